@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import signal
+import time
+import uuid
+from http import HTTPStatus
+
+import codec
+import metrics
+from api import method_handler_async, health_handler, metrics_handler, build_response, response_headers, \
+    request_deadline, MainHTTPHandler, REQUEST_TIMEOUT
+from logs import AccessLog
+from status_codes import OK, BAD_REQUEST, NOT_FOUND, INTERNAL_ERROR
+from timing import timed, request_context
+from tracing import Tracer
+
+MAX_HEADERS_SIZE = 64 * 1024
+
+
+class AsyncHTTPServer:
+    """asyncio alternative to api.MainHTTPHandler sharing its routing and validation"""
+    router = {
+        "method": method_handler_async,
+    }
+    get_router = {
+        "_health": health_handler,
+        "_metrics": metrics_handler,
+    }
+
+    def __init__(self, store, request_timeout=REQUEST_TIMEOUT):
+        self.store = store
+        self.request_timeout = request_timeout
+
+    async def handle_connection(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, path, _ = request_line.split(' ', 2)
+            headers = {}
+            for line in header_lines:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            body = b''
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+
+        if method == 'GET':
+            code, content_type, payload = self.do_get(path)
+            extra = {}
+        elif method == 'POST':
+            code, content_type, payload, extra = await self.do_post(path, headers, body)
+        else:
+            code, content_type, payload, extra = NOT_FOUND, 'text/html', b'', {}
+        try:
+            writer.write(b''.join([
+                b'HTTP/1.0 %d %s\r\n' % (code, HTTPStatus(code).phrase.encode('ascii')),
+                b'Content-Type: %s\r\n' % content_type.encode('ascii'),
+                b''.join(b'%s: %s\r\n' % (name.encode('ascii'), value.encode('ascii'))
+                         for name, value in extra.items()),
+                b'Content-Length: %d\r\n\r\n' % len(payload),
+                payload,
+            ]))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def do_get(self, path):
+        path = path.strip("/")
+        if path in self.get_router:
+            response, code = self.get_router[path]()
+        else:
+            response, code = '', NOT_FOUND
+        return code, MainHTTPHandler.content_types.get(path, 'text/html'), response.encode('utf-8')
+
+    async def do_post(self, path, headers, body):
+        started = time.perf_counter()
+        response, code = {}, OK
+        request_id = headers.get('x-request-id') or headers.get('http_x_request_id') or uuid.uuid4().hex
+        context = {"request_id": request_id, "_started": started}
+        deadline = request_deadline(time.monotonic(), headers.get('x-request-timeout'), self.request_timeout)
+        if deadline is not None:
+            context["deadline"] = deadline
+        # every connection runs in its own task, so the context var is per request
+        request_context.set(context)
+        request = None
+        try:
+            with timed(context, "parse"):
+                request = codec.loads(body)
+        except ValueError:
+            code = BAD_REQUEST
+
+        if request:
+            route = path.strip("/")
+            if route in self.router:
+                try:
+                    response, code = await self.router[route]({"body": request, "headers": headers},
+                                                              context, self.store)
+                except Exception as e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+            else:
+                code = NOT_FOUND
+
+        r = build_response(response, code)
+        context.update(r)
+        AccessLog.log(path, context, body if request else None)
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(context, code, elapsed)
+        Tracer.export(path, context, code, elapsed)
+        return code, 'application/json', codec.dumps(r), response_headers(context, code)
+
+
+async def serve(address, port, store, request_timeout=REQUEST_TIMEOUT):
+    app = AsyncHTTPServer(store, request_timeout)
+    server = await asyncio.start_server(app.handle_connection, address, port, limit=MAX_HEADERS_SIZE)
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+    async with server:
+        await stopped.wait()
+    store.close()
+
+
+def run(address, port, store, request_timeout=REQUEST_TIMEOUT):
+    asyncio.run(serve(address, port, store, request_timeout))
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import time
+from functools import wraps
+
+from redis.exceptions import TimeoutError, ConnectionError, ResponseError
+
+from exceptions import StoreGetException
+from store import chunks, observe_store_call
+from timing import remaining, check_deadline, capped_timeout
+
+
+def async_retry(tries=3, delay=0.1, backoff=2, max_delay=2):
+    """Retry on redis connection errors, no attempt starts or sleep outlasts the request deadline"""
+    def deco_retry(f):
+        op = f.__name__.replace('_with_retry', '')
+
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            local_tries, local_delay = tries, delay
+            while local_tries > 0:
+                check_deadline()
+                start = time.perf_counter()
+                try:
+                    result = await f(*args, **kwargs)
+                    observe_store_call(op, time.perf_counter() - start)
+                    return result
+                except (TimeoutError, ConnectionError) as e:
+                    observe_store_call(op, time.perf_counter() - start)
+                    left = remaining()
+                    if left is not None and left <= local_delay:
+                        raise
+                    msg = '{}, Retrying in {} seconds...'.format(e, local_delay)
+                    logging.info(msg)
+                    await asyncio.sleep(local_delay)
+                    local_tries -= 1
+                    local_delay = min(local_delay * backoff, max_delay)
+            check_deadline()
+            return await f(*args, **kwargs)
+
+        return wrapper
+
+    return deco_retry
+
+
+class AsyncConnection:
+    """Single Redis connection speaking RESP over asyncio streams"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), capped_timeout(self.timeout))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timeout connecting to {self.host}:{self.port}")
+        except OSError as e:
+            raise ConnectionError(f"Error connecting to {self.host}:{self.port}. {e}")
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    @staticmethod
+    def pack(*args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def execute(self, *args):
+        return (await self.execute_many([args]))[0]
+
+    async def execute_many(self, commands):
+        """Send all commands before reading any reply: one round trip for the whole pipeline"""
+        if self._writer is None:
+            await self.connect()
+        try:
+            self._writer.write(b''.join(self.pack(*args) for args in commands))
+            await self._writer.drain()
+            return await asyncio.wait_for(self._read_replies(len(commands)), capped_timeout(self.timeout))
+        except asyncio.TimeoutError:
+            self.close()
+            raise TimeoutError("Timeout reading from socket")
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.close()
+            raise ConnectionError(f"Error while reading from socket: {e}")
+
+    async def _read_replies(self, count):
+        return [await self._read_reply() for _ in range(count)]
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b'\r\n')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise ResponseError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Protocol error, got {line!r}")
+
+
+class AsyncBaseStore:
+    """Strict reads on top of cache_get/cache_get_many provided by subclasses"""
+
+    async def get(self, name):
+        value = await self.cache_get(name)
+        if not value:
+            check_deadline()
+            raise StoreGetException(f"Can not get value from store by key {name}")
+        return value
+
+    async def get_many(self, names):
+        values = await self.cache_get_many(names)
+        missing = [name for name, value in values.items() if not value]
+        if missing:
+            check_deadline()
+            raise StoreGetException(f"Can not get values from store by keys {', '.join(missing)}")
+        return values
+
+    async def cache_get(self, name):
+        raise NotImplementedError
+
+    async def cache_get_many(self, names):
+        raise NotImplementedError
+
+
+class AsyncStore(AsyncBaseStore):
+    """Non-blocking counterpart of store.Store for the asyncio engine"""
+    SOCKET_TIMEOUT = 5
+    CHUNK_SIZE = 500
+
+    def __init__(self, host='localhost', port=6379, max_connections=64, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def execute(self, *args):
+        return (await self.execute_many([args]))[0]
+
+    async def execute_many(self, commands):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else AsyncConnection(self.host, self.port, self.SOCKET_TIMEOUT)
+            try:
+                result = await conn.execute_many(commands)
+            except Exception:
+                conn.close()
+                raise
+            self._idle.append(conn)
+            return result
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def cache_get_many(self, names):
+        names = list(names)
+        if not names:
+            return {}
+        try:
+            return dict(zip(names, await self.get_many_with_retry(names)))
+        except Exception as e:
+            logging.error(str(e))
+            return dict.fromkeys(names)
+
+    async def cache_get(self, name):
+        try:
+            return await self.get_with_retry(name)
+        except Exception as e:
+            logging.error(str(e))
+            return None
+
+    async def cache_set(self, key, value, ttl=None):
+        try:
+            await self.set_with_retry(key, value, ttl)
+        except Exception as e:
+            logging.error(str(e))
+
+    async def cache_set_many(self, items, ttl=None):
+        try:
+            await self.set_many_with_retry(items, ttl)
+        except Exception as e:
+            logging.error(str(e))
+
+    @staticmethod
+    def set_command(key, value, ttl=None):
+        if ttl:
+            return 'SET', key, value, 'EX', ttl
+        return 'SET', key, value
+
+    @async_retry(tries=3)
+    async def set_with_retry(self, key, value, ttl=None):
+        await self.execute(*self.set_command(key, value, ttl))
+
+    @async_retry(tries=3)
+    async def set_many_with_retry(self, items, ttl=None):
+        await self.execute_many([self.set_command(key, value, ttl) for key, value in items.items()])
+
+    @async_retry(tries=3)
+    async def get_with_retry(self, name):
+        return await self.execute('GET', name)
+
+    @async_retry(tries=3)
+    async def get_many_with_retry(self, names):
+        replies = await asyncio.gather(*(self.execute('MGET', *chunk) for chunk in chunks(names, self.chunk_size)))
+        return [value for values in replies for value in values]
+
+
+class AsyncPrefetchedStore(AsyncBaseStore):
+    """Async counterpart of store.PrefetchedStore"""
+
+    def __init__(self, store, values):
+        self.store = store
+        self.values = values
+
+    async def cache_get(self, name):
+        if name in self.values:
+            return self.values[name]
+        return await self.store.cache_get(name)
+
+    async def cache_get_many(self, names):
+        values = {name: self.values[name] for name in names if name in self.values}
+        rest = [name for name in names if name not in self.values]
+        if rest:
+            values.update(await self.store.cache_get_many(rest))
+        return values
+
+    async def cache_set(self, key, value, ttl=None):
+        self.values[key] = str(value)
+        await self.store.cache_set(key, value, ttl)
+
+    async def cache_set_many(self, items, ttl=None):
+        self.values.update((key, str(value)) for key, value in items.items())
+        await self.store.cache_set_many(items, ttl)
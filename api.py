@@ -1,14 +1,33 @@
 import datetime
+import functools
 import hashlib
-import json
+import hmac
 import logging
+import math
+import sys
+import time
 import uuid
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from optparse import OptionParser
 
-from handlers import OnlineScoreHandler, ClientsInterestsHandler, BaseRequest
-from status_codes import ERRORS, INVALID_REQUEST, INTERNAL_ERROR, NOT_FOUND, BAD_REQUEST, FORBIDDEN, OK
-from store import Store
+import codec
+import metrics
+from aio_store import AsyncPrefetchedStore
+from backends import MemoryBackend, RedisBackend
+from cache import LocalCache, DEFAULT_TTL_POLICY
+from handlers import OnlineScoreHandler, OnlineScoreBatchHandler, ClientsInterestsHandler, BaseRequest, RequestHandler
+from logs import AccessLog, setup_logging
+from overload import OverloadController
+from ratelimit import RateLimiter
+from scoring import InterestsDictionary
+from snapshot import SnapshotBackend
+from server import make_server, serve_forever, PreforkServer
+from exceptions import DeadlineExceeded
+from status_codes import ERRORS, INVALID_REQUEST, INTERNAL_ERROR, NOT_FOUND, BAD_REQUEST, FORBIDDEN, OK, \
+    TOO_MANY_REQUESTS, GATEWAY_TIMEOUT, SERVICE_UNAVAILABLE
+from store import Store, PrefetchedStore, CircuitBreaker
+from timing import timed, request_context, check_deadline, server_timing
+from tracing import Tracer, setup_tracing
 
 SALT = "Otus"
 ADMIN_SALT = "42"
@@ -22,54 +41,354 @@ GENDERS = {
 }
 
 
+AUTH_CACHE_SIZE = 4096
+# seconds a request may take unless its X-Request-Timeout header says otherwise
+REQUEST_TIMEOUT = 0.3
+
+# command line options the asyncio engine has no equivalent for
+SYNC_ONLY_OPTIONS = ("workers", "threads", "keepalive_timeout", "max_requests_per_connection", "local_cache_entries",
+                     "local_cache_bytes", "local_cache_ttl", "write_behind_size", "breaker_threshold",
+                     "breaker_reset_timeout")
+
+# (valid until timestamp, digest) of the current hour's admin token
+_admin_digest = (0.0, None)
+
+
+def admin_digest():
+    global _admin_digest
+    valid_until, digest = _admin_digest
+    now = time.time()
+    if now >= valid_until:
+        hour = datetime.datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+        msg = (hour.strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')
+        digest = hashlib.sha512(msg).hexdigest()
+        _admin_digest = ((hour + datetime.timedelta(hours=1)).timestamp(), digest)
+    return digest
+
+
+@functools.lru_cache(maxsize=AUTH_CACHE_SIZE)
+def user_digest(account, login):
+    msg = (account + login + SALT).encode('utf-8')
+    return hashlib.sha512(msg).hexdigest()
+
+
 def check_auth(request):
     if request.is_admin:
-        msg = (datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')
-        digest = hashlib.sha512(msg).hexdigest()
+        digest = admin_digest()
     else:
-        msg = (request.account + request.login + SALT).encode('utf-8')
-        digest = hashlib.sha512(msg).hexdigest()
-    if digest == request.token:
-        return True
-    return False
+        digest = user_digest(request.account, request.login)
+    return hmac.compare_digest(digest.encode('utf-8'), (request.token or '').encode('utf-8'))
 
 
-def method_handler(request, ctx, store):
-    methods_map = {
-        "online_score": OnlineScoreHandler,
-        "clients_interests": ClientsInterestsHandler,
-    }
+METHODS = {
+    "online_score": OnlineScoreHandler,
+    "online_score_batch": OnlineScoreBatchHandler,
+    "clients_interests": ClientsInterestsHandler,
+}
+MAX_BATCH_SIZE = 1000
+
+
+def prepare_method(request, ctx):
+    """Validate and authorize request body.
+
+    Returns (handler, base_request, None) on success or (None, None, (response, code)) on error,
+    so the sync and async engines run exactly the same checks.
+    """
     base_request = BaseRequest(request["body"])
-    base_request.validate()
+    with timed(ctx, "validate"):
+        base_request.validate()
     if not base_request.is_valid():
-        return base_request.errors_str(), INVALID_REQUEST
-    if not check_auth(base_request):
-        return None, FORBIDDEN
-    method = methods_map.get(base_request.method)
+        return None, None, (base_request.errors_str(), INVALID_REQUEST)
+    ctx["method"] = base_request.method
+    with timed(ctx, "auth"):
+        authorized = check_auth(base_request)
+    if not authorized:
+        return None, None, (None, FORBIDDEN)
+    method = METHODS.get(base_request.method)
     if not method:
-        return "Method Not Found", NOT_FOUND
+        return None, None, ("Method Not Found", NOT_FOUND)
+    return method(), base_request, None
+
+
+def request_deadline(started, header, default=REQUEST_TIMEOUT):
+    """time.monotonic() deadline of a request started at `started`, None when it has no time budget.
 
-    response, code = method().validate_handle(is_admin=base_request.is_admin,
-                                              request=method.request_type(base_request.arguments),
-                                              ctx=ctx,
-                                              store=store)
+    header is the X-Request-Timeout value in seconds. It can only shorten the default budget:
+    missing, malformed, non-positive or longer values give the default.
+    """
+    timeout = default
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = None
+        if requested is not None and 0 < requested < (default or math.inf):
+            timeout = requested
+    if not timeout or timeout <= 0:
+        return None
+    return started + timeout
+
+
+def admit(handler, base_request, method_request, ctx):
+    """Charge the caller's rate limit and take an in-flight slot of the method.
+
+    Returns None when the request may run, release() must follow its handling then;
+    (response, code) with ctx["retry_after"] set otherwise.
+    """
+    if handler.limiter is None:
+        return None
+    caller = "%s/%s" % (base_request.account or "", base_request.login or "")
+    wait, limit = handler.limiter.admit(caller, base_request.method, handler.cost(method_request))
+    if not wait:
+        return None
+    metrics.RATE_LIMITED.inc(base_request.method, limit)
+    ctx["retry_after"] = max(1, math.ceil(wait))
+    return f"Too many requests, {limit} limit exceeded", TOO_MANY_REQUESTS
+
+
+def release(handler, base_request):
+    if handler.limiter is not None:
+        handler.limiter.leave(base_request.method)
+
+
+def release_batch(items):
+    for _, handler, base_request, _, error in items:
+        if not error:
+            release(handler, base_request)
+
+
+def prepare_batch(request, ctx):
+    """Validate every envelope of a batch request.
+
+    Returns items of (item_ctx, handler, base_request, method_request, error) and the
+    store keys the valid items are going to read, without duplicates. An element that
+    fails unexpectedly gets an internal error of its own, the others are still served.
+    """
+    items, keys = [], []
+    ctx["batch"] = []
+    try:
+        for body in request["body"]:
+            item_ctx = {}
+            ctx["batch"].append(item_ctx)
+            if not isinstance(body, dict):
+                items.append((item_ctx, None, None, None, ("Request should be an object", INVALID_REQUEST)))
+                continue
+            try:
+                handler, base_request, error = prepare_method({"body": body, "headers": request["headers"]}, ctx)
+                method_request, item_keys = None, ()
+                if not error:
+                    method_request = handler.request_type(base_request.arguments)
+                    with timed(ctx, "validate"):
+                        error = handler.validate(method_request)
+                if not error:
+                    item_keys = handler.store_keys(base_request.is_admin, method_request)
+                # admission comes last: nothing after it can fail and leave its slot taken
+                if not error:
+                    error = admit(handler, base_request, method_request, item_ctx)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                items.append((item_ctx, None, None, None, (None, INTERNAL_ERROR)))
+                continue
+            items.append((item_ctx, handler, base_request, method_request, error))
+            if not error:
+                keys.extend(item_keys)
+    except BaseException:
+        # the caller releases nothing when preparation fails
+        release_batch(items)
+        raise
+    ctx["method"] = "batch"
+    return items, list(dict.fromkeys(keys))
+
+
+def method_handler(request, ctx, store):
+    if isinstance(request["body"], list):
+        return batch_method_handler(request, ctx, store)
+    handler, base_request, error = prepare_method(request, ctx)
+    if error:
+        return error
+    method_request = handler.request_type(base_request.arguments)
+    with timed(ctx, "validate"):
+        error = handler.validate(method_request)
+    if error:
+        return error
+    error = admit(handler, base_request, method_request, ctx)
+    if error:
+        return error
+    try:
+        with timed(ctx, "handler"):
+            check_deadline(ctx)
+            response, code = handler.handle(base_request.is_admin, method_request, ctx, store)
+    except DeadlineExceeded as e:
+        return str(e), GATEWAY_TIMEOUT
+    finally:
+        release(handler, base_request)
     return response, code
 
 
+def batch_method_handler(request, ctx, store):
+    if len(request["body"]) > MAX_BATCH_SIZE:
+        return f"Batch should contain at most {MAX_BATCH_SIZE} requests", INVALID_REQUEST
+    items, keys = prepare_batch(request, ctx)
+    try:
+        store = PrefetchedStore(store, store.cache_get_many(keys))
+        results = []
+        with timed(ctx, "handler"):
+            for item_ctx, handler, base_request, method_request, error in items:
+                if error:
+                    response, code = error
+                else:
+                    try:
+                        # items handled before the deadline keep their results
+                        check_deadline(ctx)
+                        response, code = handler.handle(base_request.is_admin, method_request, item_ctx, store)
+                    except DeadlineExceeded as e:
+                        response, code = str(e), GATEWAY_TIMEOUT
+                    except Exception as e:
+                        logging.exception("Unexpected error: %s" % e)
+                        response, code = None, INTERNAL_ERROR
+                results.append(build_response(response, code))
+    finally:
+        release_batch(items)
+    return results, OK
+
+
+async def method_handler_async(request, ctx, store):
+    if isinstance(request["body"], list):
+        return await batch_method_handler_async(request, ctx, store)
+    handler, base_request, error = prepare_method(request, ctx)
+    if error:
+        return error
+    method_request = handler.request_type(base_request.arguments)
+    with timed(ctx, "validate"):
+        error = handler.validate(method_request)
+    if error:
+        return error
+    error = admit(handler, base_request, method_request, ctx)
+    if error:
+        return error
+    try:
+        with timed(ctx, "handler"):
+            check_deadline(ctx)
+            response, code = await handler.handle_async(base_request.is_admin, method_request, ctx, store)
+    except DeadlineExceeded as e:
+        return str(e), GATEWAY_TIMEOUT
+    finally:
+        release(handler, base_request)
+    return response, code
+
+
+async def batch_method_handler_async(request, ctx, store):
+    if len(request["body"]) > MAX_BATCH_SIZE:
+        return f"Batch should contain at most {MAX_BATCH_SIZE} requests", INVALID_REQUEST
+    items, keys = prepare_batch(request, ctx)
+    try:
+        store = AsyncPrefetchedStore(store, await store.cache_get_many(keys))
+        results = []
+        with timed(ctx, "handler"):
+            for item_ctx, handler, base_request, method_request, error in items:
+                if error:
+                    response, code = error
+                else:
+                    try:
+                        check_deadline(ctx)
+                        response, code = await handler.handle_async(base_request.is_admin, method_request, item_ctx,
+                                                                    store)
+                    except DeadlineExceeded as e:
+                        response, code = str(e), GATEWAY_TIMEOUT
+                    except Exception as e:
+                        logging.exception("Unexpected error: %s" % e)
+                        response, code = None, INTERNAL_ERROR
+                results.append(build_response(response, code))
+    finally:
+        release_batch(items)
+    return results, OK
+
+
+def metrics_handler():
+    return metrics.REGISTRY.render(), OK
+
+
 def health_handler():
     return '', OK
 
 
+def response_headers(ctx, code):
+    headers = {}
+    if "_started" in ctx:
+        headers["Server-Timing"] = server_timing(ctx, time.perf_counter() - ctx["_started"])
+    if code == TOO_MANY_REQUESTS and "retry_after" in ctx:
+        headers["Retry-After"] = str(ctx["retry_after"])
+    return headers
+
+
+def build_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
+# answer to requests shed by the overload controller, encoded once
+SHED_RESPONSE = codec.dumps(build_response(None, SERVICE_UNAVAILABLE))
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
         "method": method_handler,
-        "_health": health_handler
+        "_health": health_handler,
+        "_metrics": metrics_handler,
+    }
+    content_types = {
+        "_metrics": "text/plain; version=0.0.4",
     }
 
     store = None
+    # default time budget of a request in seconds, 0 for none
+    request_timeout = REQUEST_TIMEOUT
+    # overload.OverloadController guarding /method/, None takes all requests
+    overload = None
+
+    # persistent connections: every response carries Content-Length, idle
+    # connections are dropped after `timeout` seconds; servers with a
+    # keep_alive() method decide per response whether to keep one open
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    max_requests_per_connection = 1000
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+
+    def handle_one_request(self):
+        self.requests_served += 1
+        super().handle_one_request()
+
+    def send_body(self, code, content_type, body, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.requests_served >= self.max_requests_per_connection:
+            self.close_connection = True
+        keep_alive = getattr(self.server, 'keep_alive', None)
+        if keep_alive is not None and not keep_alive():
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # request lines go through the queued logging, not straight to stderr
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+    def log_error(self, format, *args):
+        logging.warning("%s - %s" % (self.address_string(), format % args))
 
     def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+        # the id a client sent lets it find its request in logs and traces
+        return headers.get('X-Request-Id') or headers.get('HTTP_X_REQUEST_ID') or uuid.uuid4().hex
 
     def do_GET(self):
         response, code = '', OK
@@ -78,24 +397,54 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             response, code = self.router[self.path.strip("/")]()
         else:
             code = NOT_FOUND
-        self.send_response(code)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        self.send_body(code, self.content_types.get(path, 'text/html'), response.encode('utf-8'))
 
     def do_POST(self):
+        started = time.perf_counter()
+        overload = self.overload if self.path.strip("/") == "method" else None
+        if overload is not None:
+            reason = overload.check(self.server)
+            if reason:
+                self.shed(reason, started)
+                return
+            overload.enter()
+        try:
+            self.handle_post(started)
+        finally:
+            if overload is not None:
+                overload.leave(time.perf_counter() - started)
+
+    def shed(self, reason, started):
+        """Cheap 503: the body is skipped without parsing and nothing is logged per request"""
+        metrics.OVERLOAD_SHED.inc(reason)
+        try:
+            self.rfile.read(int(self.headers['Content-Length']))
+        except (TypeError, ValueError):
+            self.close_connection = True
+        self.send_body(SERVICE_UNAVAILABLE, "application/json", SHED_RESPONSE, {"Retry-After": "1"})
+        metrics.observe_request({}, SERVICE_UNAVAILABLE, time.perf_counter() - started)
+
+    def handle_post(self, started):
         response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
-        request = None
+        context = {"request_id": self.get_request_id(self.headers), "_started": started}
+        deadline = request_deadline(time.monotonic(), self.headers.get('X-Request-Timeout'), self.request_timeout)
+        if deadline is not None:
+            context["deadline"] = deadline
+        context_token = request_context.set(context)
+        request, data_string = None, None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
-        except:
+            with timed(context, "read"):
+                data_string = self.rfile.read(int(self.headers['Content-Length']))
+            with timed(context, "parse"):
+                request = codec.loads(data_string)
+        except Exception as e:
             code = BAD_REQUEST
+            if not isinstance(e, codec.DecodeError):
+                # body framing is unknown, the rest of the stream can not be trusted
+                self.close_connection = True
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
             if path in self.router:
                 try:
                     response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
@@ -104,17 +453,15 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
                     code = INTERNAL_ERROR
             else:
                 code = NOT_FOUND
+        request_context.reset(context_token)
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+        r = build_response(response, code)
+        self.send_body(code, "application/json", codec.dumps(r), response_headers(context, code))
         context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode('utf-8'))
+        AccessLog.log(self.path, context, data_string if request else None)
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(context, code, elapsed)
+        Tracer.export(self.path, context, code, elapsed)
         return
 
 
@@ -123,17 +470,135 @@ if __name__ == "__main__":
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-a", "--address", action="store", type=str, default='localhost')
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--log_queue_size", action="store", type=int, default=10000,
+                  help="log records buffered for the writer thread, the rest is dropped")
+    op.add_option("--log_body_sample", action="store", type=float, default=1.0,
+                  help="share of access log entries that include the request body")
+    op.add_option("--trace_file", action="store", default=None,
+                  help="append request spans to this file as OTLP/JSON, for an OpenTelemetry collector")
+    op.add_option("--trace_sample", action="store", type=float, default=1.0,
+                  help="share of requests exported to --trace_file")
+    op.add_option("--store", action="store", type="choice", choices=["redis", "memory"], default="redis",
+                  help="memory keeps data in the process, every worker has its own copy")
+    op.add_option("--memory_store_bytes", action="store", type=int, default=0,
+                  help="memory limit of --store memory, 0 means unlimited")
+    op.add_option("--interests_snapshot", action="store", default=None,
+                  help="serve interests from this snapshot file (see snapshot.py), reloaded when it is replaced")
     op.add_option("--cache_host", action="store", type=str, default='localhost')
     op.add_option("--cache_port", action="store", type=int, default=6379)
+    op.add_option("--cache_chunk_size", action="store", type=int, default=Store.CHUNK_SIZE)
+    op.add_option("--write_behind_size", action="store", type=int, default=10000,
+                  help="cache writes waiting for the background writer, 0 writes synchronously")
+    op.add_option("--breaker_threshold", action="store", type=int, default=5,
+                  help="consecutive redis failures that open the circuit breaker")
+    op.add_option("--breaker_reset_timeout", action="store", type=float, default=5,
+                  help="seconds to fail fast before probing redis again")
+    op.add_option("--local_cache_entries", action="store", type=int, default=0,
+                  help="size of in-process cache in front of redis, 0 disables it")
+    op.add_option("--local_cache_bytes", action="store", type=int, default=64 * 1024 * 1024)
+    op.add_option("--local_cache_ttl", action="append", default=[], metavar="PREFIX=SECONDS",
+                  help="local TTL for keys with the given prefix, may be repeated")
+    op.add_option("--raw_interests", action="store_true", default=False,
+                  help="copy stored interests JSON into responses without decoding it")
+    op.add_option("--raw_interests_validate", action="store", type=float,
+                  default=ClientsInterestsHandler.raw_validate_rate,
+                  help="share of raw interests values that are still decoded to check them")
+    op.add_option("--interests_layout", action="store", type="choice", choices=["json", "compact"], default="json",
+                  help="compact reads interests from bucket hashes first, falling back to JSON keys")
+    op.add_option("--rate_limit", action="store", type=float, default=0,
+                  help="cost units per second per account and login (a client id or record each), 0 disables limits")
+    op.add_option("--rate_limit_burst", action="store", type=float, default=None,
+                  help="cost units a caller may spend at once, --rate_limit by default")
+    op.add_option("--max_concurrency", action="append", default=[], metavar="METHOD=N",
+                  help="requests of the method served at the same time by all workers, may be repeated")
+    op.add_option("--request_timeout", action="store", type=float, default=REQUEST_TIMEOUT,
+                  help="seconds a request may take, its X-Request-Timeout header may only shorten that, "
+                       "0 for no limit")
+    op.add_option("--overload_max_in_flight", action="store", type=int, default=0,
+                  help="requests a worker handles at once before it sheds new ones with 503, 0 disables")
+    op.add_option("--overload_max_queue_wait", action="store", type=float, default=0,
+                  help="seconds a connection may wait for a thread before new requests are shed, 0 disables")
+    op.add_option("--overload_max_p99", action="store", type=float, default=0,
+                  help="p99 latency in seconds over the last 10s above which requests are shed, 0 disables")
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("-t", "--threads", action="store", type=int, default=1)
+    op.add_option("--keepalive_timeout", action="store", type=int, default=MainHTTPHandler.timeout)
+    op.add_option("--max_requests_per_connection", action="store", type=int,
+                  default=MainHTTPHandler.max_requests_per_connection)
+    op.add_option("-e", "--engine", action="store", type="choice", choices=["sync", "asyncio"], default="sync")
     (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    store = Store(host=opts.cache_host, port=opts.cache_port)
-    MainHTTPHandler.store = store
-    server = HTTPServer((opts.address, opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    setup_logging(filename=opts.log, queue_size=opts.log_queue_size, body_sample_rate=opts.log_body_sample)
+    if opts.trace_file:
+        setup_tracing(opts.trace_file, queue_size=opts.log_queue_size, sample_rate=opts.trace_sample)
+    ClientsInterestsHandler.raw_interests = opts.raw_interests
+    ClientsInterestsHandler.raw_validate_rate = opts.raw_interests_validate
+    if opts.rate_limit or opts.max_concurrency:
+        max_concurrency = {}
+        for rule in opts.max_concurrency:
+            method, limit = rule.split("=", 1)
+            max_concurrency[method] = int(limit)
+        # created before the workers fork, so they share the buckets
+        RequestHandler.limiter = RateLimiter(opts.rate_limit, opts.rate_limit_burst, max_concurrency,
+                                             workers=opts.workers)
+    if opts.engine == "asyncio" and (opts.store != "redis" or opts.interests_layout != "json" or
+                                     opts.interests_snapshot):
+        op.error("--engine asyncio supports only --store redis and --interests_layout json without a snapshot")
+    overload_limits = (opts.overload_max_in_flight, opts.overload_max_queue_wait, opts.overload_max_p99)
+    if opts.engine == "asyncio" and any(overload_limits):
+        op.error("--overload_* options are supported by the sync engine only")
+    if opts.engine == "asyncio":
+        defaults = op.get_default_values()
+        sync_only = [name for name in SYNC_ONLY_OPTIONS if getattr(opts, name) != getattr(defaults, name)]
+        if sync_only:
+            op.error("--engine asyncio serves one process without %s" % ", ".join("--" + name for name in sync_only))
+    if opts.engine == "asyncio":
+        import aio_api
+        from aio_store import AsyncStore
+
+        logging.info("Starting asyncio server at %s" % opts.port)
+        store = AsyncStore(host=opts.cache_host, port=opts.cache_port, chunk_size=opts.cache_chunk_size)
+        aio_api.run(opts.address, opts.port, store, opts.request_timeout)
+    else:
+        local_cache = None
+        if opts.local_cache_entries:
+            ttl_policy = dict(DEFAULT_TTL_POLICY)
+            for rule in opts.local_cache_ttl:
+                prefix, ttl = rule.split("=", 1)
+                ttl_policy[prefix] = int(ttl)
+            local_cache = LocalCache(max_entries=opts.local_cache_entries, max_bytes=opts.local_cache_bytes,
+                                     ttl_policy=ttl_policy)
+        breaker = CircuitBreaker(failure_threshold=opts.breaker_threshold, reset_timeout=opts.breaker_reset_timeout)
+        backend = None
+        if opts.store == "memory":
+            backend = MemoryBackend(max_bytes=opts.memory_store_bytes)
+        if opts.interests_snapshot:
+            if backend is None:
+                backend = RedisBackend(host=opts.cache_host, port=opts.cache_port, chunk_size=opts.cache_chunk_size)
+            backend = SnapshotBackend(opts.interests_snapshot, backend)
+        store = Store(host=opts.cache_host, port=opts.cache_port, chunk_size=opts.cache_chunk_size,
+                      local_cache=local_cache, breaker=breaker, backend=backend,
+                      write_behind_size=opts.write_behind_size)
+        if opts.interests_layout == "compact":
+            ClientsInterestsHandler.interests_dictionary = InterestsDictionary(store)
+        MainHTTPHandler.store = store
+        MainHTTPHandler.timeout = opts.keepalive_timeout
+        MainHTTPHandler.request_timeout = opts.request_timeout
+        if any(overload_limits):
+            # every worker watches its own load
+            MainHTTPHandler.overload = OverloadController(*overload_limits)
+        MainHTTPHandler.max_requests_per_connection = opts.max_requests_per_connection
+        logging.info("Starting server at %s with %s worker(s) x %s thread(s)" %
+                     (opts.port, opts.workers, opts.threads))
+        if opts.workers > 1:
+            limiter = RequestHandler.limiter
+            server = PreforkServer(opts.address, opts.port, MainHTTPHandler,
+                                   workers=opts.workers, threads=opts.threads, on_exit=store.close,
+                                   on_worker_exit=limiter.forget if limiter is not None else None)
+            server.serve_forever()
+            if server.failed:
+                sys.exit(1)
+        else:
+            try:
+                serve_forever(make_server(opts.address, opts.port, MainHTTPHandler, threads=opts.threads))
+            finally:
+                store.close()
@@ -0,0 +1,244 @@
+import fnmatch
+import heapq
+import sys
+import threading
+import time
+
+import redis
+
+from exceptions import StoreFullException
+from timing import capped_timeout
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def as_str(value):
+    """Value as redis returns it with decode_responses"""
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+class DeadlineConnection(redis.Connection):
+    """Redis connection whose socket timeout is cut to the time left for the current request"""
+
+    def _apply_deadline(self):
+        if self._sock is not None:
+            self._sock.settimeout(capped_timeout(self.socket_timeout))
+
+    def _connect(self):
+        # the connect timeout falls back to socket_timeout, cut it like reads and writes
+        connect_timeout = self.socket_connect_timeout
+        self.socket_connect_timeout = capped_timeout(connect_timeout)
+        try:
+            return super()._connect()
+        finally:
+            self.socket_connect_timeout = connect_timeout
+
+    def send_packed_command(self, command, check_health=True):
+        if not self._sock:
+            self.connect()
+        self._apply_deadline()
+        super().send_packed_command(command, check_health)
+
+    def read_response(self, *args, **kwargs):
+        self._apply_deadline()
+        return super().read_response(*args, **kwargs)
+
+
+class RedisBackend:
+    """Key-value backend on a redis server"""
+    SOCKET_TIMEOUT = 5
+
+    def __init__(self, host='localhost', port=6379, chunk_size=500, socket_timeout=SOCKET_TIMEOUT):
+        self.chunk_size = chunk_size
+        pool = redis.ConnectionPool(host=host,
+                                    port=port,
+                                    decode_responses=True,
+                                    socket_timeout=socket_timeout,
+                                    connection_class=DeadlineConnection)
+        self.client = redis.Redis(connection_pool=pool)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def get_many(self, keys):
+        # several bounded MGETs in one pipeline: a single round trip
+        # without a huge command blocking redis
+        pipe = self.client.pipeline(transaction=False)
+        for chunk in chunks(keys, self.chunk_size):
+            pipe.mget(chunk)
+        return [value for values in pipe.execute() for value in values]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(name=key, value=value, ex=ttl)
+
+    def set_many(self, items, ttl=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(name=key, value=value, ex=ttl)
+        pipe.execute()
+
+    def delete_many(self, keys):
+        pipe = self.client.pipeline(transaction=False)
+        for chunk in chunks(keys, self.chunk_size):
+            pipe.delete(*chunk)
+        pipe.execute()
+
+    def scan(self, match, count=1000):
+        return self.client.scan_iter(match=match, count=count)
+
+    def hgetall(self, key):
+        return self.client.hgetall(key)
+
+    def hmget_many(self, requests):
+        """[(key, [field, ...]), ...] -> [[value, ...], ...] in one round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        for key, fields in requests:
+            pipe.hmget(key, fields)
+        return pipe.execute()
+
+    def hset_many(self, hashes):
+        """Set fields of several hashes, {key: {field: value}}, in one round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        for key, mapping in hashes.items():
+            pipe.hset(key, mapping=mapping)
+        pipe.execute()
+
+
+class MemoryBackend:
+    """Key-value backend in process memory, for runs without redis.
+
+    Values are kept as strings, like redis returns them, hashes as dicts of strings. Expired keys are removed
+    when read and by a sweep that runs on writes at most every sweep_interval
+    seconds. With max_bytes set, writes that do not fit raise StoreFullException.
+    The data is not shared between processes: every pre-fork worker has its own copy.
+    """
+
+    def __init__(self, max_bytes=0, sweep_interval=1):
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.size_bytes = 0
+        self.expired = 0
+        self._data = {}
+        # (expires_at, key) of keys with a TTL, entries for overwritten keys are skipped on sweep
+        self._expiry = []
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key, time.monotonic())
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return [self._get(key, now) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items, ttl=None):
+        now = time.monotonic()
+        expires_at = now + ttl if ttl else None
+        entries = {}
+        for key, value in items.items():
+            value = as_str(value)
+            entries[key] = (value, expires_at, sys.getsizeof(key) + sys.getsizeof(value))
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            self._check_size(entries)
+            for key, entry in entries.items():
+                self._put(key, entry)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._remove(key)
+
+    def scan(self, match, count=1000):
+        with self._lock:
+            keys = [key for key in self._data if fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, time.monotonic()) or {})
+
+    def hmget_many(self, requests):
+        now = time.monotonic()
+        with self._lock:
+            hashes = [self._get(key, now) or {} for key, _ in requests]
+            return [[mapping.get(field) for field in fields] for mapping, (_, fields) in zip(hashes, requests)]
+
+    def hset_many(self, hashes):
+        now = time.monotonic()
+        with self._lock:
+            entries = {}
+            for key, fields in hashes.items():
+                mapping = dict(self._get(key, now) or {})
+                mapping.update((as_str(field), as_str(value)) for field, value in fields.items())
+                size = sys.getsizeof(key) + sys.getsizeof(mapping) + sum(
+                    sys.getsizeof(field) + sys.getsizeof(value) for field, value in mapping.items())
+                entries[key] = (mapping, None, size)
+            self._check_size(entries)
+            for key, entry in entries.items():
+                self._put(key, entry)
+
+    def _check_size(self, entries):
+        if not self.max_bytes:
+            return
+        grow = sum(entry[2] for entry in entries.values())
+        grow -= sum(self._data[key][2] for key in entries if key in self._data)
+        if self.size_bytes + grow > self.max_bytes:
+            raise StoreFullException(f"Memory store is full: {self.size_bytes} of {self.max_bytes} bytes")
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            self._remove(key)
+            self.expired += 1
+            return None
+        return entry[0]
+
+    def _put(self, key, entry):
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = entry
+        self.size_bytes += entry[2]
+        if entry[1] is not None:
+            heapq.heappush(self._expiry, (entry[1], key))
+
+    def _remove(self, key):
+        self.size_bytes -= self._data.pop(key)[2]
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key)
+                self.expired += 1
+        if len(self._expiry) > 2 * len(self._data) + 1024:
+            # overwrites leave stale heap entries behind, rebuild before they pile up
+            self._expiry = [(entry[1], key) for key, entry in self._data.items() if entry[1] is not None]
+            heapq.heapify(self._expiry)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "keys": len(self._data),
+            "bytes": self.size_bytes,
+            "expired": self.expired,
+        }
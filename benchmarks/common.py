@@ -0,0 +1,88 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class DictStore:
+    """In-process stand-in for store.Store, keeps microbenchmarks free of network time"""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def cache_get(self, name):
+        return self.data.get(name)
+
+    def cache_get_many(self, names):
+        return {name: self.data.get(name) for name in names}
+
+    def get(self, name):
+        return self.data[name]
+
+    def get_many(self, names):
+        return {name: self.data[name] for name in names}
+
+    def cache_set(self, key, value, ttl=None):
+        self.data[key] = str(value)
+
+
+def measure(fn, min_time=0.2, repeat=5):
+    """Best time per call in seconds over `repeat` runs of at least min_time each"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def metric(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, suite, results, params=None):
+    report = {
+        "suite": suite,
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": params or {},
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+def print_results(results):
+    width = max(len(name) for name in results)
+    for name, m in sorted(results.items()):
+        print(f"{name:<{width}}  {m['value']:>14.3f} {m['unit']}")
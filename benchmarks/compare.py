@@ -0,0 +1,50 @@
+"""Compare two benchmark result files and fail on regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+
+Exits with status 1 when any metric present in both files got worse by more
+than threshold percent, so it can gate a build.
+"""
+import json
+import sys
+from optparse import OptionParser
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(baseline, current, threshold):
+    """Return [(name, baseline value, current value, change %, regressed)] for metrics in both runs"""
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name]["value"], current[name]["value"]
+        if old:
+            change = (new - old) / abs(old) * 100
+        else:
+            change = 0.0 if not new else float("inf")
+        worse = -change if current[name]["higher_is_better"] else change
+        rows.append((name, old, new, change, worse > threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] BASELINE CURRENT")
+    op.add_option("-t", "--threshold", action="store", type=float, default=10,
+                  help="allowed worsening in percent")
+    op.add_option("-i", "--ignore", action="append", default=[], help="metric name prefix to skip, may be repeated")
+    (opts, args) = op.parse_args()
+    if len(args) != 2:
+        op.error("expected BASELINE and CURRENT result files")
+    baseline, current = load(args[0]), load(args[1])
+    rows = [row for row in compare(baseline, current, opts.threshold)
+            if not any(row[0].startswith(prefix) for prefix in opts.ignore)]
+    width = max([len(row[0]) for row in rows] + [4])
+    for name, old, new, change, regressed in rows:
+        print(f"{name:<{width}}  {old:>14.3f} {new:>14.3f} {change:>+8.1f}%{'  REGRESSION' if regressed else ''}")
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print("%d metric(s) regressed by more than %g%%: %s" % (len(regressions), opts.threshold,
+                                                                ", ".join(regressions)))
+        sys.exit(1)
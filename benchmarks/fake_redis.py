@@ -0,0 +1,130 @@
+"""Minimal in-memory Redis stand-in speaking RESP, enough for the scoring API.
+
+Supports HELLO (RESP2 and RESP3), PING, GET, SET [EX], MGET, DEL, HSET, HMGET, HGETALL,
+SCAN [MATCH], FLUSHDB and pipelining. Run standalone with
+    python -m benchmarks.fake_redis --port 6390
+"""
+import asyncio
+import fnmatch
+import threading
+import time
+from optparse import OptionParser
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+
+    def lookup(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    @staticmethod
+    def bulk(value, null=b'$-1\r\n'):
+        if value is None:
+            return null
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def execute(self, args, session=None):
+        """RESP reply to a command; session holds the protocol version a connection switched to with HELLO"""
+        session = {} if session is None else session
+        resp3 = session.get("protocol") == 3
+
+        def bulk(value):
+            # RESP3 has a null type of its own
+            return self.bulk(value, b'_\r\n' if resp3 else b'$-1\r\n')
+
+        command = args[0].upper()
+        if command == b'HELLO':
+            protocol = int(args[1]) if len(args) > 1 else session.get("protocol", 2)
+            if protocol not in (2, 3):
+                return b'-NOPROTO unsupported protocol version\r\n'
+            session["protocol"] = protocol
+            info = [b'server', b'redis', b'version', b'7.0.0', b'proto', protocol, b'mode', b'standalone']
+            reply = b'%%%d\r\n' % (len(info) // 2) if protocol == 3 else b'*%d\r\n' % len(info)
+            return reply + b''.join(b':%d\r\n' % x if isinstance(x, int) else self.bulk(x) for x in info)
+        if command == b'PING':
+            return b'+PONG\r\n'
+        if command == b'GET':
+            return bulk(self.lookup(args[1]))
+        if command == b'MGET':
+            return b'*%d\r\n' % (len(args) - 1) + b''.join(bulk(self.lookup(key)) for key in args[1:])
+        if command == b'SET':
+            expires_at = None
+            if len(args) > 4 and args[3].upper() == b'EX':
+                expires_at = time.monotonic() + int(args[4])
+            self.data[args[1]] = (args[2], expires_at)
+            return b'+OK\r\n'
+        if command == b'HSET':
+            mapping = self.lookup(args[1])
+            if mapping is None:
+                mapping = {}
+                self.data[args[1]] = (mapping, None)
+            added = sum(field not in mapping for field in args[2::2])
+            mapping.update(zip(args[2::2], args[3::2]))
+            return b':%d\r\n' % added
+        if command == b'HMGET':
+            mapping = self.lookup(args[1]) or {}
+            return b'*%d\r\n' % (len(args) - 2) + b''.join(bulk(mapping.get(field)) for field in args[2:])
+        if command == b'HGETALL':
+            mapping = self.lookup(args[1]) or {}
+            items = [x for item in mapping.items() for x in item]
+            header = b'%%%d\r\n' % len(mapping) if resp3 else b'*%d\r\n' % len(items)
+            return header + b''.join(bulk(x) for x in items)
+        if command == b'SCAN':
+            # the whole keyspace in one reply, cursor 0 ends the iteration
+            options = {args[i].upper(): args[i + 1] for i in range(2, len(args) - 1, 2)}
+            pattern = options.get(b'MATCH', b'*').decode('utf-8')
+            keys = [key for key in list(self.data) if fnmatch.fnmatchcase(key.decode('utf-8'), pattern)]
+            return b'*2\r\n$1\r\n0\r\n*%d\r\n' % len(keys) + b''.join(bulk(key) for key in keys)
+        if command == b'DEL':
+            return b':%d\r\n' % sum(self.data.pop(key, None) is not None for key in args[1:])
+        if command == b'FLUSHDB':
+            self.data.clear()
+            return b'+OK\r\n'
+        return b'-ERR unknown command %s\r\n' % command
+
+    async def handle(self, reader, writer):
+        session = {}
+        try:
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int((await reader.readuntil(b'\r\n'))[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self.execute(args, session))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if started:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self, host='127.0.0.1', port=6390):
+        started = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(host, port, started),), daemon=True)
+        thread.start()
+        started.wait(5)
+        return thread
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-a", "--address", action="store", type=str, default='127.0.0.1')
+    op.add_option("-p", "--port", action="store", type=int, default=6390)
+    (opts, args) = op.parse_args()
+    asyncio.run(FakeRedis().serve(opts.address, opts.port))
@@ -0,0 +1,212 @@
+"""End-to-end load generator for /method/.
+
+    python -m benchmarks.load --duration 10 --concurrency 8 --mix online_score=3,clients_interests=1 -o load.json
+
+Starts a FakeRedis stand-in and an api.py server of its own unless --url points
+to a running one, then drives it from keep-alive client threads and reports
+RPS and p50/p99 latency per method. Extra api.py options go after "--".
+"""
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from optparse import OptionParser
+
+from benchmarks.common import ROOT, metric, save_results, print_results
+from benchmarks.fake_redis import FakeRedis
+from benchmarks.micro import ACCOUNT, LOGIN, TOKEN
+
+import codec
+import scoring
+
+CLIENTS = 1000
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def preload(fake, clients=CLIENTS):
+    rnd = random.Random(0)
+    for cid in range(clients):
+        value = codec.dumps(rnd.sample(INTERESTS, 2))
+        fake.data[scoring.interests_key(cid).encode('utf-8')] = (value, None)
+
+
+def online_score_arguments(rnd, users):
+    user = rnd.randrange(users)
+    return {"phone": "7%010d" % user, "email": f"user{user}@otus.ru", "first_name": "Stan", "last_name": "Stupnikov",
+            "birthday": "01.01.1990", "gender": user % 3}
+
+
+def clients_interests_arguments(rnd, clients, batch):
+    return {"client_ids": rnd.sample(range(clients), batch)}
+
+
+def parse_mix(mix):
+    """"online_score=3,clients_interests=1" -> {"online_score": 3.0, "clients_interests": 1.0}"""
+    weights = {}
+    for part in mix.split(","):
+        method, _, weight = part.partition("=")
+        if method not in ("online_score", "clients_interests"):
+            raise ValueError(f"Unknown method in mix: {method}")
+        weights[method] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+class Worker(threading.Thread):
+    """Sends requests over one keep-alive connection until the deadline"""
+
+    def __init__(self, url, weights, deadline, seed, users, clients, batch):
+        super().__init__(daemon=True)
+        self.url = url
+        self.methods = list(weights)
+        self.weights = list(weights.values())
+        self.deadline = deadline
+        self.rnd = random.Random(seed)
+        self.users = users
+        self.clients = clients
+        self.batch = batch
+        self.latencies = {method: [] for method in self.methods}
+        self.errors = 0
+
+    def body(self, method):
+        if method == "online_score":
+            arguments = online_score_arguments(self.rnd, self.users)
+        else:
+            arguments = clients_interests_arguments(self.rnd, self.clients, self.batch)
+        return codec.dumps({"account": ACCOUNT, "login": LOGIN, "token": TOKEN, "method": method,
+                            "arguments": arguments})
+
+    def connect(self):
+        return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=10)
+
+    def run(self):
+        conn = self.connect()
+        headers = {"Content-Type": "application/json"}
+        while time.monotonic() < self.deadline:
+            method = self.rnd.choices(self.methods, self.weights)[0]
+            body = self.body(method)
+            start = time.perf_counter()
+            try:
+                conn.request("POST", self.url.path, body, headers)
+                response = conn.getresponse()
+                payload = response.read()
+                if response.status != 200 or b'"error"' in payload:
+                    self.errors += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = self.connect()
+                continue
+            self.latencies[method].append(time.perf_counter() - start)
+        conn.close()
+
+
+def start_server(port, redis_port, server_args):
+    cmd = [sys.executable, os.path.join(ROOT, "api.py"), "-a", "127.0.0.1", "-p", str(port),
+           "--cache_host", "127.0.0.1", "--cache_port", str(redis_port), "-l", os.devnull] + server_args
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("api.py did not start: %s" % " ".join(cmd))
+
+
+def run_load(url, weights, duration, concurrency, users, clients, batch, warmup=1.0):
+    url = urllib.parse.urlsplit(url)
+    if warmup:
+        warm = Worker(url, weights, time.monotonic() + warmup, -1, users, clients, batch)
+        warm.run()
+    deadline = time.monotonic() + duration
+    workers = [Worker(url, weights, deadline, seed, users, clients, batch) for seed in range(concurrency)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    results = {}
+    everything = []
+    for method in weights:
+        latencies = sorted(x for worker in workers for x in worker.latencies[method])
+        everything.extend(latencies)
+        results.update(summary(method, latencies, elapsed))
+    results.update(summary("all", sorted(everything), elapsed))
+    results["all.errors"] = metric(sum(worker.errors for worker in workers), "requests", False)
+    return results
+
+
+def summary(name, latencies, elapsed):
+    return {
+        f"{name}.rps": metric(len(latencies) / elapsed, "req/s", True),
+        f"{name}.p50": metric(percentile(latencies, 50) * 1000, "ms", False),
+        f"{name}.p99": metric(percentile(latencies, 99) * 1000, "ms", False),
+    }
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] [-- api.py options]")
+    op.add_option("-u", "--url", action="store", default=None,
+                  help="drive a running server instead of starting one, e.g. http://127.0.0.1:8080/method/")
+    op.add_option("-d", "--duration", action="store", type=float, default=10)
+    op.add_option("-c", "--concurrency", action="store", type=int, default=4, help="client connections")
+    op.add_option("-m", "--mix", action="store", default="online_score=1,clients_interests=1",
+                  help="relative weights of methods")
+    op.add_option("--users", action="store", type=int, default=10000,
+                  help="distinct online_score users, fewer users means more score cache hits")
+    op.add_option("--batch", action="store", type=int, default=5, help="client_ids per clients_interests request")
+    op.add_option("--warmup", action="store", type=float, default=1, help="seconds of unrecorded load")
+    op.add_option("-o", "--output", action="store", default=None, help="save results as JSON")
+    (opts, args) = op.parse_args()
+
+    weights = parse_mix(opts.mix)
+    proc = None
+    url = opts.url
+    if url is None:
+        fake = FakeRedis()
+        preload(fake)
+        redis_port = free_port()
+        fake.start_in_thread(port=redis_port)
+        port = free_port()
+        proc = start_server(port, redis_port, args)
+        url = f"http://127.0.0.1:{port}/method/"
+    try:
+        results = run_load(url, weights, opts.duration, opts.concurrency, opts.users, CLIENTS, opts.batch,
+                           opts.warmup)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(10)
+    print_results(results)
+    if opts.output:
+        params = {"duration": opts.duration, "concurrency": opts.concurrency, "mix": opts.mix, "users": opts.users,
+                  "batch": opts.batch, "server_args": args, "url": opts.url}
+        save_results(opts.output, "load", results, params)
+    if results["all.errors"]["value"]:
+        # latencies of a run with failed requests do not measure the server
+        print("%d requests failed" % results["all.errors"]["value"], file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,96 @@
+"""Microbenchmarks for request validation, auth and scoring hot paths.
+
+    python -m benchmarks.micro --output micro.json
+
+Store calls go to an in-process dict, so numbers do not depend on redis.
+"""
+import datetime
+import hashlib
+import logging
+import sys
+from optparse import OptionParser
+
+from benchmarks.common import DictStore, measure, metric, save_results, print_results
+
+import api
+import scoring
+from handlers import BaseRequest, OnlineScoreRequest, ClientsInterestsRequest
+
+ACCOUNT, LOGIN = "horns&hoofs", "h&f"
+TOKEN = hashlib.sha512((ACCOUNT + LOGIN + api.SALT).encode('utf-8')).hexdigest()
+SCORE_ARGS = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Stan", "last_name": "Stupnikov",
+              "birthday": "01.01.1990", "gender": 1}
+REQUEST_BODY = {"account": ACCOUNT, "login": LOGIN, "token": TOKEN, "method": "online_score", "arguments": SCORE_ARGS}
+FIELD_VALUES = {
+    OnlineScoreRequest: {
+        "first_name": "Stan",
+        "email": "stupnikov@otus.ru",
+        "phone": "79175002040",
+        "birthday": "01.01.1990",
+        "gender": 1,
+    },
+    ClientsInterestsRequest: {
+        "client_ids": list(range(10)),
+        "date": datetime.date.today().strftime("%d.%m.%Y"),
+    },
+    BaseRequest: {
+        "arguments": SCORE_ARGS,
+    },
+}
+
+
+def field_benchmarks():
+    benchmarks = {}
+    for request_type, values in FIELD_VALUES.items():
+        for name, value in values.items():
+            field = request_type.field_types[name]
+            benchmarks[f"field.{type(field).__name__}.validate"] = lambda f=field, v=value: f.validate(v)
+    return benchmarks
+
+
+def request_validate():
+    BaseRequest(REQUEST_BODY).validate()
+
+
+def benchmarks():
+    request = BaseRequest(REQUEST_BODY)
+    request.validate()
+    score_hit = DictStore()
+    scoring.get_score(score_hit, **SCORE_ARGS)
+    interests = DictStore({scoring.interests_key(1): '["books", "hi-tech"]'})
+    result = {
+        "request.BaseRequest.validate": request_validate,
+        "api.check_auth": lambda: api.check_auth(request),
+        "scoring.get_score.hit": lambda: scoring.get_score(score_hit, **SCORE_ARGS),
+        # fresh store every call, so each call computes and writes the score
+        "scoring.get_score.miss": lambda: scoring.get_score(DictStore(), **SCORE_ARGS),
+        "scoring.get_interests": lambda: scoring.get_interests(interests, 1),
+    }
+    result.update(field_benchmarks())
+    return result
+
+
+def run(names=None, min_time=0.2, repeat=5):
+    results = {}
+    for name, fn in sorted(benchmarks().items()):
+        if names and not any(name.startswith(n) for n in names):
+            continue
+        results[name] = metric(measure(fn, min_time, repeat) * 1e9, "ns/call", False)
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] [benchmark name prefix ...]")
+    op.add_option("-o", "--output", action="store", default=None, help="save results as JSON")
+    op.add_option("--min_time", action="store", type=float, default=0.2,
+                  help="seconds every timing run lasts at least")
+    op.add_option("--repeat", action="store", type=int, default=5, help="timing runs, the best one is reported")
+    (opts, args) = op.parse_args()
+    # store errors and score cache misses must not turn into logging benchmarks
+    logging.disable(logging.CRITICAL)
+    results = run(args, opts.min_time, opts.repeat)
+    if not results:
+        sys.exit("No benchmarks match %s" % " ".join(args))
+    print_results(results)
+    if opts.output:
+        save_results(opts.output, "micro", results, {"min_time": opts.min_time, "repeat": opts.repeat})
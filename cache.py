@@ -0,0 +1,158 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_TTL_POLICY = {
+    "uid:": 60,
+    "i:": 30,
+}
+
+
+class LocalCache:
+    """In-process LRU with per-entry TTL, bounded by entries and bytes.
+
+    TTL is chosen by the longest matching key prefix in ttl_policy; keys without
+    a matching prefix use default_ttl, and a TTL of 0 means the key is never cached.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl_policy=None, default_ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_policy = sorted((ttl_policy if ttl_policy is not None else DEFAULT_TTL_POLICY).items(),
+                                 key=lambda item: len(item[0]), reverse=True)
+        self.default_ttl = default_ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, key):
+        for prefix, ttl in self.ttl_policy:
+            if key.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        if self.ttl_for(key) <= 0:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        policy_ttl = self.ttl_for(key)
+        ttl = min(ttl, policy_ttl) if ttl else policy_ttl
+        if ttl <= 0 or value is None:
+            return
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl, size)
+            self.size_bytes += size
+            while len(self._data) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size_bytes = 0
+
+    def _remove(self, key):
+        self.size_bytes -= self._data.pop(key)[2]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers of the same key share its result.
+
+    do() returns (result, shared); shared is True for callers that waited on another
+    thread's call. Calls are coalesced within a process only.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+            # interrupted, waiters must not hang
+            future.cancel()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines of one event loop"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            # nobody may be waiting, do not let asyncio report it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+            # cancelled, waiters must not hang
+            future.cancel()
@@ -0,0 +1,71 @@
+"""JSON encoding used on every request path.
+
+Uses orjson when it is installed and falls back to the standard library.
+dumps always returns UTF-8 bytes ready to be written to a socket.
+"""
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DecodeError = json.JSONDecodeError
+
+if orjson:
+    # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+    def loads(data):
+        return orjson.loads(data)
+
+    def _dumps(obj, default):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def _dumps(obj, default):
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=default)
+        return encoder.encode(obj).encode('utf-8')
+
+
+class RawJSON:
+    """Already encoded JSON value, dumps copies it into the output without decoding it"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data.encode('utf-8') if isinstance(data, str) else data
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.data == other.data
+
+    def __repr__(self):
+        return f"RawJSON({self.data!r})"
+
+
+# RawJSON values are encoded as placeholder strings and replaced afterwards, the
+# random part keeps anything else in the output from looking like a placeholder
+_RAW_MARK = "rawjson:%s:" % os.urandom(8).hex()
+_RAW_MARK_BYTES = _RAW_MARK.encode('ascii')
+_RAW_PLACEHOLDER = re.compile(b'"' + re.escape(_RAW_MARK_BYTES) + rb'(\d+)"')
+
+
+def dumps(obj, default=None):
+    fragments = []
+
+    def encode_default(value):
+        if isinstance(value, RawJSON):
+            fragments.append(value.data)
+            return f"{_RAW_MARK}{len(fragments) - 1}"
+        if default is None:
+            raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+        return default(value)
+
+    data = _dumps(obj, encode_default)
+    if not fragments:
+        return data
+    if data.count(_RAW_MARK_BYTES) != len(fragments):
+        # a string in obj mimics a placeholder, encode the slow way
+        return _dumps(obj, lambda value: loads(value.data) if isinstance(value, RawJSON) else encode_default(value))
+    return _RAW_PLACEHOLDER.sub(lambda m: fragments[int(m.group(1))], data)
@@ -6,3 +6,18 @@ class ValidationError(Exception):
 class StoreGetException(Exception):
     """Raised when cant get value from store"""
     pass
+
+
+class CircuitOpenError(Exception):
+    """Raised when store calls are skipped because the circuit breaker is open"""
+    pass
+
+
+class StoreFullException(Exception):
+    """Raised when a write does not fit into the memory limit of the store backend"""
+    pass
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the time budget of the request being served has run out"""
+    pass
@@ -21,32 +21,36 @@ class Field:
     def validate(self, value):
         if self.required and value is None:
             raise ValidationError(f'{self.name} is required')
-        if not self.nullable and not value:
+        if not self.nullable and self.is_empty(value):
             raise ValidationError(f'{self.name} should not be empty')
+        if value:
+            self.validate_value(value)
+
+    def is_empty(self, value):
+        return not value
+
+    def validate_value(self, value):
+        """Check a non-empty value, presence is already checked by validate"""
+        pass
 
 
 class CharField(Field):
 
-    def validate(self, value):
-        super().validate(value)
-        if value and not isinstance(value, str):
+    def validate_value(self, value):
+        if not isinstance(value, str):
             raise ValidationError(f'{self.name} must be a str')
 
 
 class ArgumentsField(Field):
 
-    def validate(self, value):
-        super().validate(value)
-        if value and not isinstance(value, dict):
+    def validate_value(self, value):
+        if not isinstance(value, dict):
             raise ValidationError(f'{self.name} must be a dict')
 
 
 class EmailField(CharField):
 
-    def validate(self, value):
-        super().validate(value)
-        if not value:
-            return
+    def validate_value(self, value):
         if not isinstance(value, str):
             raise ValidationError(f'{self.name} must be a str')
         if '@' not in value:
@@ -55,10 +59,7 @@ class EmailField(CharField):
 
 class PhoneField(Field):
 
-    def validate(self, value):
-        super().validate(value)
-        if not value:
-            return
+    def validate_value(self, value):
         if not isinstance(value, str) and not isinstance(value, int):
             raise ValidationError(f'{self.name} must be a str or int')
         if len(str(value)) != 11:
@@ -70,51 +71,84 @@ class PhoneField(Field):
 class DateField(Field):
     date_format = '%d.%m.%Y'
 
-    def validate(self, value):
-        super().validate(value)
-        if not value:
-            return
+    def parse(self, value):
         if not isinstance(value, str):
             raise ValidationError(f'{self.name} must be a str')
         try:
-            datetime.datetime.strptime(value, self.date_format)
+            return datetime.datetime.strptime(value, self.date_format)
         except ValueError:
             raise ValidationError(f"Incorrect date format of {self.name}, should be DD.MM.YYYY")
 
+    def validate_value(self, value):
+        self.parse(value)
+
 
 class BirthDayField(DateField):
 
-    def validate(self, value):
-        super().validate(value)
-        if not value:
-            return
-        date = datetime.datetime.strptime(value, self.date_format)
+    def validate_value(self, value):
+        date = self.parse(value)
         min_year = datetime.datetime.now().year - 70
         if date.year < min_year:
             raise ValidationError(f"Incorrect {self.name}: year should be more then {min_year}")
 
 
 class GenderField(Field):
+    valid_values = [0, 1, 2]
 
-    def validate(self, value):
-        if self.required and value is None:
-            raise ValidationError(f'{self.name} is required')
-        if not self.nullable and value is None:
-            raise ValidationError(f'{self.name} should not be empty')
-        if not value:
-            return
-        valid_values = [0, 1, 2]
-        if value not in valid_values:
-            raise ValidationError(f'Incorrect {self.name}. Valid values: {valid_values}')
+    def is_empty(self, value):
+        # 0 is a valid gender
+        return value is None
+
+    def validate_value(self, value):
+        if value not in self.valid_values:
+            raise ValidationError(f'Incorrect {self.name}. Valid values: {self.valid_values}')
 
 
 class ClientIDsField(Field):
 
-    def validate(self, value):
-        super().validate(value)
-        if not value:
-            return
+    def validate_value(self, value):
         if not isinstance(value, list):
             raise ValidationError(f'{self.name} must be a list')
         if not all(isinstance(x, int) for x in value):
             raise ValidationError(f'All values from {self.name} should be integers')
+
+
+class RecordsField(Field):
+
+    def validate_value(self, value):
+        if not isinstance(value, list):
+            raise ValidationError(f'{self.name} must be a list')
+
+
+def compile_validator(fields):
+    """Build a validate function for a request class with the given {name: Field}.
+
+    The checks of every field are unrolled into one function at class creation time,
+    so validating a request costs no descriptor or super() dispatch per field.
+    Invalid fields are set to None and their errors appended to self.errors.
+    """
+    namespace = {"ValidationError": ValidationError}
+    lines = ["def validate_fields(self):",
+             "    get = self.request_body.get",
+             "    errors = self.errors"]
+    for i, (name, field) in enumerate(fields.items()):
+        lines.append(f"    value = get({name!r})")
+        lines.append("    try:")
+        if field.required:
+            namespace[f"required_{i}"] = f'{name} is required'
+            lines.append(f"        if value is None: raise ValidationError(required_{i})")
+        if not field.nullable:
+            namespace[f"is_empty_{i}"] = field.is_empty
+            namespace[f"empty_{i}"] = f'{name} should not be empty'
+            lines.append(f"        if is_empty_{i}(value): raise ValidationError(empty_{i})")
+        if type(field).validate_value is not Field.validate_value:
+            namespace[f"validate_value_{i}"] = field.validate_value
+            lines.append(f"        if value: validate_value_{i}(value)")
+        else:
+            lines.append("        pass")
+        lines.append("    except ValidationError as e:")
+        lines.append("        errors.append(str(e))")
+        lines.append("        value = None")
+        lines.append(f"    self.{name} = value")
+    exec("\n".join(lines), namespace)
+    return namespace["validate_fields"]
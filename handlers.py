@@ -1,21 +1,31 @@
 import scoring
 from exceptions import ValidationError
 from fields import CharField, ArgumentsField, ClientIDsField, DateField, EmailField, GenderField, PhoneField, \
-    BirthDayField, Field
+    BirthDayField, RecordsField, Field, compile_validator
 from status_codes import OK, INVALID_REQUEST
 
 ADMIN_LOGIN = "admin"
 
 
 class RequestMeta(type):
+    """Turns Field attributes into __slots__ and compiles a validate function for them"""
+
     def __new__(mcs, name, bases, attrs):
+        fields = {a: v for a, v in attrs.items() if isinstance(v, Field)}
+        for a in fields:
+            del attrs[a]
+        attrs.setdefault('__slots__', tuple(fields))
         cls = super(RequestMeta, mcs).__new__(mcs, name, bases, attrs)
-        fields = [a for a, v in attrs.items() if isinstance(v, Field)]
-        cls.fields = fields
+        for a, field in fields.items():
+            field.__set_name__(cls, a)
+        cls.fields = list(fields)
+        cls.field_types = fields
+        cls.validate_fields = compile_validator(fields)
         return cls
 
 
 class Request(metaclass=RequestMeta):
+    __slots__ = ('request_body', 'errors')
 
     def __init__(self, request_body):
         self.request_body = request_body
@@ -25,11 +35,7 @@ class Request(metaclass=RequestMeta):
         return not self.errors
 
     def validate(self):
-        for field in self.fields:
-            try:
-                setattr(self, field, self.request_body.get(field, None))
-            except ValidationError as e:
-                self.errors.append(str(e))
+        self.validate_fields()
 
     def errors_str(self):
         return ", ".join(self.errors)
@@ -48,15 +54,41 @@ class BaseRequest(Request):
 
 
 class RequestHandler:
-    def validate_handle(self, is_admin, request, ctx, store):
+    # ratelimit.RateLimiter shared by all handlers, None admits everything
+    limiter = None
+
+    def validate(self, request):
         request.validate()
         if not request.is_valid():
             return request.errors_str(), INVALID_REQUEST
+        return None
+
+    def validate_handle(self, is_admin, request, ctx, store):
+        error = self.validate(request)
+        if error:
+            return error
         return self.handle(is_admin, request, ctx, store)
 
+    async def validate_handle_async(self, is_admin, request, ctx, store):
+        error = self.validate(request)
+        if error:
+            return error
+        return await self.handle_async(is_admin, request, ctx, store)
+
+    def store_keys(self, is_admin, request):
+        """Keys handle() is going to read, so batches can fetch them up front"""
+        return []
+
+    def cost(self, request):
+        """Tokens a request takes from the caller's rate limit bucket"""
+        return 1
+
     def handle(self, is_admin, request, ctx, store):
         return {}, OK
 
+    async def handle_async(self, is_admin, request, ctx, store):
+        return {}, OK
+
 
 class ClientsInterestsRequest(Request):
     client_ids = ClientIDsField(required=True, nullable=False)
@@ -65,13 +97,32 @@ class ClientsInterestsRequest(Request):
 
 class ClientsInterestsHandler(RequestHandler):
     request_type = ClientsInterestsRequest
+    # copy stored interests JSON into responses without decoding it, see scoring.join_interests
+    raw_interests = False
+    raw_validate_rate = 0.01
+    # scoring.InterestsDictionary to read the compact layout first, None reads JSON keys only
+    interests_dictionary = None
+
+    def store_keys(self, is_admin, request):
+        return [scoring.interests_key(cid) for cid in request.client_ids]
+
+    def cost(self, request):
+        return len(request.client_ids)
 
     def handle(self, is_admin, request, ctx, store):
-        clients_interests = dict()
-        for cid in request.client_ids:
-            clients_interests[str(cid)] = scoring.get_interests(store, cid)
         ctx['nclients'] = len(request.client_ids)
-        return clients_interests, OK
+        if self.raw_interests:
+            return scoring.get_interests_raw(store, request.client_ids, self.raw_validate_rate,
+                                             self.interests_dictionary), OK
+        interests = scoring.get_interests_many(store, request.client_ids, self.interests_dictionary)
+        return {str(cid): i for cid, i in interests.items()}, OK
+
+    async def handle_async(self, is_admin, request, ctx, store):
+        ctx['nclients'] = len(request.client_ids)
+        if self.raw_interests:
+            return await scoring.get_interests_raw_async(store, request.client_ids, self.raw_validate_rate), OK
+        interests = await scoring.get_interests_many_async(store, request.client_ids)
+        return {str(cid): i for cid, i in interests.items()}, OK
 
 
 class OnlineScoreRequest(Request):
@@ -96,6 +147,11 @@ class OnlineScoreRequest(Request):
 class OnlineScoreHandler(RequestHandler):
     request_type = OnlineScoreRequest
 
+    def store_keys(self, is_admin, request):
+        if is_admin:
+            return []
+        return [scoring.score_key(request.phone, request.birthday, request.first_name, request.last_name)]
+
     def handle(self, is_admin, request, ctx, store):
         if is_admin:
             score = 42
@@ -110,3 +166,93 @@ class OnlineScoreHandler(RequestHandler):
 
         ctx["has"] = [f for f in request.fields if getattr(request, f) is not None]
         return {"score": score}, OK
+
+    async def handle_async(self, is_admin, request, ctx, store):
+        if is_admin:
+            score = 42
+        else:
+            score = await scoring.get_score_async(store,
+                                                  request.phone,
+                                                  request.email,
+                                                  request.birthday,
+                                                  request.gender,
+                                                  request.first_name,
+                                                  request.last_name)
+
+        ctx["has"] = [f for f in request.fields if getattr(request, f) is not None]
+        return {"score": score}, OK
+
+
+class OnlineScoreBatchRequest(Request):
+    records = RecordsField(required=True, nullable=False)
+    max_records = 10000
+
+    def validate(self):
+        super().validate()
+        if self.records and len(self.records) > self.max_records:
+            self.errors.append(f'records should contain at most {self.max_records} items')
+
+
+class OnlineScoreBatchHandler(RequestHandler):
+    """online_score for many records in one call; every record gets a score or an error"""
+    request_type = OnlineScoreBatchRequest
+    pair_error = 'One of pairs phone-email or first_name-last_name or gender-birthday should not be empty'
+
+    def cost(self, request):
+        return len(request.records)
+
+    def validate_records(self, records):
+        """Validate records field by field, return ({field: column of values}, {record index: [errors]}).
+
+        Values that failed validation are None in the columns.
+        """
+        errors = {}
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors[i] = ['record should be an object']
+        records = [record if isinstance(record, dict) else {} for record in records]
+        columns = {}
+        for name, field in OnlineScoreRequest.field_types.items():
+            column = columns[name] = [record.get(name) for record in records]
+            for i, value in enumerate(column):
+                try:
+                    field.validate(value)
+                except ValidationError as e:
+                    errors.setdefault(i, []).append(str(e))
+                    column[i] = None
+        pairs = zip(columns["phone"], columns["email"], columns["first_name"], columns["last_name"],
+                    columns["gender"], columns["birthday"])
+        for i, (phone, email, first_name, last_name, gender, birthday) in enumerate(pairs):
+            if i not in errors and not ((phone is not None and email is not None) or
+                                        (first_name is not None and last_name is not None) or
+                                        (gender is not None and birthday is not None)):
+                errors[i] = [self.pair_error]
+        return columns, errors
+
+    @staticmethod
+    def valid_columns(columns, errors):
+        return {name: [v for i, v in enumerate(column) if i not in errors] for name, column in columns.items()}
+
+    def build_results(self, count, errors, scores):
+        scores = iter(scores)
+        return [{"error": ", ".join(errors[i])} if i in errors else {"score": next(scores)} for i in range(count)]
+
+    def handle(self, is_admin, request, ctx, store):
+        columns, errors = self.validate_records(request.records)
+        valid = self.valid_columns(columns, errors)
+        if is_admin:
+            scores = [42] * (len(request.records) - len(errors))
+        else:
+            scores = scoring.get_scores(store, valid)
+        ctx["nrecords"] = len(request.records)
+        return self.build_results(len(request.records), errors, scores), OK
+
+    async def handle_async(self, is_admin, request, ctx, store):
+        columns, errors = self.validate_records(request.records)
+        valid = self.valid_columns(columns, errors)
+        if is_admin:
+            scores = [42] * (len(request.records) - len(errors))
+        else:
+            scores = await scoring.get_scores_async(store, valid)
+        ctx["nrecords"] = len(request.records)
+        return self.build_results(len(request.records), errors, scores), OK
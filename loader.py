@@ -0,0 +1,206 @@
+"""Bulk loader of client interests into the store.
+
+    python loader.py interests.jsonl --cache_port 6379 --chunk_size 1000 --state interests.state
+
+Input is streamed line by line, so memory use does not depend on its size:
+  * jsonl: {"cid": 1, "interests": ["cars", "pets"]} per line
+  * csv: cid,interests per line, interests as a JSON list or separated by ";",
+    a header line starting with "cid" is skipped
+Every interests value is checked and written as compact JSON under interests_key(cid)
+(or to bucket hashes with --layout compact), chunk_size records per pipelined round trip.
+With --state the byte offset after every written chunk is saved, and a restarted load
+continues from there.
+"""
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import codec
+import scoring
+from exceptions import ValidationError
+from store import Store
+
+
+def parse_jsonl(line):
+    record = codec.loads(line)
+    if not isinstance(record, dict):
+        raise ValidationError("record should be an object")
+    return record.get("cid"), record.get("interests")
+
+
+def parse_csv(line):
+    row = next(csv.reader([line.decode('utf-8')]))
+    if len(row) != 2:
+        raise ValidationError("record should have 2 columns: cid,interests")
+    cid, interests = row
+    interests = interests.strip()
+    if interests.startswith("["):
+        interests = codec.loads(interests)
+    else:
+        interests = [i.strip() for i in interests.split(";") if i.strip()]
+    return int(cid), interests
+
+
+PARSERS = {
+    "jsonl": parse_jsonl,
+    "csv": parse_csv,
+}
+
+
+def validate(cid, interests):
+    if not isinstance(cid, int) or isinstance(cid, bool):
+        raise ValidationError("cid must be an integer")
+    if not isinstance(interests, list) or not all(isinstance(i, str) for i in interests):
+        raise ValidationError("interests must be a list of strings")
+
+
+def read_records(f, parse):
+    """Yield (offset after the line, line number, cid, interests or the parse error)"""
+    number = 0
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        number += 1
+        offset = f.tell()
+        if not line.strip() or (parse is parse_csv and line.lstrip().startswith(b"cid")):
+            continue
+        try:
+            cid, interests = parse(line)
+            validate(cid, interests)
+        except (ValueError, ValidationError) as e:
+            yield offset, number, None, e
+            continue
+        yield offset, number, cid, interests
+
+
+class Progress:
+    """Logs records loaded so far and the load rate every `interval` seconds"""
+
+    def __init__(self, interval=5, total_bytes=None):
+        self.interval = interval
+        self.total_bytes = total_bytes
+        self.started = time.monotonic()
+        self._last = self.started
+        self.written = 0
+        self.errors = 0
+
+    def update(self, offset, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rate = self.written / max(now - self.started, 1e-9)
+        done = f" ({offset / self.total_bytes:.1%})" if self.total_bytes else ""
+        logging.info("Written %s records, %s invalid, offset %s%s, %.0f records/s" %
+                     (self.written, self.errors, offset, done, rate))
+
+
+def load_state(path, input_path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("input") != os.path.abspath(input_path):
+        raise ValueError(f"State file {path} belongs to {state.get('input')}")
+    return state["offset"]
+
+
+def save_state(path, input_path, offset):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"input": os.path.abspath(input_path), "offset": offset}, f)
+    os.replace(tmp, path)
+
+
+def clear_state(path):
+    """Remove the state of a finished load, there is none when no chunk was written"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load(store, input_path, fmt="jsonl", chunk_size=1000, ttl=None, state_path=None, max_errors=0,
+         progress_interval=5, layout="json"):
+    """Write interests from input_path to store, return Progress with the totals"""
+    parse = PARSERS[fmt]
+    # chunks of {cid: interests} for the compact layout, {key: JSON} otherwise
+    dictionary = scoring.InterestsDictionary(store) if layout == "compact" else None
+    offset = load_state(state_path, input_path)
+    progress = Progress(progress_interval, os.path.getsize(input_path))
+    if offset:
+        logging.info("Resuming %s from offset %s" % (input_path, offset))
+    with open(input_path, "rb") as f:
+        f.seek(offset)
+        chunk = {}
+        for offset, number, cid, interests in read_records(f, parse):
+            if cid is None:
+                progress.errors += 1
+                logging.warning("Skip line %s: %s" % (number, interests))
+                if max_errors and progress.errors > max_errors:
+                    raise ValueError(f"More than {max_errors} invalid records")
+                continue
+            if dictionary is not None:
+                chunk[cid] = interests
+            else:
+                chunk[scoring.interests_key(cid)] = codec.dumps(interests).decode('utf-8')
+            if len(chunk) >= chunk_size:
+                write_chunk(store, dictionary, chunk, ttl, progress, state_path, input_path, offset)
+                chunk = {}
+        if chunk:
+            write_chunk(store, dictionary, chunk, ttl, progress, state_path, input_path, offset)
+    progress.update(offset, force=True)
+    return progress
+
+
+def write_chunk(store, dictionary, chunk, ttl, progress, state_path, input_path, offset):
+    # errors are not swallowed here: the state must only move past written chunks
+    if dictionary is not None:
+        scoring.set_interests_compact(store, dictionary, chunk)
+    else:
+        store.set_many_with_retry(chunk, ttl)
+    progress.written += len(chunk)
+    if state_path:
+        save_state(state_path, input_path, offset)
+    progress.update(offset)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] INPUT")
+    op.add_option("-f", "--format", action="store", type="choice", choices=list(PARSERS), default=None,
+                  help="input format, by default taken from the file extension")
+    op.add_option("--cache_host", action="store", type=str, default='localhost')
+    op.add_option("--cache_port", action="store", type=int, default=6379)
+    op.add_option("--chunk_size", action="store", type=int, default=1000, help="records per pipelined write")
+    op.add_option("--ttl", action="store", type=int, default=None, help="expire loaded keys after TTL seconds")
+    op.add_option("--layout", action="store", type="choice", choices=["json", "compact"], default="json",
+                  help="write JSON keys or the compact layout read with api.py --interests_layout compact")
+    op.add_option("--state", action="store", default=None, help="file to save progress to and resume from")
+    op.add_option("--max_errors", action="store", type=int, default=0,
+                  help="stop after that many invalid records, 0 never stops")
+    op.add_option("--progress_interval", action="store", type=float, default=5)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("expected one INPUT file")
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    if opts.layout == "compact" and opts.ttl:
+        op.error("--ttl is not supported with --layout compact, bucket hashes hold many clients")
+    fmt = opts.format or os.path.splitext(args[0])[1].lstrip(".").lower()
+    if fmt not in PARSERS:
+        op.error(f"unknown input format {fmt!r}, use --format")
+    store = Store(host=opts.cache_host, port=opts.cache_port)
+    try:
+        result = load(store, args[0], fmt, opts.chunk_size, opts.ttl, opts.state, opts.max_errors,
+                      opts.progress_interval, opts.layout)
+    except Exception as e:
+        logging.error("Load failed: %s" % e)
+        sys.exit(1)
+    if opts.state:
+        clear_state(opts.state)
+    logging.info("Done in %.1fs" % (time.monotonic() - result.started))
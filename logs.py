@@ -0,0 +1,128 @@
+import logging
+import os
+import queue
+import random
+import threading
+
+import codec
+import metrics
+
+access_logger = logging.getLogger("access")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; dict messages are merged into the object as fields"""
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname}
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return codec.dumps(entry, default=self.default).decode('utf-8')
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, bytes):
+            return obj.decode('utf-8', 'replace')
+        return str(obj)
+
+
+class AsyncLogHandler(logging.Handler):
+    """Hands records to a background thread that formats and writes them in batches.
+
+    The calling thread only puts the record on a bounded queue. When the queue is
+    more than `pressure` full, records below WARNING are dropped, and anything that
+    does not fit is dropped too; drops are counted in metrics.LOG_DROPPED.
+    """
+
+    def __init__(self, target, queue_size=10000, batch_size=256, pressure=0.8):
+        super().__init__()
+        self.target = target
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.pressure_size = int(queue_size * pressure)
+        self._start()
+        # threads do not survive fork, every pre-fork worker needs its own writer
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self.queue = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.pressure_size:
+            metrics.LOG_DROPPED.inc()
+            return
+        if record.exc_info:
+            # tracebacks hold frames of the request, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [record for record in batch if record is not None]
+            self.write(batch)
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.target.format(record))
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        with self.target.lock:
+            self.target.stream.write("\n".join(lines) + "\n")
+            self.target.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+        self.target.close()
+        super().close()
+
+
+class AccessLog:
+    """Access log entries for served requests, request bodies are logged for a sample of them.
+
+    context keys starting with "_" are internal and not logged.
+    """
+    body_sample_rate = 1.0
+
+    @classmethod
+    def log(cls, path, context, body=None):
+        entry = {"path": path}
+        entry.update((key, value) for key, value in context.items() if not key.startswith("_"))
+        if body is not None and cls.body_sample_rate and random.random() < cls.body_sample_rate:
+            entry["body"] = body
+        access_logger.info(entry)
+
+
+def setup_logging(filename=None, level=logging.INFO, queue_size=10000, body_sample_rate=1.0):
+    target = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    target.setFormatter(JsonFormatter(datefmt='%Y.%m.%d %H:%M:%S'))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(AsyncLogHandler(target, queue_size=queue_size))
+    AccessLog.body_sample_rate = body_sample_rate
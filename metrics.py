@@ -0,0 +1,168 @@
+import bisect
+import itertools
+import mmap
+import multiprocessing
+
+from status_codes import ERRORS, OK
+
+OTHER = "other"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Registry:
+    """Metric values in anonymous shared memory.
+
+    Every metric allocates a fixed range of float slots at creation time, so metrics
+    created before the server forks are shared by all workers; a single process-shared
+    lock keeps updates from threads and processes consistent.
+    """
+
+    def __init__(self, capacity=8192):
+        self._buffer = mmap.mmap(-1, capacity * 8)
+        self.values = memoryview(self._buffer).cast('d')
+        self.lock = multiprocessing.Lock()
+        self.capacity = capacity
+        self.metrics = []
+        self._next = 0
+
+    def allocate(self, metric, size):
+        if self._next + size > self.capacity:
+            raise ValueError(f"Metrics registry is full, can not allocate {metric.name}")
+        offset = self._next
+        self._next += size
+        self.metrics.append(metric)
+        return offset
+
+    def add(self, offset, amount):
+        with self.lock:
+            self.values[offset] += amount
+
+    def render(self):
+        return "".join(metric.render() for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = None
+    width = 1
+
+    def __init__(self, name, documentation, labels=None, registry=REGISTRY):
+        """labels maps label name to its known values, anything else is reported as "other" """
+        self.name = name
+        self.documentation = documentation
+        self.registry = registry
+        self.label_names = list(labels or {})
+        self._known = [set(v) for v in (labels or {}).values()]
+        values = [list(v) + [OTHER] for v in (labels or {}).values()]
+        self.label_sets = list(itertools.product(*values))
+        self._index = {label_set: i for i, label_set in enumerate(self.label_sets)}
+        self.offset = registry.allocate(self, len(self.label_sets) * self.width)
+
+    def slot(self, labels):
+        index = self._index.get(labels)
+        if index is None:
+            index = self._index[tuple(v if v in known else OTHER for v, known in zip(labels, self._known))]
+        return self.offset + index * self.width
+
+    def format_labels(self, label_set, extra=None):
+        pairs = list(zip(self.label_names, label_set)) + (extra or [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} {self.kind}\n"]
+        lines.extend(self.render_samples())
+        return "".join(lines)
+
+    def render_samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.registry.add(self.slot(labels), amount)
+
+    def value(self, *labels):
+        return self.registry.values[self.slot(labels)]
+
+    def render_samples(self):
+        values = self.registry.values
+        for label_set in self.label_sets:
+            value = values[self.slot(label_set)]
+            if value:
+                yield f"{self.name}{self.format_labels(label_set)} {value:g}\n"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=None, buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        # a slot per bucket, +Inf, sum and count
+        self.width = len(self.buckets) + 3
+        super().__init__(name, documentation, labels, registry)
+
+    def observe(self, value, *labels):
+        offset = self.slot(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        values = self.registry.values
+        with self.registry.lock:
+            values[offset + bucket] += 1
+            values[offset + len(self.buckets) + 1] += value
+            values[offset + len(self.buckets) + 2] += 1
+
+    def count(self, *labels):
+        return self.registry.values[self.slot(labels) + len(self.buckets) + 2]
+
+    def render_samples(self):
+        values = self.registry.values
+        for label_set in self.label_sets:
+            offset = self.slot(label_set)
+            count = values[offset + len(self.buckets) + 2]
+            if not count:
+                continue
+            cumulative = 0
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                cumulative += values[offset + i]
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{self.format_labels(label_set, [('le', le)])} {cumulative:g}\n"
+            labels = self.format_labels(label_set)
+            yield f"{self.name}_sum{labels} {values[offset + len(self.buckets) + 1]:g}\n"
+            yield f"{self.name}_count{labels} {count:g}\n"
+
+
+METHODS = ("online_score", "online_score_batch", "clients_interests", "batch")
+CODES = tuple(str(code) for code in [OK] + list(ERRORS))
+STAGES = ("read", "parse", "validate", "auth", "handler", "store")
+STORE_OPS = ("get", "set", "get_many", "set_many", "hgetall", "hmget_many", "hset_many", "delete_many")
+
+REQUESTS = Counter("scoring_requests_total", "Requests by method and response code",
+                   {"method": METHODS, "code": CODES})
+REQUEST_LATENCY = Histogram("scoring_request_seconds", "Request latency by method", {"method": METHODS})
+STAGE_LATENCY = Histogram("scoring_stage_seconds", "Time spent in each request stage", {"stage": STAGES})
+STORE_LATENCY = Histogram("scoring_store_seconds", "Redis round trip time by operation", {"op": STORE_OPS})
+STORE_RETRIES = Counter("scoring_store_retries_total", "Retried redis calls by operation", {"op": STORE_OPS})
+BREAKER_TRANSITIONS = Counter("scoring_store_breaker_transitions_total", "Circuit breaker state changes",
+                              {"state": ("closed", "open", "half_open")})
+STORE_WRITES_DROPPED = Counter("scoring_store_writes_dropped_total",
+                               "Write-behind cache writes dropped because the queue was full or the write failed")
+LOG_DROPPED = Counter("scoring_log_dropped_total", "Log records dropped because the log queue was full")
+RATE_LIMITED = Counter("scoring_rate_limited_total", "Requests rejected by admission control by method and limit",
+                       {"method": METHODS, "limit": ("rate", "concurrency")})
+OVERLOAD_SHED = Counter("scoring_overload_shed_total", "Requests rejected with 503 by the overload controller",
+                        {"reason": ("in_flight", "queue_wait", "latency")})
+SCORE_CACHE = Counter("scoring_score_cache_total", "get_score cache lookups by result",
+                      {"result": ("hit", "miss", "refresh", "coalesced")})
+
+
+def observe_request(ctx, code, elapsed):
+    method = ctx.get("method", OTHER)
+    REQUESTS.inc(method, str(code))
+    REQUEST_LATENCY.observe(elapsed, method)
+    for stage, seconds in ctx.get("timings", {}).items():
+        STAGE_LATENCY.observe(seconds, stage)
@@ -0,0 +1,79 @@
+"""Move interests from JSON keys (i:<cid>) to the compact layout.
+
+    python migrate_interests.py --cache_port 6379 --batch_size 1000 --delete
+
+Keys are scanned in batches: values are read with one MGET, interned through
+scoring.InterestsDictionary and written to bucket hashes in one pipeline, then
+with --delete the migrated JSON keys are removed. Servers running with
+--interests_layout compact read both layouts, so they can serve during the
+migration. Running it again is safe, it only rewrites the same values.
+"""
+import itertools
+import logging
+import sys
+import time
+from optparse import OptionParser
+
+import codec
+import scoring
+from exceptions import ValidationError
+from loader import validate
+from store import Store
+
+
+def migrate_batch(store, dictionary, keys, delete=False):
+    """Migrate JSON keys, return (migrated, skipped)"""
+    interests, skipped = {}, 0
+    for key, value in zip(keys, store.get_many_with_retry(keys)):
+        if value is None:
+            continue
+        try:
+            cid = int(key[len(scoring.interests_key("")):])
+            names = codec.loads(value)
+            validate(cid, names)
+        except (ValueError, ValidationError) as e:
+            logging.warning("Skip %s: %s" % (key, e))
+            skipped += 1
+            continue
+        interests[cid] = names
+    scoring.set_interests_compact(store, dictionary, interests)
+    if delete:
+        store.delete_many_with_retry([scoring.interests_key(cid) for cid in interests])
+    return len(interests), skipped
+
+
+def migrate(store, batch_size=1000, delete=False, progress_interval=5):
+    dictionary = scoring.InterestsDictionary(store)
+    migrated = skipped = 0
+    started = last = time.monotonic()
+    keys_iter = store.backend.scan(scoring.interests_key("*"), count=batch_size)
+    # SCAN returns every key that exists for the whole scan, deleting migrated keys does not hide others;
+    # a key may come twice, migrating it again is harmless
+    for keys in iter(lambda: list(itertools.islice(keys_iter, batch_size)), []):
+        done, failed = migrate_batch(store, dictionary, keys, delete)
+        migrated += done
+        skipped += failed
+        now = time.monotonic()
+        if now - last >= progress_interval:
+            last = now
+            logging.info("Migrated %s keys, skipped %s, %.0f keys/s" % (migrated, skipped, migrated / (now - started)))
+    logging.info("Migrated %s keys, skipped %s in %.1fs" % (migrated, skipped, time.monotonic() - started))
+    return migrated, skipped
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("--cache_host", action="store", type=str, default='localhost')
+    op.add_option("--cache_port", action="store", type=int, default=6379)
+    op.add_option("--batch_size", action="store", type=int, default=1000, help="keys per read and write round trip")
+    op.add_option("--delete", action="store_true", default=False, help="remove JSON keys once migrated")
+    op.add_option("--progress_interval", action="store", type=float, default=5)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    try:
+        migrate(Store(host=opts.cache_host, port=opts.cache_port), opts.batch_size, opts.delete,
+                opts.progress_interval)
+    except Exception as e:
+        logging.error("Migration failed: %s" % e)
+        sys.exit(1)
@@ -0,0 +1,71 @@
+import collections
+import random
+import threading
+import time
+
+# share of requests still let through while p99 latency is over its limit, so it keeps being measured
+MIN_ADMIT_SHARE = 0.1
+
+
+class OverloadController:
+    """Decides whether a worker process should take new work or shed it.
+
+    Three signals are checked, each disabled by a limit of 0:
+      * max_in_flight: requests being handled at the moment
+      * max_queue_wait: seconds the longest waiting connection has been queued for a
+        thread (server.queue_wait())
+      * max_p99: p99 latency of requests finished in the last `window` seconds; above it
+        requests are shed with a probability growing with the overshoot, and a share
+        is still let through to keep measuring
+    """
+
+    def __init__(self, max_in_flight=0, max_queue_wait=0, max_p99=0, window=10, refresh_interval=0.5,
+                 max_samples=2000, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.max_p99 = max_p99
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.in_flight = 0
+        self.p99 = 0.0
+        self._samples = collections.deque(maxlen=max_samples)
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, server=None):
+        """Reason to shed a new request ("in_flight", "queue_wait" or "latency"), None to take it"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        queue_wait = getattr(server, "queue_wait", None)
+        if self.max_queue_wait and queue_wait is not None and queue_wait() >= self.max_queue_wait:
+            return "queue_wait"
+        if self.max_p99:
+            p99 = self.latency_p99()
+            if p99 > self.max_p99 and random.random() < min(p99 / self.max_p99 - 1, 1 - MIN_ADMIT_SHARE):
+                return "latency"
+        return None
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self, elapsed):
+        """Finish a request that took elapsed seconds"""
+        with self._lock:
+            self.in_flight -= 1
+            if self.max_p99:
+                self._samples.append((self.clock(), elapsed))
+
+    def latency_p99(self):
+        """p99 of recent latencies, recomputed at most every refresh_interval seconds"""
+        now = self.clock()
+        if now - self._refreshed_at < self.refresh_interval:
+            return self.p99
+        with self._lock:
+            self._refreshed_at = now
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+            latencies = sorted(elapsed for _, elapsed in self._samples)
+        self.p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+        return self.p99
@@ -0,0 +1,173 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import time
+
+
+def key_hash(key):
+    """Stable non-zero 64-bit hash, the same in every worker process"""
+    h = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+    return h or 1
+
+
+class RateLimiter:
+    """Admission control: token buckets per caller and in-flight limits per method.
+
+    State lives in anonymous shared memory allocated before the server forks, so all
+    workers see the same buckets; a process-shared lock guards it like the metrics
+    registry. Buckets are kept in a fixed open-addressed table of `slots` entries: a key
+    is looked up at most `probes` slots from its hash, and when all of them are taken
+    the least recently used bucket is handed over, starting full.
+
+    A bucket holds up to `burst` tokens and refills at `rate` tokens per second; a
+    request takes as many tokens as it costs, a cost above `burst` takes the whole bucket.
+    A rate of 0 leaves only the in-flight limits.
+
+    In-flight counters are kept per worker process in one of `workers` rows, so the
+    slots of a worker that died mid-request can be dropped with forget(pid). A process
+    claims a free row on its first request, or else the row of a process that no longer exists.
+    """
+
+    def __init__(self, rate, burst=None, max_concurrency=None, slots=4096, probes=8, concurrency_retry_after=1,
+                 workers=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or rate
+        self.slots = slots
+        self.probes = min(probes, slots)
+        self.concurrency_retry_after = concurrency_retry_after
+        self.clock = clock
+        self.max_concurrency = dict(max_concurrency or {})
+        self._methods = {method: i for i, method in enumerate(self.max_concurrency)}
+        self.workers = workers
+        # per slot: key hash | tokens, updated at | per worker: pid, an in-flight counter per method
+        self._row_size = len(self._methods) + 1
+        self._buffer = mmap.mmap(-1, slots * 8 * 3 + workers * self._row_size * 8)
+        view = memoryview(self._buffer)
+        self.keys = view[:slots * 8].cast('q')
+        self.buckets = view[slots * 8:slots * 24].cast('d')
+        self.rows = view[slots * 24:].cast('q')
+        self.lock = multiprocessing.Lock()
+        # (pid, offset of its row) cached by the process that claimed the row
+        self._row = (0, None)
+
+    def _slot(self, h):
+        """Index of the bucket of hash h, claiming an empty or the least recently used one"""
+        keys, buckets = self.keys, self.buckets
+        start = h % self.slots
+        oldest = None
+        for i in range(start, start + self.probes):
+            i %= self.slots
+            if keys[i] == h:
+                return i
+            if keys[i] == 0:
+                oldest = i
+                break
+            if oldest is None or buckets[i * 2 + 1] < buckets[oldest * 2 + 1]:
+                oldest = i
+        keys[oldest] = h
+        buckets[oldest * 2] = self.burst
+        buckets[oldest * 2 + 1] = self.clock()
+        return oldest
+
+    def take(self, key, cost=1):
+        """Take cost tokens from key's bucket, return 0 or the seconds until they are there"""
+        if not self.rate:
+            return 0
+        cost = min(cost, self.burst)
+        h = key_hash(key)
+        with self.lock:
+            i = self._slot(h)
+            now = self.clock()
+            tokens = min(self.burst, self.buckets[i * 2] + (now - self.buckets[i * 2 + 1]) * self.rate)
+            self.buckets[i * 2 + 1] = now
+            if tokens >= cost:
+                self.buckets[i * 2] = tokens - cost
+                return 0
+            self.buckets[i * 2] = tokens
+        return (cost - tokens) / self.rate
+
+    def _own_row(self):
+        """Offset of this process's row of in-flight counters, called under the lock"""
+        pid, row = self._row
+        if pid == os.getpid() and self.rows[row] == pid:
+            return row
+        pid, rows, size = os.getpid(), self.rows, self._row_size
+        free = dead = None
+        for row in range(0, len(rows), size):
+            if rows[row] == pid:
+                free = row
+                break
+            if rows[row] == 0:
+                if free is None:
+                    free = row
+            elif dead is None and free is None and not _alive(rows[row]):
+                dead = row
+        if free is None:
+            free = dead
+        if free is None:
+            raise RuntimeError(f"All {self.workers} rate limiter rows are taken by live processes")
+        if rows[free] != pid:
+            self._clear(free)
+            rows[free] = pid
+        self._row = (pid, free)
+        return free
+
+    def in_flight(self, method):
+        """Requests of method holding an in-flight slot in all workers"""
+        i = self._methods[method] + 1
+        rows = self.rows
+        return sum(rows[row + i] for row in range(0, len(rows), self._row_size) if rows[row])
+
+    def enter(self, method):
+        """Take an in-flight slot of method, False when all of them are busy"""
+        i = self._methods.get(method)
+        if i is None:
+            return True
+        with self.lock:
+            # claimed first: taking over a dead worker's row drops its slots
+            row = self._own_row()
+            if self.in_flight(method) >= self.max_concurrency[method]:
+                return False
+            self.rows[row + i + 1] += 1
+        return True
+
+    def leave(self, method):
+        i = self._methods.get(method)
+        if i is not None:
+            with self.lock:
+                self.rows[self._own_row() + i + 1] -= 1
+
+    def forget(self, pid):
+        """Drop the in-flight slots held by the exited worker pid"""
+        rows = self.rows
+        with self.lock:
+            for row in range(0, len(rows), self._row_size):
+                if rows[row] == pid:
+                    self._clear(row)
+
+    def _clear(self, row):
+        for i in range(row, row + self._row_size):
+            self.rows[i] = 0
+
+    def admit(self, key, method, cost=1):
+        """Return (0, None) when the request may run, it then holds an in-flight slot until
+        leave(method); otherwise the seconds to wait and the limit it hit, "concurrency" or "rate".
+        """
+        if not self.enter(method):
+            return self.concurrency_retry_after, "concurrency"
+        wait = self.take(key, cost)
+        if wait:
+            self.leave(method)
+            return wait, "rate"
+        return 0, None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
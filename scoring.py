@@ -1,22 +1,47 @@
 import hashlib
-import json
+import math
+import random
+import threading
+import time
+
+import codec
+import metrics
+from cache import SingleFlight, AsyncSingleFlight
+from exceptions import StoreGetException
 
 SCORE_TTL = 60 * 60
+# share of SCORE_TTL a cached score may expire early by
+SCORE_TTL_JITTER = 0.1
+# > 1 refreshes earlier, < 1 later
+SCORE_REFRESH_BETA = 1.0
+# seconds XFetch counts as the cost of a recompute at least: compute_score takes microseconds, and
+# with that alone a key would only be refreshed in its last microseconds
+SCORE_RECOMPUTE_COST = 1.0
+# cached values are "score expires_at delta", older workers expect a bare score under "uid:<md5>"
+SCORE_KEY_PREFIX = "uid:v2:"
+# compute_score arguments in order
+SCORE_FIELDS = ("phone", "email", "birthday", "gender", "first_name", "last_name")
 
+# compact interests layout, see InterestsDictionary
+INTERESTS_DICT_KEY = "interests:dict"
+INTERESTS_BUCKET_SIZE = 100
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+_score_flight = SingleFlight()
+_async_score_flight = AsyncSingleFlight()
+
+
+def score_key(phone, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
         phone or "",
         birthday or "",
     ]
-    key = "uid:" + hashlib.md5("".join([str(k) for k in key_parts]).encode('utf-8')).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = store.cache_get(key) or 0
-    if score:
-        return float(score)
+    return SCORE_KEY_PREFIX + hashlib.md5("".join([str(k) for k in key_parts]).encode('utf-8')).hexdigest()
+
+
+def compute_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -25,11 +50,298 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
-    # cache for 60 minutes
-    store.cache_set(key, score, SCORE_TTL)
     return score
 
 
+def compute_scores(phones, emails, birthdays, genders, first_names, last_names):
+    """compute_score over columns of equal length"""
+    return [compute_score(*record) for record in zip(phones, emails, birthdays, genders, first_names, last_names)]
+
+
+def score_ttl():
+    """SCORE_TTL shortened by up to SCORE_TTL_JITTER, so keys written together do not expire together"""
+    return int(SCORE_TTL * (1 - random.uniform(0, SCORE_TTL_JITTER)))
+
+
+def pack_score(score, ttl, delta):
+    """Cached score value: the score, when it expires and how long it took to compute"""
+    return "%s %.3f %.6f" % (score, time.time() + ttl, delta)
+
+
+def unpack_score(value):
+    """Return (score, expires at, compute time), values cached as a bare score have no expiry"""
+    parts = str(value).split()
+    if len(parts) == 3:
+        return float(parts[0]), float(parts[1]), float(parts[2])
+    return float(parts[0]), None, 0.0
+
+
+def should_refresh(expires_at, delta, beta=SCORE_REFRESH_BETA):
+    """Probabilistic early expiration (XFetch): recompute before expiry, the more likely the closer it is"""
+    if expires_at is None:
+        return False
+    delta = max(delta, SCORE_RECOMPUTE_COST)
+    return time.time() - delta * beta * math.log(1 - random.random()) >= expires_at
+
+
+def cached_score(value):
+    """Score from a cached value, None on a miss or when this caller should refresh it early"""
+    if not value:
+        metrics.SCORE_CACHE.inc("miss")
+        return None
+    score, expires_at, delta = unpack_score(value)
+    if should_refresh(expires_at, delta):
+        metrics.SCORE_CACHE.inc("refresh")
+        return None
+    metrics.SCORE_CACHE.inc("hit")
+    return score
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, birthday, first_name, last_name)
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+    score = cached_score(store.cache_get(key))
+    if score is not None:
+        return score
+
+    def compute():
+        start = time.perf_counter()
+        score = compute_score(phone, email, birthday, gender, first_name, last_name)
+        ttl = score_ttl()
+        store.cache_set(key, pack_score(score, ttl, time.perf_counter() - start), ttl)
+        return score
+
+    # concurrent misses of the same key wait for a single calculation
+    score, shared = _score_flight.do(key, compute)
+    if shared:
+        metrics.SCORE_CACHE.inc("coalesced")
+    return score
+
+
+async def get_score_async(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, birthday, first_name, last_name)
+    score = cached_score(await store.cache_get(key))
+    if score is not None:
+        return score
+
+    async def compute():
+        start = time.perf_counter()
+        score = compute_score(phone, email, birthday, gender, first_name, last_name)
+        ttl = score_ttl()
+        await store.cache_set(key, pack_score(score, ttl, time.perf_counter() - start), ttl)
+        return score
+
+    score, shared = await _async_score_flight.do(key, compute)
+    if shared:
+        metrics.SCORE_CACHE.inc("coalesced")
+    return score
+
+
+def score_keys(columns):
+    return [score_key(*record) for record in
+            zip(columns["phone"], columns["birthday"], columns["first_name"], columns["last_name"])]
+
+
+def missing_scores(keys, columns, scores):
+    """Compute scores that are None in place, return ({key: value to cache}, ttl) for them"""
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if not missing:
+        return {}, None
+    start = time.perf_counter()
+    computed = compute_scores(*([columns[name][i] for i in missing] for name in SCORE_FIELDS))
+    delta = (time.perf_counter() - start) / len(missing)
+    ttl = score_ttl()
+    for i, score in zip(missing, computed):
+        scores[i] = score
+    return {keys[i]: pack_score(scores[i], ttl, delta) for i in missing}, ttl
+
+
+def get_scores(store, columns):
+    """get_score for many users given as {field: column of values}.
+
+    The cache is read and written in one round trip each; scores computed together
+    share one jittered TTL.
+    """
+    keys = score_keys(columns)
+    cached = store.cache_get_many(list(dict.fromkeys(keys)))
+    scores = [cached_score(cached.get(key)) for key in keys]
+    values, ttl = missing_scores(keys, columns, scores)
+    if values:
+        store.cache_set_many(values, ttl)
+    return scores
+
+
+async def get_scores_async(store, columns):
+    keys = score_keys(columns)
+    cached = await store.cache_get_many(list(dict.fromkeys(keys)))
+    scores = [cached_score(cached.get(key)) for key in keys]
+    values, ttl = missing_scores(keys, columns, scores)
+    if values:
+        await store.cache_set_many(values, ttl)
+    return scores
+
+
+def interests_key(cid):
+    return "i:%s" % cid
+
+
 def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    return parse_interests(store.get(interests_key(cid)))
+
+
+def interests_bucket(cid):
+    """Hash key and field holding cid's interests in the compact layout"""
+    return "ib:%d" % (cid // INTERESTS_BUCKET_SIZE), str(cid % INTERESTS_BUCKET_SIZE)
+
+
+class InterestsDictionary:
+    """Interest names interned as small integer codes, kept in the INTERESTS_DICT_KEY hash.
+
+    In the compact layout a client's interests are stored as comma separated codes in
+    a field of a bucket hash (see interests_bucket). The codes are cached in process
+    and reloaded, at most every refresh_interval seconds, when an unknown one shows
+    up. encode() assigns codes to new names and assumes nobody else does at the same
+    time: run one loader or migration at a time.
+    """
+
+    def __init__(self, store, refresh_interval=1):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.names = {}
+        self.codes = {}
+        # code -> name encoded as a JSON string, for responses built without re-encoding
+        self.json_names = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        names = {int(code): name for code, name in self.store.hgetall_with_retry(INTERESTS_DICT_KEY).items()}
+        self.add(names)
+
+    def add(self, names):
+        """Remember {code: name}; lookups replace whole dicts, so readers never see a half-updated one"""
+        self.json_names = {**self.json_names, **{str(code): codec.dumps(name).decode('utf-8')
+                                                 for code, name in names.items()}}
+        self.names = {**self.names, **{str(code): name for code, name in names.items()}}
+        self.codes = {**self.codes, **{name: code for code, name in names.items()}}
+
+    def _lookup(self, value, table_name):
+        codes = value.split(",") if value else []
+        table = getattr(self, table_name)
+        if not all(code in table for code in codes):
+            with self._lock:
+                now = time.monotonic()
+                if self._refreshed_at is None or now - self._refreshed_at >= self.refresh_interval:
+                    self._refreshed_at = now
+                    self.refresh()
+            table = getattr(self, table_name)
+            unknown = [code for code in codes if code not in table]
+            if unknown:
+                raise StoreGetException(f"Unknown interest codes {', '.join(unknown)}")
+        return [table[code] for code in codes]
+
+    def decode(self, value):
+        return self._lookup(value, "names")
+
+    def decode_json(self, value):
+        """Interests as a JSON array string"""
+        return "[" + ",".join(self._lookup(value, "json_names")) + "]"
+
+    def encode(self, interests):
+        new = [name for name in dict.fromkeys(interests) if name not in self.codes]
+        if new:
+            if self._refreshed_at is None:
+                self._refreshed_at = time.monotonic()
+                self.refresh()
+                new = [name for name in new if name not in self.codes]
+            start = max(self.codes.values(), default=0) + 1
+            names = {code: name for code, name in enumerate(new, start)}
+            if names:
+                self.store.hset_many_with_retry({INTERESTS_DICT_KEY: names})
+                self.add(names)
+        return ",".join(str(self.codes[name]) for name in interests)
+
+
+def get_interests_compact(store, dictionary, cids, as_json=False):
+    """{cid: interests} of cids stored in the compact layout, one HMGET per bucket in one round trip"""
+    buckets = {}
+    for cid in cids:
+        key, field = interests_bucket(cid)
+        buckets.setdefault(key, {})[field] = cid
+    replies = store.cache_hmget_many([(key, list(fields)) for key, fields in buckets.items()])
+    decode = dictionary.decode_json if as_json else dictionary.decode
+    interests = {}
+    for fields, values in zip(buckets.values(), replies):
+        for cid, value in zip(fields.values(), values):
+            if value is not None:
+                interests[cid] = decode(value)
+    return interests
+
+
+def set_interests_compact(store, dictionary, interests):
+    """Write {cid: interests} to bucket hashes in one round trip"""
+    hashes = {}
+    for cid, names in interests.items():
+        key, field = interests_bucket(cid)
+        hashes.setdefault(key, {})[field] = dictionary.encode(names)
+    if hashes:
+        store.hset_many_with_retry(hashes)
+
+
+def get_interests_many(store, cids, dictionary=None):
+    """{cid: interests}, with a dictionary the compact layout is read first and the JSON keys for the rest"""
+    interests = {}
+    rest = cids
+    if dictionary is not None:
+        interests = get_interests_compact(store, dictionary, cids)
+        rest = [cid for cid in cids if cid not in interests]
+    if rest or dictionary is None:
+        values = store.get_many([interests_key(cid) for cid in rest])
+        interests.update((cid, parse_interests(values[interests_key(cid)])) for cid in rest)
+    return {cid: interests[cid] for cid in cids}
+
+
+async def get_interests_many_async(store, cids):
+    values = await store.get_many([interests_key(cid) for cid in cids])
+    return {cid: parse_interests(values[interests_key(cid)]) for cid in cids}
+
+
+def get_interests_raw(store, cids, validate_rate=1.0, dictionary=None):
+    """get_interests_many as a codec.RawJSON {"cid": interests} object, stored JSON is copied without decoding"""
+    cids = list(dict.fromkeys(cids))
+    values = {}
+    if dictionary is not None:
+        values = get_interests_compact(store, dictionary, cids, as_json=True)
+    rest = [cid for cid in cids if cid not in values]
+    if rest:
+        keys = [interests_key(cid) for cid in rest]
+        stored = store.get_many(keys)
+        values.update(zip(rest, validate_interests([stored[key] for key in keys], validate_rate)))
+    return join_interests(cids, [values[cid] for cid in cids])
+
+
+async def get_interests_raw_async(store, cids, validate_rate=1.0):
+    cids = list(dict.fromkeys(cids))
+    keys = [interests_key(cid) for cid in cids]
+    values = await store.get_many(keys)
+    return join_interests(cids, validate_interests([values[key] for key in keys], validate_rate))
+
+
+def validate_interests(values, validate_rate):
+    """Stored values are trusted to be valid JSON as written by the loader; for a
+    validate_rate share of calls they are decoded anyway, so broken data does not go unnoticed.
+    """
+    if validate_rate and random.random() < validate_rate:
+        for value in values:
+            parse_interests(value)
+    return values
+
+
+def join_interests(cids, values):
+    """Splice JSON values into one JSON object"""
+    return codec.RawJSON("{" + ",".join(['"%s":%s' % (cid, value or "[]") for cid, value in zip(cids, values)]) + "}")
+
+
+def parse_interests(value):
+    return codec.loads(value) if value else []
@@ -0,0 +1,227 @@
+import collections
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+
+class ReusePortHTTPServer(HTTPServer):
+    """HTTPServer that can share its listen address with sibling processes via SO_REUSEPORT"""
+
+    def __init__(self, server_address, handler_class, reuse_port=False, bind_and_activate=True):
+        self.reuse_port = reuse_port
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def keep_alive(self):
+        """Whether a connection that was just served may stay open for the next request"""
+        # the only thread would wait on an idle client while others queue behind it
+        return False
+
+
+class QueueWaitTracker:
+    """Accept times of connections waiting for a worker thread, oldest first"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._waiting = collections.OrderedDict()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        """Record a newly queued connection, return its ticket for remove()"""
+        with self._lock:
+            self._next += 1
+            self._waiting[self._next] = self.clock()
+            return self._next
+
+    def remove(self, ticket):
+        with self._lock:
+            self._waiting.pop(ticket, None)
+
+    def oldest_wait(self):
+        """Seconds the longest waiting connection has been queued, 0 when none waits"""
+        with self._lock:
+            if not self._waiting:
+                return 0.0
+            accepted_at = next(iter(self._waiting.values()))
+        return self.clock() - accepted_at
+
+    def __len__(self):
+        with self._lock:
+            return len(self._waiting)
+
+
+class ThreadPoolHTTPServer(ReusePortHTTPServer):
+    """Dispatches accepted connections to a fixed pool of worker threads"""
+
+    def __init__(self, server_address, handler_class, threads=8, reuse_port=False, bind_and_activate=True):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http-worker')
+        self._queued = QueueWaitTracker()
+        self.threads = threads
+        self._active = 0
+        self._active_lock = threading.Lock()
+        super().__init__(server_address, handler_class, reuse_port, bind_and_activate)
+
+    def queue_wait(self):
+        """Seconds the longest waiting accepted connection has been waiting for a thread"""
+        return self._queued.oldest_wait()
+
+    def keep_alive(self):
+        # idle connections may hold all threads but one, which stays free for new
+        # connections; nothing is kept open while connections wait for a thread
+        return len(self._queued) == 0 and self._active < self.threads
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address, self._queued.add())
+
+    def process_request_thread(self, request, client_address, ticket=None):
+        self._queued.remove(ticket)
+        with self._active_lock:
+            self._active += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._active_lock:
+                self._active -= 1
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # let in-flight requests finish before the process goes away
+        self._pool.shutdown(wait=True)
+
+
+def make_server(address, port, handler_class, threads=1, reuse_port=False):
+    if threads > 1:
+        return ThreadPoolHTTPServer((address, port), handler_class, threads=threads, reuse_port=reuse_port)
+    return ReusePortHTTPServer((address, port), handler_class, reuse_port=reuse_port)
+
+
+def serve_forever(server):
+    """Run server until SIGTERM/SIGINT, then stop accepting and drain in-flight requests"""
+
+    def stop(signum, frame):
+        logging.info("Got signal %s, shutting down" % signum)
+        # shutdown() blocks until serve_forever() returns, so it must not run in the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class PreforkServer:
+    """Forks worker processes, each serving the same address through its own SO_REUSEPORT socket.
+
+    A worker that exits is respawned. Workers exiting within MIN_UPTIME seconds of
+    their start count as failed to start: they are respawned with exponential backoff,
+    and after max_failures of them in a row the master stops and sets `failed`.
+    """
+    MIN_UPTIME = 5
+    RESPAWN_BACKOFF = 0.5
+    MAX_RESPAWN_BACKOFF = 30
+
+    def __init__(self, address, port, handler_class, workers=2, threads=1, on_exit=None, max_failures=5,
+                 on_worker_exit=None):
+        """on_exit is called in a worker once it stopped serving, before the process exits;
+        on_worker_exit is called in the master with the pid of every worker that exited
+        """
+        self.address = address
+        self.port = port
+        self.handler_class = handler_class
+        self.workers = workers
+        self.threads = threads
+        self.on_exit = on_exit
+        self.on_worker_exit = on_worker_exit
+        self.max_failures = max_failures
+        self.failed = False
+        # pid -> time.monotonic() it was started at
+        self._children = {}
+        self._failures = 0
+        self._stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.monotonic()
+            return
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            server = make_server(self.address, self.port, self.handler_class,
+                                 threads=self.threads, reuse_port=True)
+            logging.info("Worker %s started" % os.getpid())
+            serve_forever(server)
+        except Exception:
+            logging.exception("Worker %s failed" % os.getpid())
+            code = 1
+        finally:
+            if self.on_exit:
+                try:
+                    self.on_exit()
+                except Exception:
+                    logging.exception("Worker %s failed to clean up" % os.getpid())
+            # os._exit skips atexit, flush queued log records explicitly
+            logging.shutdown()
+            os._exit(code)
+
+    def stop(self, signum=signal.SIGTERM, frame=None):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._children.pop(pid, None)
+
+    def respawn(self, pid, status, started):
+        """Replace a worker that exited, False when workers keep failing to start"""
+        if started is not None and time.monotonic() - started < self.MIN_UPTIME:
+            self._failures += 1
+        else:
+            self._failures = 0
+        if self._failures >= self.max_failures:
+            logging.error("Worker %s exited with status %s, %s workers in a row failed to start, stopping" %
+                          (pid, status, self._failures))
+            return False
+        delay = min(self.RESPAWN_BACKOFF * 2 ** (self._failures - 1), self.MAX_RESPAWN_BACKOFF) if self._failures else 0
+        logging.error("Worker %s exited with status %s, respawning in %.1fs" % (pid, status, delay))
+        deadline = time.monotonic() + delay
+        # short sleeps, so a stop signal does not wait for the whole backoff
+        while not self._stopping and time.monotonic() < deadline:
+            time.sleep(max(0, min(0.1, deadline - time.monotonic())))
+        if not self._stopping:
+            self.spawn()
+        return True
+
+    def serve_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self._children.pop(pid, None)
+            if self.on_worker_exit is not None:
+                self.on_worker_exit(pid)
+            if not self._stopping and not self.respawn(pid, status, started):
+                self.failed = True
+                self.stop()
+        logging.info("All workers stopped")
@@ -0,0 +1,239 @@
+"""Read-only interests snapshot file, served from memory-mapped pages.
+
+Layout, little endian:
+  header   8 byte magic, uint64 count
+  ids      count int64 client ids, sorted
+  offsets  count + 1 uint64 offsets of payloads, relative to the payload region
+  payload  compact JSON interests of every client, in ids order
+
+Build one from redis or from a loader input file:
+    python snapshot.py --cache_port 6379 --output interests.snap
+    python snapshot.py --input interests.jsonl --output interests.snap
+
+The file is written next to the output and renamed over it, so servers never see a
+partial snapshot and pick up the new one on their next check.
+"""
+import array
+import bisect
+import itertools
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import codec
+import loader
+import scoring
+from exceptions import ValidationError
+from store import Store
+
+MAGIC = b"ISNAP001"
+HEADER = struct.Struct("<8sQ")
+
+
+class Snapshot:
+    """Client id -> interests JSON lookups by binary search over a memory-mapped snapshot file.
+
+    Pages are mapped read-only from the page cache, so every process serving the
+    same file shares them, and lookups copy nothing but the returned value.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.stat = os.fstat(f.fileno())
+        size = len(self._mmap)
+        if size < HEADER.size:
+            raise ValueError(f"{path} is not an interests snapshot")
+        magic, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an interests snapshot")
+        ids_end = HEADER.size + 8 * count
+        offsets_end = ids_end + 8 * (count + 1)
+        if offsets_end > size:
+            raise ValueError(f"{path} is truncated: {count} clients need {offsets_end} bytes, it has {size}")
+        view = memoryview(self._mmap)
+        self.ids = view[HEADER.size:ids_end].cast('q')
+        self.offsets = view[ids_end:offsets_end].cast('Q')
+        self.payload = view[offsets_end:]
+        if self.offsets[count] > len(self.payload):
+            raise ValueError(f"{path} is truncated: payload ends before offset {self.offsets[count]}")
+
+    def get(self, cid):
+        """Interests JSON of cid as a memoryview into the mapping, None when cid is not in the snapshot"""
+        i = bisect.bisect_left(self.ids, cid)
+        if i == len(self.ids) or self.ids[i] != cid:
+            return None
+        return self.payload[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def build(records, path):
+    """Write a snapshot of (cid, interests) records to path, return the number of clients.
+
+    Payloads are spooled to a temporary file, so memory holds only the index: 24 bytes per client.
+    """
+    ids, offsets, lengths = array.array('q'), array.array('Q'), array.array('Q')
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as payload:
+        for cid, interests in records:
+            value = codec.dumps(interests)
+            ids.append(cid)
+            offsets.append(payload.tell())
+            lengths.append(len(value))
+            payload.write(value)
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        for a, b in zip(order, order[1:]):
+            if ids[a] == ids[b]:
+                raise ValidationError(f"Client {ids[a]} is in the input twice")
+        sorted_offsets = array.array('Q', [0])
+        for i in order:
+            sorted_offsets.append(sorted_offsets[-1] + lengths[i])
+
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, len(ids)))
+                out.write(array.array('q', (ids[i] for i in order)).tobytes())
+                out.write(sorted_offsets.tobytes())
+                for i in order:
+                    payload.seek(offsets[i])
+                    out.write(payload.read(lengths[i]))
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp, 0o644)
+            # readers open either the old or the new file, never a partial one
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return len(ids)
+
+
+class SnapshotBackend:
+    """Answers interests_key reads from a Snapshot, everything else goes to the wrapped backend.
+
+    Clients missing from the snapshot are looked up in the wrapped backend too. Store
+    reads snapshot hits through get_local() before its retries and circuit breaker, so
+    they are served while the wrapped backend is down. The snapshot file is checked for
+    a new version at most every check_interval seconds and swapped in without blocking
+    readers.
+    """
+
+    def __init__(self, path, backend, check_interval=1):
+        self.path = path
+        self.backend = backend
+        self.check_interval = check_interval
+        self.snapshot = Snapshot(path)
+        self._next_check = time.monotonic() + check_interval
+        self._prefix = scoring.interests_key("")
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def current(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self.reload()
+        return self.snapshot
+
+    def reload(self):
+        try:
+            stat = os.stat(self.path)
+            old = self.snapshot.stat
+            if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == (old.st_ino, old.st_size, old.st_mtime_ns):
+                return
+            self.snapshot = Snapshot(self.path)
+            logging.info("Loaded interests snapshot %s with %s clients" % (self.path, len(self.snapshot)))
+        except (OSError, ValueError) as e:
+            logging.error("Can not load interests snapshot %s: %s" % (self.path, e))
+
+    def lookup(self, snapshot, key):
+        if not key.startswith(self._prefix):
+            return None
+        try:
+            value = snapshot.get(int(key[len(self._prefix):]))
+        except ValueError:
+            return None
+        return None if value is None else str(value, 'utf-8')
+
+    def get_local(self, keys):
+        """{key: value} of the keys answered by the snapshot, without touching the wrapped backend"""
+        snapshot = self.current()
+        values = {}
+        for key in keys:
+            value = self.lookup(snapshot, key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def get(self, key):
+        value = self.lookup(self.current(), key)
+        return value if value is not None else self.backend.get(key)
+
+    def get_many(self, keys):
+        snapshot = self.current()
+        values = [self.lookup(snapshot, key) for key in keys]
+        rest = [key for key, value in zip(keys, values) if value is None]
+        if rest:
+            fetched = iter(self.backend.get_many(rest))
+            values = [next(fetched) if value is None else value for value in values]
+        return values
+
+
+def redis_records(store, batch_size=1000):
+    keys = store.backend.scan(scoring.interests_key("*"), count=batch_size)
+    prefix = scoring.interests_key("")
+    for batch in iter(lambda: list(itertools.islice(keys, batch_size)), []):
+        for key, value in zip(batch, store.get_many_with_retry(batch)):
+            if value is None:
+                continue
+            try:
+                cid, interests = int(key[len(prefix):]), codec.loads(value)
+                loader.validate(cid, interests)
+            except (ValueError, ValidationError) as e:
+                logging.warning("Skip %s: %s" % (key, e))
+                continue
+            yield cid, interests
+
+
+def file_records(path, fmt):
+    with open(path, "rb") as f:
+        for _, number, cid, interests in loader.read_records(f, loader.PARSERS[fmt]):
+            if cid is None:
+                logging.warning("Skip line %s: %s" % (number, interests))
+                continue
+            yield cid, interests
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-o", "--output", action="store", help="snapshot file to publish")
+    op.add_option("-i", "--input", action="store", default=None, help="loader input file instead of redis")
+    op.add_option("-f", "--format", action="store", type="choice", choices=["jsonl", "csv"], default=None)
+    op.add_option("--cache_host", action="store", type=str, default='localhost')
+    op.add_option("--cache_port", action="store", type=int, default=6379)
+    (opts, args) = op.parse_args()
+    if not opts.output:
+        op.error("--output is required")
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    started = time.monotonic()
+    if opts.input:
+        records = file_records(opts.input, opts.format or os.path.splitext(opts.input)[1].lstrip(".").lower())
+    else:
+        records = redis_records(Store(host=opts.cache_host, port=opts.cache_port))
+    try:
+        count = build(records, opts.output)
+    except Exception as e:
+        logging.error("Snapshot failed: %s" % e)
+        sys.exit(1)
+    logging.info("Published %s with %s clients in %.1fs" % (opts.output, count, time.monotonic() - started))
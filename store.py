@@ -1,66 +1,463 @@
 import logging
+import os
+import random
+import threading
 import time
 from functools import wraps
 
-import redis
 from redis.exceptions import TimeoutError, ConnectionError
 
-from exceptions import StoreGetException
+import metrics
+from backends import RedisBackend, chunks
+from exceptions import StoreGetException, CircuitOpenError
+from timing import request_context, add_timing, add_span, remaining, check_deadline, MIN_TIMEOUT
 
 
-def retry(tries=3, delay=0.5):
+class CircuitBreaker:
+    """Stops calling a failing backend for reset_timeout seconds after failure_threshold failures in a row.
+
+    After the timeout a single probe call is let through (half open): success closes
+    the breaker, failure opens it again. on_state_change(old, new) callbacks are
+    called on every transition.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=5, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = list(on_state_change or [])
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def release(self):
+        """End a call that neither proved nor disproved the backend is reachable (it failed for
+        another reason), so a half open breaker lets the next probe through
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        old, self.state = self.state, state
+        logging.warning("Circuit breaker %s -> %s after %s failure(s)" % (old, state, self.failures))
+        for callback in self.on_state_change:
+            callback(old, state)
+
+
+class RetryBudget:
+    """Caps retries to `ratio` of calls, so retries can not multiply load on a struggling backend.
+
+    Every call deposits `ratio` tokens and every retry withdraws one; the bucket
+    starts with and never exceeds max_tokens.
+    """
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def observe_store_call(op, seconds):
+    metrics.STORE_LATENCY.observe(seconds, op)
+    ctx = request_context.get()
+    if ctx is not None:
+        add_timing(ctx, "store", seconds)
+        # a span per round trip, so slow ones stand out
+        add_span(ctx, "store." + op, time.perf_counter() - seconds, seconds)
+
+
+def retry(tries=3, delay=0.05, max_delay=1, deadline=2):
+    """Retry a store method on redis connection errors.
+
+    Delays grow exponentially with full jitter and no retry starts once `deadline`
+    seconds have passed since the first attempt, or once the deadline of the request
+    being served (see timing.remaining) would pass; a call made after the request
+    deadline raises DeadlineExceeded without touching redis, and a call that timed out
+    at the request deadline does not count as a backend failure. The instance's `breaker`
+    (CircuitBreaker) and `retry_budget` (RetryBudget), when set, are consulted
+    before every attempt, so calls fail fast with CircuitOpenError while redis is down.
+    """
+
     def deco_retry(f):
+        op = f.__name__.replace('_with_retry', '')
+
         @wraps(f)
-        def wrapper(*args, **kwargs):
-            local_tries, local_delay = tries, delay
-            while local_tries > 0:
+        def wrapper(self, *args, **kwargs):
+            breaker = getattr(self, 'breaker', None)
+            budget = getattr(self, 'retry_budget', None)
+            if budget:
+                budget.deposit()
+            started = time.monotonic()
+            left = remaining()
+            limit = deadline if left is None else min(deadline, left)
+            attempt = 0
+            while True:
+                check_deadline()
+                if breaker and not breaker.allow():
+                    raise CircuitOpenError(f"Circuit breaker is open, skip {f.__name__}")
+                start = time.perf_counter()
                 try:
-                    return f(*args, **kwargs)
+                    result = f(self, *args, **kwargs)
                 except (TimeoutError, ConnectionError) as e:
-                    msg = '{}, Retrying in {} seconds...'.format(e, local_delay)
+                    observe_store_call(op, time.perf_counter() - start)
+                    left = remaining()
+                    if left is not None and left <= MIN_TIMEOUT:
+                        # the socket timeout was cut by this request's own deadline,
+                        # that says nothing about the backend's health
+                        if breaker:
+                            breaker.release()
+                        raise
+                    if breaker:
+                        breaker.record_failure()
+                    local_delay = random.uniform(0, min(max_delay, delay * 2 ** attempt))
+                    if (attempt >= tries or time.monotonic() - started + local_delay > limit or
+                            (budget and not budget.withdraw())):
+                        raise
+                    msg = '{}, Retrying in {:.3f} seconds...'.format(e, local_delay)
                     logging.info(msg)
+                    metrics.STORE_RETRIES.inc(op)
                     time.sleep(local_delay)
-                    local_tries -= 1
-            return f(*args, **kwargs)
+                    attempt += 1
+                except Exception:
+                    # e.g. a redis ResponseError or StoreFullException: not a connection problem,
+                    # but a half open breaker must not wait for this probe forever
+                    observe_store_call(op, time.perf_counter() - start)
+                    if breaker:
+                        breaker.release()
+                    raise
+                else:
+                    observe_store_call(op, time.perf_counter() - start)
+                    if breaker:
+                        breaker.record_success()
+                    return result
 
         return wrapper
 
     return deco_retry
 
 
-class Store:
-    SOCKET_TIMEOUT = 5
+class WriteBehind:
+    """Writes key-value pairs to a store from a background thread, in pipelined batches.
+
+    put() only records the write: a later write of the same key replaces a pending
+    one, and once max_pending keys wait for the writer, writes of new keys are dropped
+    and counted in metrics.STORE_WRITES_DROPPED. close() flushes what is pending.
+    """
+
+    def __init__(self, store, max_pending=10000, batch_size=500):
+        self.store = store
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._start()
+        # threads do not survive fork, every pre-fork worker needs its own writer
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._pending = {}
+        # the batch being written, readable until the writes return
+        self._flushing = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="store-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, key, value, ttl=None):
+        with self._cond:
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                metrics.STORE_WRITES_DROPPED.inc()
+                return
+            self._pending[key] = (value, ttl)
+            self._cond.notify()
+
+    def get(self, key):
+        """Value of a write that is not flushed yet, or None"""
+        entry = self._pending.get(key) or self._flushing.get(key)
+        return entry[0] if entry else None
+
+    def get_many(self, keys):
+        """{key: value} of the keys with writes that are not flushed yet"""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # published before _pending is replaced, so readers always see the writes
+                self._flushing = pending = self._pending
+                self._pending = {}
+            try:
+                self.flush(pending)
+            finally:
+                self._flushing = {}
+
+    def flush(self, pending):
+        by_ttl = {}
+        for key, (value, ttl) in pending.items():
+            by_ttl.setdefault(ttl, []).append((key, value))
+        for ttl, items in by_ttl.items():
+            for batch in chunks(items, self.batch_size):
+                try:
+                    self.store.set_many_with_retry(dict(batch), ttl)
+                except Exception as e:
+                    logging.error(str(e))
+                    metrics.STORE_WRITES_DROPPED.inc(amount=len(batch))
 
-    def __init__(self, host='localhost', port=6379):
-        pool = redis.ConnectionPool(host=host,
-                                    port=port,
-                                    decode_responses=True,
-                                    socket_timeout=self.SOCKET_TIMEOUT)
-        self._client = redis.Redis(connection_pool=pool)
+    def close(self, timeout=5):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+class BaseStore:
+    """Strict reads on top of cache_get/cache_get_many provided by subclasses"""
 
     def get(self, name):
         value = self.cache_get(name)
         if not value:
+            check_deadline()
             raise StoreGetException(f"Can not get value from store by key {name}")
         return value
 
+    def get_many(self, names):
+        """Get values for all names, raise StoreGetException naming every missing key"""
+        values = self.cache_get_many(names)
+        missing = [name for name, value in values.items() if not value]
+        if missing:
+            # values missing because the request ran out of time are not a data problem
+            check_deadline()
+            raise StoreGetException(f"Can not get values from store by keys {', '.join(missing)}")
+        return values
+
     def cache_get(self, name):
+        raise NotImplementedError
+
+    def cache_get_many(self, names):
+        raise NotImplementedError
+
+
+class Store(BaseStore):
+    """Store on a key-value backend (redis by default) with retries, a circuit breaker and an optional local cache"""
+    SOCKET_TIMEOUT = RedisBackend.SOCKET_TIMEOUT
+    CHUNK_SIZE = 500
+
+    def __init__(self, host='localhost', port=6379, chunk_size=CHUNK_SIZE, local_cache=None, breaker=None,
+                 retry_budget=None, backend=None, write_behind_size=0):
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.on_state_change.append(lambda old, new: metrics.BREAKER_TRANSITIONS.inc(new))
+        self.retry_budget = retry_budget or RetryBudget()
+        # optional cache.LocalCache served before the backend
+        self.local_cache = local_cache
+        # backends.RedisBackend or backends.MemoryBackend
+        if backend is None:
+            backend = RedisBackend(host=host, port=port, chunk_size=chunk_size, socket_timeout=self.SOCKET_TIMEOUT)
+        self.backend = backend
+        # backends answering some keys in process (snapshot.SnapshotBackend) serve them outside retries and the breaker
+        self._get_local = getattr(backend, "get_local", None)
+        # cache writes leave the request path when write behind is on
+        self.write_behind = WriteBehind(self, max_pending=write_behind_size) if write_behind_size else None
+
+    def cache_get_many(self, names):
+        """Get values for all names in one round trip, missing values are None"""
+        values = {}
+        if self.local_cache is not None:
+            for name in names:
+                value = self.local_cache.get(name)
+                if value is not None:
+                    values[name] = value
+        if self._get_local is not None:
+            values.update(self._get_local([name for name in names if name not in values]))
+        if self.write_behind is not None:
+            for name, value in self.write_behind.get_many([name for name in names if name not in values]).items():
+                values[name] = str(value)
+        remote = [name for name in names if name not in values]
+        if not remote:
+            return values
         try:
-            return self.get_with_retry(name)
+            fetched = dict(zip(remote, self.get_many_with_retry(remote)))
+        except Exception as e:
+            logging.error(str(e))
+            fetched = dict.fromkeys(remote)
+        if self.local_cache is not None:
+            for name, value in fetched.items():
+                self.local_cache.set(name, value)
+        values.update(fetched)
+        return values
+
+    def cache_get(self, name):
+        if self.local_cache is not None:
+            value = self.local_cache.get(name)
+            if value is not None:
+                return value
+        if self._get_local is not None:
+            value = self._get_local([name]).get(name)
+            if value is not None:
+                return value
+        if self.write_behind is not None:
+            value = self.write_behind.get(name)
+            if value is not None:
+                return str(value)
+        try:
+            value = self.get_with_retry(name)
         except Exception as e:
             logging.error(str(e))
             return None
+        if self.local_cache is not None:
+            self.local_cache.set(name, value)
+        return value
 
     def cache_set(self, key, value, ttl=None):
+        if self.local_cache is not None:
+            # the backend returns strings, keep local hits consistent with that
+            self.local_cache.set(key, str(value), ttl)
+        if self.write_behind is not None:
+            self.write_behind.put(key, value, ttl)
+            return
         try:
             self.set_with_retry(key, value, ttl)
         except Exception as e:
             logging.error(str(e))
 
+    def cache_set_many(self, items, ttl=None):
+        """Set all key-value pairs of items in one round trip"""
+        if self.local_cache is not None:
+            for key, value in items.items():
+                self.local_cache.set(key, str(value), ttl)
+        if self.write_behind is not None:
+            for key, value in items.items():
+                self.write_behind.put(key, value, ttl)
+            return
+        try:
+            self.set_many_with_retry(items, ttl)
+        except Exception as e:
+            logging.error(str(e))
+
+    def close(self):
+        """Flush pending writes"""
+        if self.write_behind is not None:
+            self.write_behind.close()
+
     @retry(tries=3)
     def set_with_retry(self, key, value, ttl=None):
-        self._client.set(name=key, value=value, ex=ttl)
+        self.backend.set(key, value, ttl)
+
+    @retry(tries=3)
+    def set_many_with_retry(self, items, ttl=None):
+        self.backend.set_many(items, ttl)
+
+    def cache_hmget_many(self, requests):
+        """[(key, [field, ...]), ...] -> [[value or None, ...], ...] in one round trip, all None on errors"""
+        try:
+            return self.hmget_many_with_retry(requests)
+        except Exception as e:
+            logging.error(str(e))
+            return [[None] * len(fields) for _, fields in requests]
+
+    @retry(tries=3)
+    def hgetall_with_retry(self, key):
+        return self.backend.hgetall(key)
+
+    @retry(tries=3)
+    def hmget_many_with_retry(self, requests):
+        return self.backend.hmget_many(requests)
+
+    @retry(tries=3)
+    def hset_many_with_retry(self, hashes):
+        self.backend.hset_many(hashes)
+
+    @retry(tries=3)
+    def delete_many_with_retry(self, keys):
+        self.backend.delete_many(keys)
 
     @retry(tries=3)
     def get_with_retry(self, name):
-        return self._client.get(name)
+        return self.backend.get(name)
+
+    @retry(tries=3)
+    def get_many_with_retry(self, names):
+        return self.backend.get_many(names)
+
+
+class PrefetchedStore(BaseStore):
+    """Store view answering reads from values fetched up front in one round trip.
+
+    Keys that were not prefetched fall through to the wrapped store.
+    """
+
+    def __init__(self, store, values):
+        self.store = store
+        self.values = values
+
+    def cache_get(self, name):
+        if name in self.values:
+            return self.values[name]
+        return self.store.cache_get(name)
+
+    def cache_get_many(self, names):
+        values = {name: self.values[name] for name in names if name in self.values}
+        rest = [name for name in names if name not in self.values]
+        if rest:
+            values.update(self.store.cache_get_many(rest))
+        return values
+
+    def cache_set(self, key, value, ttl=None):
+        self.values[key] = str(value)
+        self.store.cache_set(key, value, ttl)
+
+    def cache_set_many(self, items, ttl=None):
+        self.values.update((key, str(value)) for key, value in items.items())
+        self.store.cache_set_many(items, ttl)
+
+    def cache_hmget_many(self, requests):
+        return self.store.cache_hmget_many(requests)
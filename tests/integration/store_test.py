@@ -47,6 +47,15 @@ class StoreTest(unittest.TestCase):
         actual = store.cache_get(key)
         self.assertEqual(actual, value)
 
+    def test_get_many(self):
+        store = Store(port=self.redis_port, chunk_size=2)
+        values = {f'many-{i}': f'value-{i}' for i in range(5)}
+        for key, value in values.items():
+            store.cache_set(key, value)
+        self.assertEqual(values, store.get_many(list(values)))
+        self.assertEqual({'many-0': 'value-0', 'many-missing': None},
+                         store.cache_get_many(['many-0', 'many-missing']))
+
     def test_get_not_exists_value(self):
         store = Store(port=self.redis_port)
         key = 'not_exists_key'
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock
+
+import api
+from aio_store import AsyncConnection
+from tests.unit import api_test
+
+
+class AsyncMethodHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = {}
+        self.store = AsyncMock()
+        self.store.cache_get.return_value = None
+
+    def get_response(self, request):
+        return asyncio.run(api.method_handler_async({"body": request, "headers": {}}, self.context, self.store))
+
+    def test_ok_score_request(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        api_test.ApiTest.set_valid_auth(None, request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(3.0, response["score"])
+        self.store.cache_set.assert_awaited_once()
+
+    def test_ok_interests_request(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        api_test.ApiTest.set_valid_auth(None, request)
+        self.store.get_many.side_effect = lambda keys: dict.fromkeys(keys, json.dumps(["cars", "pets"]))
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual({"1": ["cars", "pets"], "2": ["cars", "pets"]}, response)
+        self.assertEqual(2, self.context["nclients"])
+
+    def test_batch_request(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1]}}
+        api_test.ApiTest.set_valid_auth(None, request)
+        self.store.cache_get_many.side_effect = lambda keys: dict.fromkeys(keys, json.dumps(["cars"]))
+        response, code = self.get_response([request, dict(request, token="bad")])
+        self.assertEqual(api.OK, code)
+        self.assertEqual([{"response": {"1": ["cars"]}, "code": api.OK}, {"error": "Forbidden", "code": api.FORBIDDEN}],
+                         response)
+        self.store.get_many.assert_not_awaited()
+
+    def test_invalid_request(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": {}}
+        api_test.ApiTest.set_valid_auth(None, request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code)
+        self.assertTrue(len(response))
+
+
+class AsyncConnectionTest(unittest.TestCase):
+
+    def read_reply(self, data):
+        async def read():
+            conn = AsyncConnection('localhost', 6379, 1)
+            conn._reader = asyncio.StreamReader()
+            conn._reader.feed_data(data)
+            return await conn._read_reply()
+
+        return asyncio.run(read())
+
+    def test_pack(self):
+        self.assertEqual(b'*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n', AsyncConnection.pack('GET', 'key'))
+
+    def test_read_replies(self):
+        self.assertEqual('OK', self.read_reply(b'+OK\r\n'))
+        self.assertEqual('value', self.read_reply(b'$5\r\nvalue\r\n'))
+        self.assertIsNone(self.read_reply(b'$-1\r\n'))
+        self.assertEqual(['a', None], self.read_reply(b'*2\r\n$1\r\na\r\n$-1\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,16 @@
 import datetime
 import hashlib
 import json
+import time
 import unittest
 from unittest.mock import patch, Mock
 
 import api
+import codec
 import handlers
+import scoring
+from exceptions import StoreGetException
+from ratelimit import RateLimiter
 from tests.decorators import cases
 
 
@@ -19,6 +24,7 @@ class ApiTest(unittest.TestCase):
             store = Mock()
             store.cache_get.return_value = None
             store.get.return_value = None
+            store.get_many.return_value = {}
         return api.method_handler({"body": request, "headers": self.headers}, self.context, store)
 
     def set_valid_auth(self, request):
@@ -128,7 +134,7 @@ class ApiTest(unittest.TestCase):
         request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
         self.set_valid_auth(request)
         store_mock = store()
-        store_mock.get.return_value = json.dumps(["cars", "pets"])
+        store_mock.get_many.side_effect = lambda keys: dict.fromkeys(keys, json.dumps(["cars", "pets"]))
         response, code = self.get_response(request, store_mock)
         self.assertEqual(api.OK, code, arguments)
         self.assertEqual(len(arguments["client_ids"]), len(response))
@@ -143,11 +149,22 @@ class ApiTest(unittest.TestCase):
         arguments = {"client_ids": [client_id], "date": "19.07.2017"}
         request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
         store_mock = store()
-        store_mock.get.return_value = json.dumps(client_interests)
+        store_mock.get_many.side_effect = lambda keys: dict.fromkeys(keys, json.dumps(client_interests))
         self.set_valid_auth(request)
         response, code = self.get_response(request, store_mock)
         self.assertEqual(api.OK, code, arguments)
         self.assertEqual(response[str(client_id)], client_interests)
+        store_mock.get_many.assert_called_once_with([f"i:{client_id}"])
+
+    @patch('store.Store')
+    def test_interests_request_missing_in_store(self, store):
+        arguments = {"client_ids": [1, 2], "date": "19.07.2017"}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        store_mock = store()
+        store_mock.get_many.side_effect = StoreGetException("Can not get values from store by keys i:2")
+        self.set_valid_auth(request)
+        with self.assertRaises(StoreGetException):
+            self.get_response(request, store_mock)
 
     @patch('store.Store')
     def test_score_request_store(self, store):
@@ -162,6 +179,214 @@ class ApiTest(unittest.TestCase):
         actual_score = response.get("score")
         self.assertEqual(actual_score, expected_score)
 
+    def test_batch_request(self):
+        score_request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                         "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        interests_request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                             "arguments": {"client_ids": [1, 2]}}
+        invalid_request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                           "arguments": {}}
+        for request in (score_request, interests_request, invalid_request):
+            self.set_valid_auth(request)
+        store = Mock()
+        store.cache_get_many.side_effect = lambda keys: {
+            k: json.dumps(["cars"]) if k.startswith("i:") else "5.0" for k in keys}
+        response, code = self.get_response([score_request, interests_request,
+                                            dict(score_request, token="bad"), invalid_request, "junk"], store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.OK, api.FORBIDDEN, api.INVALID_REQUEST, api.INVALID_REQUEST],
+                         [r["code"] for r in response])
+        self.assertEqual({"score": 5.0}, response[0]["response"])
+        self.assertEqual({"1": ["cars"], "2": ["cars"]}, response[1]["response"])
+        store.cache_get_many.assert_called_once()
+        store.cache_get.assert_not_called()
+        store.get_many.assert_not_called()
+        self.assertEqual(["email", "phone"], sorted(self.context["batch"][0]["has"]))
+
+    def test_batch_request_too_large(self):
+        response, code = self.get_response([{}] * (api.MAX_BATCH_SIZE + 1))
+        self.assertEqual(api.INVALID_REQUEST, code)
+
+    def test_auth_digests_are_cached(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        api.user_digest.cache_clear()
+        self.get_response(dict(request))
+        _, code = self.get_response(dict(request))
+        self.assertEqual(api.OK, code)
+        self.assertEqual(1, api.user_digest.cache_info().hits)
+        self.assertIn("auth", self.context["timings"])
+        self.assertEqual(["validate", "auth", "validate", "handler"], [span[0] for span in self.context["spans"][-4:]])
+        self.assertRegex(api.response_headers(self.context, code)["Server-Timing"],
+                         r"^validate;dur=[\d.]+, auth;dur=[\d.]+, handler;dur=[\d.]+, total;dur=[\d.]+$")
+
+    @patch('handlers.ClientsInterestsHandler.raw_interests', True)
+    def test_ok_interests_request_raw(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        store = Mock()
+        store.get_many.side_effect = lambda keys: dict.fromkeys(keys, '["cars", "pets"]')
+        response, code = self.get_response(request, store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual({"response": {"1": ["cars", "pets"], "2": ["cars", "pets"]}, "code": api.OK},
+                         json.loads(codec.dumps(api.build_response(response, code))))
+        self.assertEqual(2, self.context["nclients"])
+
+    def test_online_score_batch(self):
+        records = [
+            {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+            {"phone": "89175002040", "email": "stupnikov@otus.ru"},
+            {"first_name": "a", "last_name": "b", "gender": 0, "birthday": "01.01.2000"},
+            {"gender": 1},
+            "junk",
+            {"phone": "79175002041", "email": "a@b", "gender": 1, "birthday": "01.01.2000"},
+        ]
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score_batch",
+                   "arguments": {"records": records}}
+        self.set_valid_auth(request)
+        cached_key = scoring.score_key("79175002040")
+        store = Mock()
+        store.cache_get_many.side_effect = lambda keys: {k: "5.0" if k == cached_key else None for k in keys}
+        response, code = self.get_response(request, store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual({"score": 5.0}, response[0])
+        self.assertEqual({"score": 0.5}, response[2])
+        self.assertEqual({"score": 4.5}, response[5])
+        self.assertIn("phone should start with 7", response[1]["error"])
+        self.assertIn("One of pairs", response[3]["error"])
+        self.assertEqual("record should be an object", response[4]["error"])
+        store.cache_get_many.assert_called_once()
+        values, ttl = store.cache_set_many.call_args.args
+        self.assertEqual({scoring.score_key(None, "01.01.2000", "a", "b"),
+                          scoring.score_key("79175002041", "01.01.2000")}, set(values))
+        self.assertEqual(6, self.context["nrecords"])
+
+    def test_online_score_batch_too_large(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score_batch",
+                   "arguments": {"records": [{}] * (handlers.OnlineScoreBatchRequest.max_records + 1)}}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code)
+
+    def test_rate_limit(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(request)
+        store = Mock()
+        store.get_many.side_effect = lambda keys: dict.fromkeys(keys, '["cars"]')
+        limiter = RateLimiter(rate=1, burst=5, max_concurrency={"clients_interests": 1})
+        with patch('handlers.RequestHandler.limiter', limiter):
+            _, code = self.get_response(dict(request), store)
+            self.assertEqual(api.OK, code)
+            self.assertEqual(0, limiter.in_flight("clients_interests"))
+            response, code = self.get_response(dict(request))
+            self.assertEqual(api.TOO_MANY_REQUESTS, code)
+            self.assertIn("rate", response)
+            self.assertEqual(1, self.context["retry_after"])
+            self.assertEqual("1", api.response_headers(self.context, code)["Retry-After"])
+            # other callers have their own bucket
+            other = dict(request, login="other")
+            self.set_valid_auth(other)
+            limiter.enter("clients_interests")
+            _, code = self.get_response(other)
+            self.assertEqual(api.TOO_MANY_REQUESTS, code)
+            limiter.leave("clients_interests")
+            _, code = self.get_response(other, store)
+            self.assertEqual(api.OK, code)
+
+    def test_rate_limit_batch(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(request)
+        store = Mock()
+        store.cache_get_many.side_effect = lambda keys: dict.fromkeys(keys, '["cars"]')
+        limiter = RateLimiter(rate=1, burst=5, max_concurrency={"clients_interests": 2})
+        with patch('handlers.RequestHandler.limiter', limiter):
+            response, code = self.get_response([request, request], store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.TOO_MANY_REQUESTS], [r["code"] for r in response])
+        self.assertEqual([scoring.interests_key(cid) for cid in (1, 2, 3)], store.cache_get_many.call_args.args[0])
+        self.assertEqual(0, limiter.in_flight("clients_interests"))
+
+    def test_rate_limit_batch_failed_preparation_releases_slots(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(request)
+        # no account: the digest can not be computed; falsy arguments that are not an object
+        no_account = {"login": "x", "method": "clients_interests", "token": "t", "arguments": {"client_ids": [1]}}
+        no_arguments = dict(request, arguments="")
+        store = Mock()
+        store.cache_get_many.side_effect = lambda keys: dict.fromkeys(keys, '["cars"]')
+        limiter = RateLimiter(rate=0, max_concurrency={"clients_interests": 2})
+        with patch('handlers.RequestHandler.limiter', limiter), self.assertLogs(level='ERROR'):
+            response, code = self.get_response([request, no_account, no_arguments], store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.INTERNAL_ERROR, api.INTERNAL_ERROR], [r["code"] for r in response])
+        self.assertEqual({"1": ["cars"], "2": ["cars"], "3": ["cars"]}, response[0]["response"])
+        self.assertEqual(0, limiter.in_flight("clients_interests"))
+
+    @cases([
+        (None, 0.3, 100.3),
+        ("0.05", 0.3, 100.05),
+        ("junk", 0.3, 100.3),
+        ("0", 0.3, 100.3),
+        ("-1", 0.3, 100.3),
+        ("1e9", 0.3, 100.3),
+        ("nan", 0.3, 100.3),
+        (None, 0, None),
+        ("0.05", 0, 100.05),
+    ])
+    def test_request_deadline(self, header, default, expected):
+        self.assertEqual(expected, api.request_deadline(100, header, default))
+
+    def test_deadline_exceeded(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        self.context["deadline"] = time.monotonic() - 1
+        store = Mock()
+        response, code = self.get_response(request, store)
+        self.assertEqual(api.GATEWAY_TIMEOUT, code)
+        store.cache_get.assert_not_called()
+
+    def test_deadline_exceeded_in_batch(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        store = Mock()
+        store.cache_get_many.side_effect = lambda keys: dict.fromkeys(keys, "5.0")
+        handle = handlers.OnlineScoreHandler.handle
+
+        def slow_handle(*args):
+            self.context["deadline"] = time.monotonic() - 1
+            return handle(*args)
+
+        with patch('handlers.OnlineScoreHandler.handle', autospec=True, side_effect=slow_handle):
+            response, code = self.get_response([request, request], store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.GATEWAY_TIMEOUT], [r["code"] for r in response])
+        self.assertEqual({"score": 5.0}, response[0]["response"])
+
+    def test_request_id_from_header(self):
+        get_request_id = api.MainHTTPHandler.get_request_id
+        self.assertEqual("req-1", get_request_id(None, {"X-Request-Id": "req-1"}))
+        self.assertEqual(32, len(get_request_id(None, {})))
+
+    @patch('api.time.time')
+    def test_admin_digest_changes_every_hour(self, now):
+        hour = datetime.datetime(2020, 7, 4, 10)
+        now.return_value = hour.timestamp()
+        first = api.admin_digest()
+        now.return_value = (hour + datetime.timedelta(minutes=59)).timestamp()
+        self.assertEqual(first, api.admin_digest())
+        now.return_value = (hour + datetime.timedelta(hours=1)).timestamp()
+        second = api.admin_digest()
+        expected = hashlib.sha512(("2020070411" + api.ADMIN_SALT).encode('utf-8')).hexdigest()
+        self.assertEqual(expected, second)
+        self.assertNotEqual(first, second)
+
 
 if __name__ == "__main__":
     unittest.main()
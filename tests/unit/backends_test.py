@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch
+
+import redis
+
+from backends import MemoryBackend, DeadlineConnection
+from exceptions import StoreFullException
+from store import Store
+
+
+class MemoryBackendTest(unittest.TestCase):
+
+    def test_get_and_set(self):
+        backend = MemoryBackend()
+        backend.set("i:1", '["books"]')
+        backend.set("uid:1", 3.0)
+        self.assertEqual('["books"]', backend.get("i:1"))
+        self.assertEqual("3.0", backend.get("uid:1"))
+        self.assertIsNone(backend.get("i:2"))
+
+    def test_bulk(self):
+        backend = MemoryBackend()
+        backend.set_many({"k1": "v1", "k2": "v2"})
+        self.assertEqual(["v1", None, "v2"], backend.get_many(["k1", "k3", "k2"]))
+
+    @patch('backends.time.monotonic')
+    def test_ttl_expires_lazily(self, monotonic):
+        monotonic.return_value = 100
+        backend = MemoryBackend(sweep_interval=3600)
+        backend.set("k", "v", ttl=10)
+        monotonic.return_value = 109
+        self.assertEqual("v", backend.get("k"))
+        monotonic.return_value = 110
+        self.assertIsNone(backend.get("k"))
+        self.assertEqual((0, 0, 1), (len(backend), backend.size_bytes, backend.expired))
+
+    @patch('backends.time.monotonic')
+    def test_sweep_removes_expired_keys(self, monotonic):
+        monotonic.return_value = 100
+        backend = MemoryBackend(sweep_interval=1)
+        backend.set_many({"k1": "v1", "k2": "v2"}, ttl=5)
+        backend.set("k2", "v2", ttl=60)
+        backend.set("k3", "v3")
+        monotonic.return_value = 106
+        backend.set("k4", "v4")
+        self.assertEqual(3, len(backend))
+        self.assertEqual({"keys": 3, "bytes": backend.size_bytes, "expired": 1}, backend.stats())
+        self.assertEqual("v2", backend.get("k2"))
+
+    def test_memory_limit(self):
+        backend = MemoryBackend(max_bytes=200)
+        backend.set("k", "v")
+        used = backend.size_bytes
+        with self.assertRaises(StoreFullException):
+            backend.set("big", "x" * 200)
+        backend.set("k", "w")
+        self.assertEqual(used, backend.size_bytes)
+        backend.delete("k")
+        self.assertEqual(0, backend.size_bytes)
+
+    def test_store_on_memory_backend(self):
+        store = Store(backend=MemoryBackend())
+        store.cache_set_many({"i:1": '["cars"]', "i:2": '["pets"]'})
+        store.cache_set("uid:1", 1.5, 60)
+        self.assertEqual({"i:1": '["cars"]', "i:2": '["pets"]'}, store.get_many(["i:1", "i:2"]))
+        self.assertEqual("1.5", store.cache_get("uid:1"))
+
+
+class DeadlineConnectionTest(unittest.TestCase):
+
+    def test_read_response_passes_arguments_through(self):
+        conn = DeadlineConnection()
+        with patch.object(redis.Connection, 'read_response', return_value=b'OK') as read_response:
+            self.assertEqual(b'OK', conn.read_response(disable_decoding=True))
+        read_response.assert_called_once_with(disable_decoding=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from benchmarks.common import metric
+from benchmarks.compare import compare
+from benchmarks.fake_redis import FakeRedis
+from benchmarks.load import parse_mix, percentile, preload, free_port, start_server, run_load, CLIENTS
+from tests.decorators import cases
+
+
+class CompareTest(unittest.TestCase):
+
+    @cases([
+        (metric(100, "ns/call", False), metric(109, "ns/call", False), False),
+        (metric(100, "ns/call", False), metric(111, "ns/call", False), True),
+        (metric(100, "ns/call", False), metric(50, "ns/call", False), False),
+        (metric(100, "req/s", True), metric(89, "req/s", True), True),
+        (metric(100, "req/s", True), metric(200, "req/s", True), False),
+        (metric(0, "requests", False), metric(1, "requests", False), True),
+    ])
+    def test_regression(self, old, new, regressed):
+        [(name, _, _, _, result)] = compare({"x": old}, {"x": new}, threshold=10)
+        self.assertEqual(regressed, result)
+
+    def test_only_common_metrics(self):
+        rows = compare({"a": metric(1, "ms", False), "b": metric(1, "ms", False)},
+                       {"b": metric(1, "ms", False), "c": metric(1, "ms", False)}, threshold=10)
+        self.assertEqual(["b"], [row[0] for row in rows])
+
+
+class LoadTest(unittest.TestCase):
+
+    def test_parse_mix(self):
+        self.assertEqual({"online_score": 3.0, "clients_interests": 1.0},
+                         parse_mix("online_score=3,clients_interests=1"))
+        self.assertEqual({"online_score": 1.0}, parse_mix("online_score"))
+        with self.assertRaises(ValueError):
+            parse_mix("unknown=1")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(51, percentile(values, 50))
+        self.assertEqual(100, percentile(values, 99))
+        self.assertEqual(0.0, percentile([], 99))
+
+    def test_run_load_against_fake_redis(self):
+        fake = FakeRedis()
+        preload(fake)
+        redis_port = free_port()
+        fake.start_in_thread(port=redis_port)
+        port = free_port()
+        proc = start_server(port, redis_port, [])
+        try:
+            results = run_load(f"http://127.0.0.1:{port}/method/", parse_mix("online_score,clients_interests"),
+                               duration=0.5, concurrency=2, users=10, clients=CLIENTS, batch=2, warmup=0)
+        finally:
+            proc.terminate()
+            proc.wait(10)
+        self.assertEqual(0, results["all.errors"]["value"])
+        self.assertGreater(results["online_score.rps"]["value"], 0)
+        self.assertGreater(results["clients_interests.rps"]["value"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from cache import LocalCache, SingleFlight, AsyncSingleFlight
+from store import Store
+
+
+class LocalCacheTest(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = LocalCache(ttl_policy={"i:": 10})
+        cache.set("i:1", "value")
+        self.assertEqual("value", cache.get("i:1"))
+        self.assertIsNone(cache.get("i:2"))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_keys_without_policy_are_not_cached(self):
+        cache = LocalCache(ttl_policy={"i:": 10})
+        cache.set("other", "value")
+        self.assertIsNone(cache.get("other"))
+        self.assertEqual(0, len(cache))
+
+    @patch('cache.time.monotonic')
+    def test_ttl_is_capped_by_policy(self, monotonic):
+        monotonic.return_value = 100
+        cache = LocalCache(ttl_policy={"uid:": 5})
+        cache.set("uid:1", "3.0", ttl=3600)
+        monotonic.return_value = 104
+        self.assertEqual("3.0", cache.get("uid:1"))
+        monotonic.return_value = 105
+        self.assertIsNone(cache.get("uid:1"))
+        self.assertEqual(0, len(cache))
+
+    def test_lru_eviction_by_entries(self):
+        cache = LocalCache(max_entries=2, ttl_policy={"": 10})
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual("1", cache.get("a"))
+        self.assertEqual(1, cache.evictions)
+
+    def test_eviction_by_bytes(self):
+        cache = LocalCache(max_bytes=300, ttl_policy={"": 10})
+        for i in range(10):
+            cache.set(f"k{i}", "x" * 50)
+        self.assertLessEqual(cache.size_bytes, 300)
+        self.assertEqual("x" * 50, cache.get("k9"))
+        self.assertIsNone(cache.get("k0"))
+
+
+class StoreLocalCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store(local_cache=LocalCache(ttl_policy={"i:": 10}))
+
+    def test_cache_get_served_locally(self):
+        with patch.object(self.store, 'get_with_retry', return_value='["cars"]') as get:
+            self.assertEqual('["cars"]', self.store.cache_get('i:1'))
+            self.assertEqual('["cars"]', self.store.get('i:1'))
+        get.assert_called_once_with('i:1')
+
+    def test_cache_get_many_fetches_only_local_misses(self):
+        self.store.local_cache.set('i:1', '["cars"]')
+        with patch.object(self.store, 'get_many_with_retry', return_value=['["pets"]', None]) as get_many:
+            values = self.store.cache_get_many(['i:1', 'i:2', 'i:3'])
+        get_many.assert_called_once_with(['i:2', 'i:3'])
+        self.assertEqual({'i:1': '["cars"]', 'i:2': '["pets"]', 'i:3': None}, values)
+        self.assertEqual('["pets"]', self.store.local_cache.get('i:2'))
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 42
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # let every thread reach the flight before the first call returns
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual([42] * 5, [result for result, _ in results])
+        self.assertEqual(1, [shared for _, shared in results].count(False))
+        self.assertEqual((42, False), flight.do("k", lambda: 42))
+
+    def test_error_is_not_cached(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do("k", lambda: 1 / 0)
+        self.assertEqual((1, False), flight.do("k", lambda: 1))
+
+    def test_async_calls_share_result(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 42
+
+        async def run():
+            return await asyncio.gather(*(flight.do("k", compute) for _ in range(3)))
+
+        self.assertEqual([(42, False), (42, True), (42, True)], asyncio.run(run()))
+        self.assertEqual(1, len(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
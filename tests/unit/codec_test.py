@@ -0,0 +1,57 @@
+import importlib
+import sys
+import unittest
+from unittest.mock import patch
+
+import codec
+
+
+class CodecTest(unittest.TestCase):
+
+    def backends(self):
+        yield codec
+        with patch.dict(sys.modules, {'orjson': None}):
+            yield importlib.reload(codec)
+        importlib.reload(codec)
+
+    def test_round_trip(self):
+        for backend in self.backends():
+            data = {"response": {"1": ["книги", "cars"], "score": 3.0}, "code": 200}
+            encoded = backend.dumps(data)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(data, backend.loads(encoded))
+
+    def test_decode_error(self):
+        for backend in self.backends():
+            with self.assertRaises(backend.DecodeError):
+                backend.loads(b'{not json')
+
+    def test_default(self):
+        for backend in self.backends():
+            self.assertEqual(b'{"body":"abc"}', backend.dumps({"body": b"abc"}, default=lambda o: o.decode()))
+
+    def test_raw_json_is_copied_as_is(self):
+        for backend in self.backends():
+            data = {"response": {"1": backend.RawJSON('["cars", "книги"]'), "2": backend.RawJSON(b'[]')}}
+            encoded = backend.dumps(data)
+            self.assertIn('"1":["cars", "книги"]'.encode('utf-8'), encoded)
+            self.assertEqual({"response": {"1": ["cars", "книги"], "2": []}}, backend.loads(encoded))
+
+    def test_raw_json_placeholder_can_not_be_forged(self):
+        for backend in self.backends():
+            data = {"1": backend.RawJSON('["cars"]'), "note": backend._RAW_MARK + "0"}
+            self.assertEqual({"1": ["cars"], "note": backend._RAW_MARK + "0"}, backend.loads(backend.dumps(data)))
+
+    def test_unknown_type(self):
+        for backend in self.backends():
+            with self.assertRaises(TypeError):
+                backend.dumps({"x": object()})
+
+    def test_stdlib_fallback(self):
+        with patch.dict(sys.modules, {'orjson': None}):
+            self.assertIsNone(importlib.reload(codec).orjson)
+        importlib.reload(codec)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
+from unittest.mock import patch
 
 from fields import CharField, ArgumentsField, EmailField, PhoneField, DateField, \
     BirthDayField, GenderField, ClientIDsField
+from handlers import Request
 from tests.decorators import cases
 
 
@@ -220,3 +222,29 @@ class FieldsTest(unittest.TestCase):
             test.client_ids_field = test_data['field'].get('value', {'key': 'value'})
 
         self.assertEqual(test_data['error'], str(exp.exception))
+
+    def test_compiled_request_validation(self):
+        class TestRequest(Request):
+            char_field = CharField(required=True, nullable=False)
+            gender_field = GenderField(required=False, nullable=False)
+            birthday_field = BirthDayField(required=False, nullable=True)
+
+        request = TestRequest({'char_field': 1, 'gender_field': 0, 'birthday_field': '01.01.2000'})
+        request.validate()
+        self.assertEqual(['char_field must be a str'], request.errors)
+        self.assertIsNone(request.char_field)
+        self.assertEqual(0, request.gender_field)
+        self.assertEqual('01.01.2000', request.birthday_field)
+        self.assertEqual(['char_field', 'gender_field', 'birthday_field'], TestRequest.fields)
+        self.assertFalse(hasattr(request, '__dict__'))
+
+    def test_birthday_field_parses_once(self):
+        class Test:
+            birthday_field = BirthDayField(required=True, nullable=False)
+
+        test = Test()
+        with patch('fields.datetime') as dt:
+            dt.datetime.strptime.return_value.year = 2000
+            dt.datetime.now.return_value.year = 2020
+            test.birthday_field = '01.01.2000'
+        dt.datetime.strptime.assert_called_once_with('01.01.2000', '%d.%m.%Y')
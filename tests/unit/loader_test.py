@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import loader
+from backends import MemoryBackend
+from store import Store
+
+
+class LoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = Store(backend=MemoryBackend())
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_load_jsonl(self):
+        path = self.write("interests.jsonl", '{"cid": 1, "interests": ["cars", "pets"]}\n'
+                                             '\n'
+                                             '{"cid": "2", "interests": ["cars"]}\n'
+                                             '{"cid": 3, "interests": []}\n'
+                                             'not json\n')
+        with self.assertLogs(level='INFO'):
+            progress = loader.load(self.store, path, "jsonl", chunk_size=2, ttl=60)
+        self.assertEqual((2, 2), (progress.written, progress.errors))
+        self.assertEqual('["cars","pets"]', self.store.backend.get("i:1"))
+        self.assertEqual('[]', self.store.backend.get("i:3"))
+        self.assertIsNone(self.store.backend.get("i:2"))
+
+    def test_load_csv(self):
+        path = self.write("interests.csv", 'cid,interests\n'
+                                           '1,cars;pets\n'
+                                           '2,"[""книги""]"\n'
+                                           'x,cars\n')
+        with self.assertLogs(level='INFO'):
+            progress = loader.load(self.store, path, "csv")
+        self.assertEqual((2, 1), (progress.written, progress.errors))
+        self.assertEqual('["cars","pets"]', self.store.backend.get("i:1"))
+        self.assertEqual('["книги"]', self.store.backend.get("i:2"))
+
+    def test_resume_from_state(self):
+        path = self.write("interests.jsonl", "".join(f'{{"cid": {i}, "interests": ["cars"]}}\n' for i in range(5)))
+        state = os.path.join(self.dir.name, "state")
+        with patch.object(self.store, 'set_many_with_retry', side_effect=[None, ConnectionError("down")]):
+            with self.assertRaises(ConnectionError):
+                loader.load(self.store, path, "jsonl", chunk_size=2, state_path=state)
+        offset = loader.load_state(state, path)
+        self.assertEqual(len('{"cid": 0, "interests": ["cars"]}\n') * 2, offset)
+
+        with self.assertLogs(level='INFO') as cm:
+            progress = loader.load(self.store, path, "jsonl", chunk_size=2, state_path=state)
+        self.assertIn("Resuming", "\n".join(cm.output))
+        self.assertEqual(3, progress.written)
+        self.assertEqual([None, None, '["cars"]', '["cars"]', '["cars"]'],
+                         self.store.backend.get_many([f"i:{i}" for i in range(5)]))
+
+    def test_clear_state(self):
+        path = self.write("interests.jsonl", "[]\n")
+        state = os.path.join(self.dir.name, "state")
+        with self.assertLogs(level='INFO'):
+            progress = loader.load(self.store, path, "jsonl", state_path=state)
+        self.assertEqual(0, progress.written)
+        self.assertFalse(os.path.exists(state))
+        loader.clear_state(state)
+        loader.save_state(state, path, 3)
+        loader.clear_state(state)
+        self.assertFalse(os.path.exists(state))
+
+    def test_max_errors(self):
+        path = self.write("interests.jsonl", "[]\n[]\n")
+        with self.assertLogs(level='INFO'):
+            with self.assertRaises(ValueError):
+                loader.load(self.store, path, "jsonl", max_errors=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
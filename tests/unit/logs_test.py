@@ -0,0 +1,69 @@
+import io
+import json
+import logging
+import unittest
+from unittest.mock import patch
+
+import metrics
+from logs import AsyncLogHandler, JsonFormatter, AccessLog
+
+
+class AsyncLogHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(JsonFormatter())
+        self.handler = AsyncLogHandler(target, queue_size=4, pressure=0.5)
+        self.logger = logging.getLogger('logs_test')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_lines(self):
+        self.logger.warning("plain %s", "message")
+        self.logger.warning({"request_id": "1", "body": b'{"a": 1}'})
+        self.handler.close()
+        self.assertEqual([("WARNING", "plain message"), ("WARNING", None)],
+                         [(line["level"], line.get("message")) for line in self.lines()])
+        self.assertEqual({"request_id": "1", "body": '{"a": 1}'},
+                         {k: self.lines()[1][k] for k in ("request_id", "body")})
+
+    def test_drops_under_pressure(self):
+        dropped = metrics.LOG_DROPPED.value()
+        with self.handler.target.lock:
+            # writer is stuck on the lock, the queue fills up
+            for i in range(10):
+                self.logger.warning("warning %s", i)
+            self.logger.info("info")
+        self.handler.close()
+        written = len(self.lines())
+        self.assertLess(written, 11)
+        self.assertEqual(11, written + metrics.LOG_DROPPED.value() - dropped)
+
+
+class AccessLogTest(unittest.TestCase):
+
+    @patch('logs.random.random', return_value=0.5)
+    def test_body_sampling(self, _):
+        with self.assertLogs('access') as cm, patch.object(AccessLog, 'body_sample_rate', 0.2):
+            AccessLog.log('/method/', {"request_id": "1"}, b'{}')
+        self.assertNotIn('body', cm.records[0].msg)
+        with self.assertLogs('access') as cm, patch.object(AccessLog, 'body_sample_rate', 0.7):
+            AccessLog.log('/method/', {"request_id": "1"}, b'{}')
+        self.assertEqual(b'{}', cm.records[0].msg['body'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+    def test_internal_keys_are_not_logged(self):
+        with self.assertLogs('access') as cm:
+            AccessLog.log('/method/', {"request_id": "1", "_started": 1.0})
+        self.assertEqual({"path": "/method/", "request_id": "1"}, cm.records[0].msg)
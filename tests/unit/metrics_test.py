@@ -0,0 +1,53 @@
+import os
+import unittest
+
+from metrics import Registry, Counter, Histogram
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry(capacity=256)
+
+    def test_counter(self):
+        counter = Counter("requests_total", "Requests", {"method": ("a", "b"), "code": ("200",)},
+                          registry=self.registry)
+        counter.inc("a", "200")
+        counter.inc("a", "200")
+        counter.inc("unknown", "200")
+        self.assertEqual(2, counter.value("a", "200"))
+        self.assertEqual(1, counter.value("other", "200"))
+        self.assertEqual("# HELP requests_total Requests\n"
+                         "# TYPE requests_total counter\n"
+                         'requests_total{method="a",code="200"} 2\n'
+                         'requests_total{method="other",code="200"} 1\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(4, histogram.count())
+        rendered = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', rendered)
+        self.assertIn('latency_seconds_bucket{le="1"} 3\n', rendered)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', rendered)
+        self.assertIn('latency_seconds_sum 3.65\n', rendered)
+        self.assertIn('latency_seconds_count 4\n', rendered)
+
+    def test_shared_with_forked_workers(self):
+        counter = Counter("forked_total", "Forked", registry=self.registry)
+        pid = os.fork()
+        if not pid:
+            counter.inc(amount=5)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        counter.inc()
+        self.assertEqual(6, counter.value())
+
+    def test_registry_capacity(self):
+        with self.assertRaises(ValueError):
+            Histogram("too_big", "Too big", {"label": [str(i) for i in range(100)]}, registry=self.registry)
+
+
+if __name__ == '__main__':
+    unittest.main()
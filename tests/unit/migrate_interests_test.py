@@ -0,0 +1,58 @@
+import unittest
+
+import codec
+import migrate_interests
+import scoring
+from backends import MemoryBackend
+from exceptions import StoreGetException
+from store import Store
+
+
+class CompactInterestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store(backend=MemoryBackend())
+        self.dictionary = scoring.InterestsDictionary(self.store)
+
+    def test_encode_interns_names(self):
+        self.assertEqual("1,2", self.dictionary.encode(["cars", "pets"]))
+        self.assertEqual("2,3", self.dictionary.encode(["pets", "книги"]))
+        self.assertEqual({"1": "cars", "2": "pets", "3": "книги"},
+                         self.store.backend.hgetall(scoring.INTERESTS_DICT_KEY))
+        # a new process picks up existing codes
+        self.assertEqual("3,4", scoring.InterestsDictionary(self.store).encode(["книги", "tv"]))
+
+    def test_read_both_layouts(self):
+        scoring.set_interests_compact(self.store, self.dictionary, {1: ["cars", "pets"], 250: []})
+        self.store.backend.set(scoring.interests_key(2), '["tv"]')
+        reader = scoring.InterestsDictionary(self.store)
+        self.assertEqual({1: ["cars", "pets"], 2: ["tv"], 250: []},
+                         scoring.get_interests_many(self.store, [1, 2, 250], reader))
+        raw = scoring.get_interests_raw(self.store, [1, 2, 250], dictionary=reader)
+        self.assertEqual({"1": ["cars", "pets"], "2": ["tv"], "250": []}, codec.loads(raw.data))
+        with self.assertRaises(StoreGetException):
+            scoring.get_interests_many(self.store, [3], reader)
+
+    def test_unknown_code(self):
+        self.store.backend.hset_many({"ib:0": {"1": "7"}})
+        with self.assertRaises(StoreGetException):
+            self.dictionary.decode("7")
+
+
+class MigrateInterestsTest(unittest.TestCase):
+
+    def test_migrate(self):
+        store = Store(backend=MemoryBackend())
+        store.backend.set_many({scoring.interests_key(cid): codec.dumps(["cars", str(cid)]) for cid in range(5)})
+        store.backend.set_many({scoring.interests_key("x"): '["cars"]', scoring.interests_key(9): '{"a": 1}'})
+        with self.assertLogs(level='INFO'):
+            migrated, skipped = migrate_interests.migrate(store, batch_size=2, delete=True)
+        self.assertEqual((5, 2), (migrated, skipped))
+        self.assertIsNone(store.backend.get(scoring.interests_key(0)))
+        self.assertEqual('["cars"]', store.backend.get(scoring.interests_key("x")))
+        self.assertEqual({cid: ["cars", str(cid)] for cid in range(5)},
+                         scoring.get_interests_many(store, list(range(5)), scoring.InterestsDictionary(store)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import Mock, patch
+
+from overload import OverloadController
+
+
+class OverloadControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Mock(return_value=100.0)
+
+    def test_in_flight(self):
+        overload = OverloadController(max_in_flight=2)
+        overload.enter()
+        self.assertIsNone(overload.check())
+        overload.enter()
+        self.assertEqual("in_flight", overload.check())
+        overload.leave(0.01)
+        self.assertIsNone(overload.check())
+
+    def test_queue_wait(self):
+        overload = OverloadController(max_queue_wait=0.1)
+        server = Mock()
+        server.queue_wait.return_value = 0.05
+        self.assertIsNone(overload.check(server))
+        server.queue_wait.return_value = 0.2
+        self.assertEqual("queue_wait", overload.check(server))
+        # a server without a connection queue
+        self.assertIsNone(overload.check(object()))
+
+    @patch('overload.random.random')
+    def test_latency(self, random):
+        overload = OverloadController(max_p99=0.1, window=10, refresh_interval=1, clock=self.clock)
+        for _ in range(100):
+            overload.enter()
+            overload.leave(0.01)
+        random.return_value = 0.5
+        self.assertIsNone(overload.check())
+        for _ in range(10):
+            overload.enter()
+            overload.leave(0.3)
+        # recomputed only after refresh_interval
+        self.assertIsNone(overload.check())
+        self.clock.return_value = 101.0
+        self.assertEqual("latency", overload.check())
+        self.assertAlmostEqual(0.3, overload.p99)
+        # a share of requests still gets through
+        random.return_value = 0.95
+        self.assertIsNone(overload.check())
+        # old samples leave the window
+        self.clock.return_value = 120.0
+        random.return_value = 0.5
+        self.assertIsNone(overload.check())
+        self.assertEqual(0, overload.p99)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import unittest
+from unittest.mock import Mock
+
+from ratelimit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Mock(return_value=100.0)
+        self.limiter = RateLimiter(rate=10, burst=20, max_concurrency={"clients_interests": 1}, slots=16,
+                                   probes=4, workers=2, clock=self.clock)
+
+    def test_token_bucket(self):
+        self.assertEqual(0, self.limiter.take("a/1", 15))
+        self.assertAlmostEqual(1.0, self.limiter.take("a/1", 15))
+        self.assertEqual(0, self.limiter.take("b/1", 15))
+        self.clock.return_value = 101.0
+        self.assertEqual(0, self.limiter.take("a/1", 15))
+        self.clock.return_value = 1000.0
+        # refills up to the burst only, a larger cost takes the whole bucket
+        self.assertEqual(0, self.limiter.take("a/1", 100))
+        self.assertAlmostEqual(0.1, self.limiter.take("a/1", 1))
+
+    def test_full_table_hands_over_least_recently_used(self):
+        for i in range(100):
+            self.clock.return_value = 100.0 + i
+            self.limiter.take(f"a/{i}", 20)
+        self.assertEqual(0, self.limiter.take("new", 20))
+
+    def test_concurrency(self):
+        self.assertEqual((0, None), self.limiter.admit("a/1", "clients_interests"))
+        self.assertEqual((1, "concurrency"), self.limiter.admit("b/1", "clients_interests"))
+        self.assertEqual((0, None), self.limiter.admit("b/1", "online_score"))
+        self.limiter.leave("clients_interests")
+        self.assertEqual((0, None), self.limiter.admit("b/1", "clients_interests"))
+
+    def test_rate_limited_request_frees_its_slot(self):
+        wait, limit = self.limiter.admit("a/1", "clients_interests", 30)
+        self.assertEqual((0, None), (wait, limit))
+        self.limiter.leave("clients_interests")
+        wait, limit = self.limiter.admit("a/1", "clients_interests", 10)
+        self.assertEqual("rate", limit)
+        self.assertAlmostEqual(1.0, wait)
+        self.assertEqual(0, self.limiter.in_flight("clients_interests"))
+
+    def test_without_rate(self):
+        limiter = RateLimiter(rate=0, max_concurrency={"online_score": 1})
+        self.assertEqual((0, None), limiter.admit("a/1", "online_score", 10 ** 6))
+
+    def test_shared_with_forked_workers(self):
+        pid = os.fork()
+        if not pid:
+            self.limiter.take("a/1", 20)
+            self.limiter.enter("clients_interests")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertAlmostEqual(0.1, self.limiter.take("a/1", 1))
+        self.assertFalse(self.limiter.enter("clients_interests"))
+
+    def test_forget_drops_slots_of_an_exited_worker(self):
+        pid = os.fork()
+        if not pid:
+            self.limiter.enter("clients_interests")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(1, self.limiter.in_flight("clients_interests"))
+        self.limiter.forget(pid)
+        self.assertEqual(0, self.limiter.in_flight("clients_interests"))
+        self.assertTrue(self.limiter.enter("clients_interests"))
+
+    def test_row_of_a_dead_worker_is_reused(self):
+        limiter = RateLimiter(rate=0, max_concurrency={"clients_interests": 1}, workers=1)
+        pid = os.fork()
+        if not pid:
+            limiter.enter("clients_interests")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertTrue(limiter.enter("clients_interests"))
+        self.assertEqual(1, limiter.in_flight("clients_interests"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch, Mock
+
+import codec
+import scoring
+from tests.decorators import cases
+
+
+class ScoringTest(unittest.TestCase):
+
+    def test_score_ttl_is_jittered_down(self):
+        ttls = {scoring.score_ttl() for _ in range(100)}
+        self.assertTrue(all(scoring.SCORE_TTL * (1 - scoring.SCORE_TTL_JITTER) <= t <= scoring.SCORE_TTL
+                            for t in ttls))
+        self.assertGreater(len(ttls), 1)
+
+    @cases([
+        ("3.0", (3.0, None, 0.0)),
+        (777, (777.0, None, 0.0)),
+        ("4.5 1000.000 0.002000", (4.5, 1000.0, 0.002)),
+    ])
+    def test_unpack_score(self, value, expected):
+        self.assertEqual(expected, scoring.unpack_score(value))
+
+    @patch('scoring.time.time', return_value=1000)
+    def test_pack_score(self, _):
+        self.assertEqual((1.5, 1060.0, 0.25), scoring.unpack_score(scoring.pack_score(1.5, 60, 0.25)))
+
+    @patch('scoring.random.random', return_value=0.5)
+    @patch('scoring.time.time', return_value=1000)
+    def test_should_refresh(self, *_):
+        # -log(0.5) ~ 0.69 compute times before expiry
+        self.assertFalse(scoring.should_refresh(1000.8, 1.0))
+        self.assertTrue(scoring.should_refresh(1000.6, 1.0))
+        self.assertFalse(scoring.should_refresh(None, 1.0))
+        # compute times below SCORE_RECOMPUTE_COST count as SCORE_RECOMPUTE_COST
+        self.assertFalse(scoring.should_refresh(1000.8, 0.000005))
+        self.assertTrue(scoring.should_refresh(1000.6, 0.000005))
+
+    @patch('scoring.time.time', return_value=1000)
+    def test_refresh_probability_rises_near_expiry(self, _):
+        def share(left):
+            return sum(scoring.should_refresh(1000 + left, 0.000005) for _ in range(2000)) / 2000
+
+        shares = [share(left) for left in (60, 3, 1, 0.1)]
+        self.assertEqual(0, shares[0])
+        self.assertEqual(sorted(shares), shares)
+        self.assertGreater(shares[-1], 0.8)
+
+    def test_score_key_is_versioned(self):
+        # workers that cache bare scores under "uid:<md5>" never read the new values
+        self.assertTrue(scoring.score_key("79175002040").startswith("uid:v2:"))
+
+    def test_get_score_hit_and_early_refresh(self):
+        store = Mock()
+        store.cache_get.return_value = scoring.pack_score(2.5, 3600, 0.001)
+        self.assertEqual(2.5, scoring.get_score(store, "79175002040", "stupnikov@otus.ru"))
+        store.cache_set.assert_not_called()
+        with patch('scoring.should_refresh', return_value=True):
+            self.assertEqual(3.0, scoring.get_score(store, "79175002040", "stupnikov@otus.ru"))
+        key, value, ttl = store.cache_set.call_args.args
+        self.assertEqual(3.0, scoring.unpack_score(value)[0])
+        self.assertLessEqual(ttl, scoring.SCORE_TTL)
+
+    def test_compute_scores_match_compute_score(self):
+        records = [
+            ("79175002040", "a@b", "01.01.2000", 1, "a", "b"),
+            ("79175002040", None, "01.01.2000", 0, "a", None),
+            (None, None, None, None, None, None),
+            (None, "a@b", "01.01.2000", 2, None, "b"),
+        ]
+        expected = [scoring.compute_score(*record) for record in records]
+        self.assertEqual(expected, scoring.compute_scores(*zip(*records)))
+
+    def test_get_interests_raw(self):
+        store = Mock()
+        store.get_many.side_effect = lambda keys: {"i:1": '["cars", "pets"]', "i:2": '[]'}
+        raw = scoring.get_interests_raw(store, [1, 2, 1])
+        store.get_many.assert_called_once_with(["i:1", "i:2"])
+        self.assertEqual(codec.RawJSON(b'{"1":["cars", "pets"],"2":[]}'), raw)
+        self.assertEqual({"response": {"1": ["cars", "pets"], "2": []}},
+                         codec.loads(codec.dumps({"response": raw})))
+
+    def test_validate_interests_sampled(self):
+        with self.assertRaises(codec.DecodeError):
+            scoring.validate_interests(['["cars"'], validate_rate=1.0)
+        self.assertEqual(['["cars"'], scoring.validate_interests(['["cars"'], validate_rate=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
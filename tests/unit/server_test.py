@@ -0,0 +1,199 @@
+import http.client
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import api
+from overload import OverloadController
+from server import ReusePortHTTPServer, ThreadPoolHTTPServer, QueueWaitTracker, PreforkServer
+
+
+class ThreadPoolHTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadPoolHTTPServer(('127.0.0.1', 0), api.MainHTTPHandler, threads=4)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, method, path):
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def test_concurrent_health_requests(self):
+        codes = []
+        threads = [threading.Thread(target=lambda: codes.append(self.request('GET', '/_health/'))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([api.OK] * 8, codes)
+
+    def test_unknown_path(self):
+        self.assertEqual(api.NOT_FOUND, self.request('GET', '/unknown/'))
+
+    def test_keep_alive(self):
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            for path in ('/_health/', '/unknown/', '/_health/'):
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                self.assertIsNotNone(response.getheader('Content-Length'))
+                self.assertFalse(response.will_close)
+            conn.request('POST', '/method/', body=b'{not json')
+            response = conn.getresponse()
+            self.assertEqual(api.BAD_REQUEST, response.status)
+            self.assertEqual(api.BAD_REQUEST, json.loads(response.read())['code'])
+            self.assertRegex(response.getheader('Server-Timing'), r"^read;dur=[\d.]+, parse;dur=[\d.]+, total;dur=")
+            self.assertFalse(response.will_close)
+        finally:
+            conn.close()
+
+    def test_max_requests_per_connection(self):
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            with patch.object(api.MainHTTPHandler, 'max_requests_per_connection', 2):
+                conn.request('GET', '/_health/')
+                response = conn.getresponse()
+                response.read()
+                self.assertFalse(response.will_close)
+                conn.request('GET', '/_health/')
+                response = conn.getresponse()
+                response.read()
+                self.assertTrue(response.will_close)
+        finally:
+            conn.close()
+
+    def test_idle_connections_leave_a_thread_free(self):
+        conns = [http.client.HTTPConnection(*self.server.server_address, timeout=5) for _ in range(4)]
+        try:
+            will_close = []
+            for conn in conns:
+                conn.request('GET', '/_health/')
+                response = conn.getresponse()
+                response.read()
+                will_close.append(response.will_close)
+            self.assertEqual([False, False, False, True], will_close)
+            started = time.monotonic()
+            self.assertEqual(api.OK, self.request('GET', '/_health/'))
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def test_overloaded_server_sheds_method_requests(self):
+        overload = OverloadController(max_in_flight=1)
+        overload.enter()
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            with patch.object(api.MainHTTPHandler, 'overload', overload):
+                conn.request('POST', '/method/', body=b'{"not": "parsed"')
+                response = conn.getresponse()
+                self.assertEqual(api.SERVICE_UNAVAILABLE, response.status)
+                self.assertEqual('1', response.getheader('Retry-After'))
+                self.assertEqual(api.SERVICE_UNAVAILABLE, json.loads(response.read())['code'])
+                self.assertFalse(response.will_close)
+                conn.request('GET', '/_health/')
+                response = conn.getresponse()
+                response.read()
+                self.assertEqual(api.OK, response.status)
+                overload.leave(0.01)
+                conn.request('POST', '/method/', body=b'{not json')
+                response = conn.getresponse()
+                response.read()
+                self.assertEqual(api.BAD_REQUEST, response.status)
+        finally:
+            conn.close()
+
+
+class SingleThreadHTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ReusePortHTTPServer(('127.0.0.1', 0), api.MainHTTPHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_idle_client_does_not_block_others(self):
+        idle = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        other = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            idle.request('GET', '/_health/')
+            response = idle.getresponse()
+            response.read()
+            self.assertTrue(response.will_close)
+            started = time.monotonic()
+            other.request('GET', '/_health/')
+            response = other.getresponse()
+            response.read()
+            self.assertEqual(api.OK, response.status)
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            idle.close()
+            other.close()
+
+
+class QueueWaitTrackerTest(unittest.TestCase):
+
+    @patch('time.monotonic')
+    def test_oldest_wait(self, monotonic):
+        monotonic.return_value = 100
+        tracker = QueueWaitTracker(clock=monotonic)
+        self.assertEqual(0, tracker.oldest_wait())
+        first = tracker.add()
+        monotonic.return_value = 101
+        second = tracker.add()
+        monotonic.return_value = 103
+        self.assertEqual(3, tracker.oldest_wait())
+        tracker.remove(first)
+        self.assertEqual(2, tracker.oldest_wait())
+        tracker.remove(second)
+        self.assertEqual(0, tracker.oldest_wait())
+
+
+class PreforkServerTest(unittest.TestCase):
+
+    @patch.object(PreforkServer, 'RESPAWN_BACKOFF', 0.01)
+    @patch('server.make_server', side_effect=OSError("Address already in use"))
+    def test_master_stops_when_workers_fail_to_start(self, _):
+        server = PreforkServer("localhost", 0, api.MainHTTPHandler, workers=2, max_failures=3)
+        with self.assertLogs(level='ERROR') as logs:
+            server.serve_forever()
+        self.assertTrue(server.failed)
+        self.assertEqual({}, server._children)
+        self.assertIn("respawning in 0.0", logs.output[0])
+        self.assertIn("3 workers in a row failed to start", logs.output[-1])
+
+    @patch('server.time.monotonic', return_value=100)
+    def test_respawn_backoff(self, monotonic):
+        def sleep(seconds):
+            monotonic.return_value += seconds
+
+        server = PreforkServer("localhost", 0, api.MainHTTPHandler, max_failures=3)
+        with patch.object(server, 'spawn') as spawn, patch('server.time.sleep', side_effect=sleep), \
+                self.assertLogs(level='ERROR') as logs:
+            for pid, failed_to_start in enumerate([True, True, False, True, True, True]):
+                started = monotonic.return_value - (1 if failed_to_start else 60)
+                self.assertEqual(pid < 5, server.respawn(pid, 256, started))
+        self.assertEqual(5, spawn.call_count)
+        # a worker that served for a while resets the count
+        self.assertEqual(["0.5s", "1.0s", "0.0s", "0.5s", "1.0s"], [line.rsplit(" ", 1)[1] for line in logs.output[:5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import snapshot
+from backends import MemoryBackend, RedisBackend
+from exceptions import ValidationError
+from store import Store, CircuitBreaker, RetryBudget
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "interests.snap")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_build_and_lookup(self):
+        records = [(5, ["cars"]), (-1, []), (3, ["книги", "pets"]), (100, ["tv"])]
+        self.assertEqual(4, snapshot.build(iter(records), self.path))
+        snap = snapshot.Snapshot(self.path)
+        self.assertEqual([-1, 3, 5, 100], list(snap.ids))
+        self.assertEqual('["книги","pets"]'.encode('utf-8'), bytes(snap.get(3)))
+        self.assertEqual(b'[]', bytes(snap.get(-1)))
+        self.assertIsNone(snap.get(4))
+        self.assertIsNone(snap.get(1000))
+
+    def test_empty_snapshot(self):
+        snapshot.build([], self.path)
+        self.assertIsNone(snapshot.Snapshot(self.path).get(1))
+
+    def test_truncated_snapshot(self):
+        snapshot.build([(1, ["cars"]), (2, ["pets"])], self.path)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        for size in (4, snapshot.HEADER.size + 8, len(data) - 1):
+            with open(self.path, "wb") as f:
+                f.write(data[:size])
+            with self.assertRaises(ValueError):
+                snapshot.Snapshot(self.path)
+
+    def test_duplicate_client(self):
+        with self.assertRaises(ValidationError):
+            snapshot.build([(1, []), (1, [])], self.path)
+        self.assertEqual([], os.listdir(self.dir.name))
+
+    def test_backend_reads_snapshot_first(self):
+        snapshot.build([(1, ["cars"]), (2, ["pets"])], self.path)
+        memory = MemoryBackend()
+        memory.set_many({"i:3": '["tv"]', "uid:1": "3.0"})
+        store = Store(backend=snapshot.SnapshotBackend(self.path, memory))
+        self.assertEqual({"i:1": '["cars"]', "i:3": '["tv"]', "i:4": None},
+                         store.cache_get_many(["i:1", "i:3", "i:4"]))
+        self.assertEqual('["pets"]', store.cache_get("i:2"))
+        self.assertEqual("3.0", store.cache_get("uid:1"))
+        store.cache_set("uid:2", 1.5)
+        self.assertEqual("1.5", memory.get("uid:2"))
+
+    def test_snapshot_hits_without_backend(self):
+        snapshot.build([(1, ["cars"]), (2, ["pets"])], self.path)
+        unreachable = RedisBackend(port=1, socket_timeout=0.05)
+        store = Store(backend=snapshot.SnapshotBackend(self.path, unreachable),
+                      breaker=CircuitBreaker(failure_threshold=1), retry_budget=RetryBudget(max_tokens=0))
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual({"i:1": '["cars"]', "i:2": '["pets"]', "i:3": None},
+                             store.cache_get_many(["i:1", "i:2", "i:3"]))
+        self.assertEqual(CircuitBreaker.OPEN, store.breaker.state)
+        # the breaker is open, hits are still served and only misses degrade
+        self.assertEqual({"i:2": '["pets"]', "i:4": None}, store.cache_get_many(["i:2", "i:4"]))
+        self.assertEqual('["cars"]', store.cache_get("i:1"))
+
+    @patch('snapshot.time.monotonic')
+    def test_hot_swap(self, monotonic):
+        monotonic.return_value = 100
+        snapshot.build([(1, ["cars"])], self.path)
+        backend = snapshot.SnapshotBackend(self.path, MemoryBackend(), check_interval=1)
+        old = backend.snapshot
+        snapshot.build([(1, ["pets"]), (2, ["tv"])], self.path)
+        self.assertEqual('["cars"]', backend.get("i:1"))
+        monotonic.return_value = 101
+        with self.assertLogs(level='INFO'):
+            self.assertEqual(['["pets"]', '["tv"]'], backend.get_many(["i:1", "i:2"]))
+        # readers holding the old snapshot keep working
+        self.assertEqual(b'["cars"]', bytes(old.get(1)))
+
+    @patch('snapshot.time.monotonic')
+    def test_broken_snapshot_keeps_the_old_one(self, monotonic):
+        monotonic.return_value = 100
+        snapshot.build([(1, ["cars"])], self.path)
+        backend = snapshot.SnapshotBackend(self.path, MemoryBackend(), check_interval=1)
+        with open(self.path + ".new", "wb") as f:
+            f.write(b"garbage garbage garbage")
+        os.replace(self.path + ".new", self.path)
+        monotonic.return_value = 101
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual('["cars"]', backend.get("i:1"))
+        with open(self.path + ".new", "wb") as f:
+            f.write(b"ISNAP")
+        os.replace(self.path + ".new", self.path)
+        monotonic.return_value = 102
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual('["cars"]', backend.get("i:1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
+import socket
+import time
 import unittest
+from unittest.mock import patch
 
-from store import Store
+from redis.exceptions import ConnectionError, ResponseError
+
+import metrics
+from backends import MemoryBackend
+from exceptions import StoreGetException, CircuitOpenError, DeadlineExceeded
+from store import Store, CircuitBreaker, RetryBudget
+from timing import request_context
 
 
 class StoreTest(unittest.TestCase):
@@ -16,6 +25,23 @@ class StoreTest(unittest.TestCase):
         self.assertTrue('Connection refused' in str(exp.exception))
         self.assertTrue('Retrying in' in '\n'.join(cm.output))
 
+    def test_get_many_chunks_in_one_pipeline(self):
+        store = Store(chunk_size=2)
+        keys = ['k1', 'k2', 'k3']
+        with patch.object(store.backend.client, 'pipeline') as pipeline:
+            pipeline.return_value.execute.return_value = [['v1', 'v2'], [None]]
+            values = store.cache_get_many(keys)
+        self.assertEqual({'k1': 'v1', 'k2': 'v2', 'k3': None}, values)
+        pipe = pipeline.return_value
+        self.assertEqual([(['k1', 'k2'],), (['k3'],)], [c.args for c in pipe.mget.call_args_list])
+        pipe.execute.assert_called_once()
+
+    def test_get_many_reports_missing_keys(self):
+        with patch.object(self.store, 'get_many_with_retry', return_value=['v1', None, '']):
+            with self.assertRaises(StoreGetException) as exp:
+                self.store.get_many(['k1', 'k2', 'k3'])
+        self.assertIn('k2, k3', str(exp.exception))
+
     def test_get_with_retry(self):
         with self.assertLogs(level='INFO') as cm:
             with self.assertRaises(Exception) as exp:
@@ -23,3 +49,160 @@ class StoreTest(unittest.TestCase):
 
         self.assertTrue('Connection refused' in str(exp.exception))
         self.assertTrue('Retrying in' in '\n'.join(cm.output))
+
+    def test_breaker_fails_fast_when_open(self):
+        store = Store(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        with patch.object(store.backend.client, 'get', side_effect=ConnectionError('Connection refused')) as get:
+            self.assertIsNone(store.cache_get('key'))
+            self.assertEqual(CircuitBreaker.OPEN, store.breaker.state)
+            calls = get.call_count
+            with self.assertRaises(CircuitOpenError):
+                store.get_with_retry('key')
+            self.assertIsNone(store.cache_get('key'))
+        self.assertEqual(calls, get.call_count)
+
+    @patch('store.time.monotonic')
+    def test_breaker_half_open_probe(self, monotonic):
+        monotonic.return_value = 100
+        changes = []
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5,
+                                 on_state_change=[lambda old, new: changes.append(new)])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        monotonic.return_value = 105
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertEqual([CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED], changes)
+
+    def in_request(self, seconds_left):
+        token = request_context.set({"deadline": time.monotonic() + seconds_left})
+        self.addCleanup(request_context.reset, token)
+
+    def test_no_call_after_deadline(self):
+        self.in_request(-1)
+        store = Store(backend=MemoryBackend())
+        with patch.object(store.backend, 'get') as get:
+            with self.assertRaises(DeadlineExceeded):
+                store.get_with_retry('key')
+            self.assertIsNone(store.cache_get('key'))
+        get.assert_not_called()
+        with self.assertRaises(DeadlineExceeded):
+            store.get_many(['key'])
+
+    def test_no_retry_past_deadline(self):
+        self.in_request(0.01)
+        with patch.object(self.store.backend.client, 'get', side_effect=ConnectionError('Connection refused')) as get:
+            with patch('store.random.uniform', return_value=0.02):
+                with self.assertRaises(ConnectionError):
+                    self.store.get_with_retry('key')
+        self.assertEqual(1, get.call_count)
+
+    def test_socket_timeout_follows_deadline(self):
+        # a server that accepts connections and never replies
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        self.addCleanup(server.close)
+        store = Store(port=server.getsockname()[1], breaker=CircuitBreaker(failure_threshold=2))
+        for _ in range(3):
+            self.in_request(0.05)
+            started = time.monotonic()
+            with self.assertLogs(level='ERROR'):
+                self.assertIsNone(store.cache_get('key'))
+            self.assertLess(time.monotonic() - started, 1)
+        # running out of the request's own time is not a backend failure
+        self.assertEqual(CircuitBreaker.CLOSED, store.breaker.state)
+        self.assertEqual(0, store.breaker.failures)
+
+    def test_connect_timeout_follows_deadline(self):
+        timeouts = []
+
+        class UnreachableSocket(socket.socket):
+            def connect(self, address):
+                timeouts.append(self.gettimeout())
+                raise socket.timeout("timed out")
+
+        store = Store(port=1)
+        self.in_request(0.05)
+        with patch('redis.connection.socket.socket', UnreachableSocket):
+            with self.assertLogs(level='ERROR'):
+                self.assertIsNone(store.cache_get('key'))
+        self.assertTrue(timeouts)
+        self.assertTrue(all(timeout <= 0.05 for timeout in timeouts), timeouts)
+
+    @patch('store.time.monotonic')
+    def test_breaker_probe_failing_with_other_error(self, monotonic):
+        monotonic.return_value = 100
+        store = Store(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=5))
+        store.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, store.breaker.state)
+        monotonic.return_value = 105
+        with patch.object(store.backend.client, 'get', side_effect=ResponseError('WRONGTYPE')) as get:
+            with self.assertRaises(ResponseError):
+                store.get_with_retry('key')
+        self.assertEqual(1, get.call_count)
+        with patch.object(store.backend.client, 'get', return_value='value') as get:
+            self.assertEqual('value', store.get_with_retry('key'))
+        self.assertEqual(CircuitBreaker.CLOSED, store.breaker.state)
+
+    def test_retry_budget(self):
+        store = Store(retry_budget=RetryBudget(ratio=0.5, max_tokens=1),
+                      breaker=CircuitBreaker(failure_threshold=100))
+        with patch.object(store.backend.client, 'get', side_effect=ConnectionError('Connection refused')) as get:
+            with self.assertRaises(ConnectionError):
+                store.get_with_retry('key')
+            self.assertEqual(2, get.call_count)
+            with self.assertRaises(ConnectionError):
+                store.get_with_retry('key')
+            self.assertEqual(3, get.call_count)
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        # no writer thread, writes stay pending
+        self.store = Store(backend=MemoryBackend(), write_behind_size=2)
+        self.store.write_behind.close()
+
+    def test_writes_are_deduplicated_and_bounded(self):
+        dropped = metrics.STORE_WRITES_DROPPED.value()
+        self.store.cache_set("uid:1", 1.0, 60)
+        self.store.cache_set("uid:1", 2.0, 60)
+        self.store.cache_set_many({"uid:2": 3.0, "uid:3": 4.0}, 60)
+        self.assertEqual({"uid:1": (2.0, 60), "uid:2": (3.0, 60)}, self.store.write_behind._pending)
+        self.assertEqual(dropped + 1, metrics.STORE_WRITES_DROPPED.value())
+        self.assertEqual("2.0", self.store.cache_get("uid:1"))
+        self.assertIsNone(self.store.backend.get("uid:1"))
+
+    def test_cache_get_many_reads_pending_writes(self):
+        self.store.cache_set_many({"uid:1": 2.0}, 60)
+        self.store.backend.set("uid:2", "3.0")
+        self.assertEqual({"uid:1": "2.0", "uid:2": "3.0", "uid:3": None},
+                         self.store.cache_get_many(["uid:1", "uid:2", "uid:3"]))
+
+    def test_batch_being_flushed_stays_readable(self):
+        store = Store(backend=MemoryBackend(), write_behind_size=100)
+        seen = []
+
+        def set_many(items, ttl=None):
+            seen.append(store.cache_get_many(["uid:1"]))
+            store.backend.set_many(items, ttl)
+
+        with patch.object(store, 'set_many_with_retry', side_effect=set_many):
+            store.cache_set("uid:1", 1.0, 60)
+            store.close()
+        self.assertEqual([{"uid:1": "1.0"}], seen)
+        self.assertIsNone(store.write_behind.get("uid:1"))
+
+    def test_flushes_pending_writes_on_close(self):
+        store = Store(backend=MemoryBackend(), write_behind_size=100)
+        with patch.object(store, 'set_many_with_retry', wraps=store.set_many_with_retry) as set_many:
+            store.cache_set("uid:1", 1.0, 60)
+            store.cache_set("i:1", '["cars"]')
+            store.close()
+        self.assertEqual("1.0", store.backend.get("uid:1"))
+        self.assertEqual('["cars"]', store.backend.get("i:1"))
+        self.assertFalse(store.write_behind._thread.is_alive())
+        self.assertLessEqual(set_many.call_count, 2)
@@ -0,0 +1,60 @@
+import io
+import json
+import logging
+import unittest
+
+import tracing
+from logs import AsyncLogHandler
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(tracing.OTLPJsonFormatter())
+        self.handler = AsyncLogHandler(target)
+        tracing.trace_logger.setLevel(logging.INFO)
+        tracing.trace_logger.addHandler(self.handler)
+
+    def tearDown(self):
+        tracing.trace_logger.removeHandler(self.handler)
+
+    def test_trace_id(self):
+        request_id = "0123456789abcdef0123456789ABCDEF"
+        self.assertEqual(request_id.lower(), tracing.trace_id(request_id))
+        self.assertEqual(32, len(tracing.trace_id("req-1")))
+        self.assertEqual(tracing.trace_id("req-1"), tracing.trace_id("req-1"))
+        self.assertNotEqual("0" * 32, tracing.trace_id("0" * 32))
+
+    def test_export(self):
+        ctx = {"request_id": "req-1", "method": "online_score", "_started": 10.0,
+               "spans": [("parse", 0.0, 0.001), ("store.get", 0.002, 0.003)]}
+        tracing.Tracer.export("/method/", ctx, 200, 0.01)
+        self.handler.close()
+        request = json.loads(self.stream.getvalue())
+        spans = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root, parse, store = spans
+        self.assertEqual("POST /method/", root["name"])
+        self.assertEqual(tracing.SPAN_KIND_SERVER, root["kind"])
+        self.assertEqual({"stringValue": "online_score"},
+                         {a["key"]: a["value"] for a in root["attributes"]}["rpc.method"])
+        self.assertEqual(10 ** 7, int(root["endTimeUnixNano"]) - int(root["startTimeUnixNano"]))
+        self.assertEqual({tracing.trace_id("req-1")}, {span["traceId"] for span in spans})
+        self.assertEqual([root["spanId"]] * 2, [parse["parentSpanId"], store["parentSpanId"]])
+        self.assertEqual("store.get", store["name"])
+        self.assertEqual(2 * 10 ** 6, int(store["startTimeUnixNano"]) - int(root["startTimeUnixNano"]))
+        self.assertEqual(3 * 10 ** 6, int(store["endTimeUnixNano"]) - int(store["startTimeUnixNano"]))
+
+    def test_sampling(self):
+        tracing.Tracer.sample_rate = 0
+        try:
+            tracing.Tracer.export("/method/", {"request_id": "1"}, 200, 0.01)
+        finally:
+            tracing.Tracer.sample_rate = 1.0
+        self.handler.close()
+        self.assertEqual("", self.stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
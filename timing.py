@@ -0,0 +1,73 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from exceptions import DeadlineExceeded
+
+# ctx of the request being served by the current thread or task,
+# lets code below the handlers (store calls) report into it
+request_context = contextvars.ContextVar("request_context", default=None)
+
+# socket timeout used when the deadline has already passed, so the call fails right away
+MIN_TIMEOUT = 0.001
+
+
+def add_timing(ctx, stage, seconds):
+    timings = ctx.setdefault("timings", {})
+    timings[stage] = timings.get(stage, 0) + seconds
+
+
+def add_span(ctx, name, start, seconds):
+    """Append (name, start, duration) to ctx["spans"], start in seconds since ctx["_started"].
+
+    start is a time.perf_counter() value; the first span starts the request when
+    ctx has no "_started" yet.
+    """
+    origin = ctx.setdefault("_started", start)
+    ctx.setdefault("spans", []).append((name, start - origin, seconds))
+
+
+@contextmanager
+def timed(ctx, stage):
+    """Add time spent in the block to ctx["timings"][stage] and a span to ctx["spans"], in seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        add_timing(ctx, stage, seconds)
+        add_span(ctx, stage, start, seconds)
+
+
+def server_timing(ctx, total=None):
+    """Server-Timing header value with time per stage of ctx, and the total, in milliseconds"""
+    metrics = ["%s;dur=%.3f" % (stage, seconds * 1000) for stage, seconds in ctx.get("timings", {}).items()]
+    if total is not None:
+        metrics.append("total;dur=%.3f" % (total * 1000))
+    return ", ".join(metrics)
+
+
+def remaining(ctx=None):
+    """Seconds left until ctx["deadline"] (a time.monotonic() value), None when there is no deadline.
+
+    ctx defaults to the request being served by the current thread or task.
+    """
+    if ctx is None:
+        ctx = request_context.get()
+    if ctx is None or "deadline" not in ctx:
+        return None
+    return ctx["deadline"] - time.monotonic()
+
+
+def check_deadline(ctx=None):
+    left = remaining(ctx)
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def capped_timeout(timeout):
+    """timeout cut to the time left for the current request"""
+    left = remaining()
+    if left is None:
+        return timeout
+    return max(min(timeout, left), MIN_TIMEOUT)
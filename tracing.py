@@ -0,0 +1,109 @@
+"""Export of request spans as OpenTelemetry traces.
+
+Every finished request becomes one line of OTLP/JSON (an ExportTraceServiceRequest)
+in a local file, the format the OpenTelemetry Collector `otlpjsonfile` receiver reads.
+Lines are written by the same kind of background writer as the logs, so a full
+queue drops traces instead of slowing requests down.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+
+import codec
+from logs import AsyncLogHandler
+
+SERVICE_NAME = "scoring_api"
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+trace_logger = logging.getLogger("trace")
+trace_logger.propagate = False
+
+_TRACE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def trace_id(request_id):
+    """Request ids that are 32 hex digits (uuid4().hex) are used as is, others are hashed"""
+    request_id = str(request_id).lower()
+    if _TRACE_ID.fullmatch(request_id) and request_id.strip("0"):
+        return request_id
+    return hashlib.md5(request_id.encode('utf-8')).hexdigest()
+
+
+def span_id():
+    return os.urandom(8).hex()
+
+
+def attributes(values):
+    result = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int):
+            result.append({"key": key, "value": {"stringValue": str(value)}})
+        else:
+            result.append({"key": key, "value": {"intValue": str(value)}})
+    return result
+
+
+class OTLPJsonFormatter(logging.Formatter):
+    """Formats {"path", "ctx", "code", "end_ns", "duration"} records as OTLP/JSON trace lines"""
+
+    def format(self, record):
+        entry = record.msg
+        ctx = entry["ctx"]
+        end_ns = entry["end_ns"]
+        start_ns = end_ns - int(entry["duration"] * 1e9)
+        trace = trace_id(ctx.get("request_id", ""))
+        root_id = span_id()
+        code = entry["code"]
+        spans = [{
+            "traceId": trace,
+            "spanId": root_id,
+            "name": "POST " + entry["path"],
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": attributes({"request_id": ctx.get("request_id"), "rpc.method": ctx.get("method"),
+                                      "http.status_code": code}),
+            "status": {"code": STATUS_CODE_ERROR if code >= 500 else STATUS_CODE_OK},
+        }]
+        for name, offset, seconds in ctx.get("spans", []):
+            span_start = start_ns + int(offset * 1e9)
+            spans.append({
+                "traceId": trace,
+                "spanId": span_id(),
+                "parentSpanId": root_id,
+                "name": name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(span_start),
+                "endTimeUnixNano": str(span_start + int(seconds * 1e9)),
+            })
+        return codec.dumps({"resourceSpans": [{
+            "resource": {"attributes": attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+        }]}).decode('utf-8')
+
+
+class Tracer:
+    """Hands finished requests to the trace writer, for a sample_rate share of them"""
+    sample_rate = 1.0
+
+    @classmethod
+    def export(cls, path, ctx, code, duration):
+        if not trace_logger.handlers or not (cls.sample_rate >= 1 or random.random() < cls.sample_rate):
+            return
+        trace_logger.info({"path": path, "ctx": ctx, "code": code, "end_ns": time.time_ns(), "duration": duration})
+
+
+def setup_tracing(filename, queue_size=10000, sample_rate=1.0):
+    target = logging.FileHandler(filename)
+    target.setFormatter(OTLPJsonFormatter())
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.addHandler(AsyncLogHandler(target, queue_size=queue_size))
+    Tracer.sample_rate = sample_rate